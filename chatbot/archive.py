@@ -0,0 +1,193 @@
+"""
+Tiered storage for chat history. Sessions inactive for longer than
+ARCHIVE_INACTIVE_DAYS move from ChatSession/Message into one ArchivedSession
+row each, holding the transcript as zstd-compressed JSON, so the hot tables
+only grow with active usage. Archived transcripts stay readable through the
+history view (`?session=<uuid>`).
+"""
+import json
+import time
+from datetime import datetime, timedelta
+
+import zstandard
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import ArchivedSession, Chat, ChatSession, Message
+from .rendering import RENDER_VERSION, render_markdown
+
+TRANSCRIPT_VERSION = 1  # bump when the transcript JSON changes shape
+MESSAGE_FIELDS = ('message_id', 'role', 'content', 'content_html', 'render_version', 'model', 'timestamp')
+
+
+# ---------------------------
+#  Transcript blobs
+# ---------------------------
+def encode_transcript(messages, level=None):
+    """zstd-compressed JSON of Message value dicts (MESSAGE_FIELDS), oldest first"""
+    level = level if level is not None else getattr(settings, 'ARCHIVE_ZSTD_LEVEL', 10)
+    payload = {
+        'version': TRANSCRIPT_VERSION,
+        'messages': [
+            {
+                'id': str(msg['message_id']),
+                'role': msg['role'],
+                'content': msg['content'],
+                'content_html': msg['content_html'],
+                'render_version': msg['render_version'],
+                'model': msg['model'],
+                'timestamp': msg['timestamp'].isoformat(),
+            }
+            for msg in messages
+        ],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return zstandard.ZstdCompressor(level=level).compress(raw)
+
+
+def decode_transcript(blob):
+    """Messages of an archived transcript, oldest first, with datetime timestamps"""
+    payload = json.loads(zstandard.ZstdDecompressor().decompress(bytes(blob)))
+    if payload.get('version') != TRANSCRIPT_VERSION:
+        raise ValueError(f"Unsupported transcript version {payload.get('version')}")
+    messages = payload['messages']
+    for msg in messages:
+        msg['timestamp'] = datetime.fromisoformat(msg['timestamp'])
+    return messages
+
+
+def archived_messages(archived, limit, cursor=None):
+    """
+    Page of an archived transcript with the same keyset semantics as
+    views.get_session_messages: the newest `limit` messages older than `cursor`
+    ("isoformat|uuid"), oldest first. Returns (messages, next_cursor).
+    """
+    messages = decode_transcript(archived.transcript)
+    if cursor:
+        timestamp, message_id = cursor.split('|', 1)
+        position = (datetime.fromisoformat(timestamp), message_id)
+        messages = [msg for msg in messages if (msg['timestamp'], msg['id']) < position]
+    messages.sort(key=lambda msg: (msg['timestamp'], msg['id']))
+    page = messages[-limit:]
+    next_cursor = None
+    if len(messages) > limit:
+        next_cursor = f"{page[0]['timestamp'].isoformat()}|{page[0]['id']}"
+    for msg in page:
+        # The blob is immutable: outdated HTML is re-rendered per read, not written back
+        if msg['role'] == 'assistant' and msg['render_version'] != RENDER_VERSION:
+            msg['content_html'] = render_markdown(msg['content'])
+    return page, next_cursor
+
+
+# ---------------------------
+#  Compaction
+# ---------------------------
+def inactive_sessions(cutoff):
+    """Inactive sessions last used before `cutoff`, oldest first (session_inactive_updated_idx)"""
+    return ChatSession.objects.filter(is_active=False, updated_at__lt=cutoff).order_by('updated_at', 'session_id')
+
+
+def archive_batch(cutoff, batch_size, level=None):
+    """
+    Archive up to `batch_size` of the oldest eligible sessions in one transaction
+    and delete their hot rows. Returns (sessions, messages) archived; (0, 0) when
+    nothing is left. Archived rows leave the eligible set, so an interrupted run
+    resumes where it stopped.
+    """
+    with transaction.atomic():
+        sessions = list(inactive_sessions(cutoff)[:batch_size])
+        if not sessions:
+            return 0, 0
+        ids = [session.session_id for session in sessions]
+        transcripts = {session_id: [] for session_id in ids}
+        rows = (
+            Message.objects.filter(session_id__in=ids)
+            .order_by('session_id', 'timestamp', 'message_id')
+            .values('session_id', *MESSAGE_FIELDS)
+        )
+        for row in rows.iterator(chunk_size=2000):
+            transcripts[row['session_id']].append(row)
+
+        ArchivedSession.objects.bulk_create([
+            ArchivedSession(
+                session_id=session.session_id,
+                user_id=session.user_id,
+                created_at=session.created_at,
+                updated_at=session.updated_at,
+                summary=session.summary,
+                imported_from_legacy=session.imported_from_legacy,
+                message_count=len(transcripts[session.session_id]),
+                transcript=encode_transcript(transcripts[session.session_id], level),
+            )
+            for session in sessions
+        ])
+        messages = Message.objects.filter(session_id__in=ids).delete()[0]
+        ChatSession.objects.filter(session_id__in=ids, is_active=False).delete()
+    return len(sessions), messages
+
+
+def compact_sessions(cutoff, batch_size=200, max_batches=None, time_limit=None, level=None, progress=None):
+    """
+    Archive eligible sessions batch by batch until none are left, `max_batches`
+    batches ran or `time_limit` seconds passed. Returns (sessions, messages, done).
+    """
+    started = time.monotonic()
+    sessions = messages = batches = 0
+    while True:
+        if max_batches is not None and batches >= max_batches:
+            return sessions, messages, False
+        if time_limit is not None and time.monotonic() - started >= time_limit:
+            return sessions, messages, False
+        archived, deleted = archive_batch(cutoff, batch_size, level)
+        if not archived:
+            return sessions, messages, True
+        sessions += archived
+        messages += deleted
+        batches += 1
+        if progress:
+            progress(sessions, messages)
+
+
+# ---------------------------
+#  Legacy Chat rows
+# ---------------------------
+def compact_legacy_chats(cutoff):
+    """
+    Delete legacy Chat rows older than `cutoff` whose content already lives in
+    ChatSession/Message or the archive: everything of users whose legacy history
+    was imported (migrate_legacy_chats), and rows dual-written after a user's
+    first real session. Returns (deleted rows, users still waiting for an import).
+    """
+    imported = set(
+        ChatSession.objects.filter(imported_from_legacy=True).values_list('user_id', flat=True)
+    ) | set(
+        ArchivedSession.objects.filter(imported_from_legacy=True).values_list('user_id', flat=True)
+    )
+    first_session = {}
+    for model in (ChatSession, ArchivedSession):
+        firsts = (model.objects.filter(imported_from_legacy=False)
+                  .values('user_id').annotate(first=Min('created_at')))
+        for row in firsts:
+            current = first_session.get(row['user_id'])
+            first_session[row['user_id']] = row['first'] if current is None else min(current, row['first'])
+
+    deleted, pending = 0, 0
+    user_ids = Chat.objects.filter(created_at__lt=cutoff).values_list('user_id', flat=True).distinct()
+    for user_id in user_ids.order_by('user_id'):
+        chats = Chat.objects.filter(user_id=user_id, created_at__lt=cutoff)
+        if user_id not in imported:
+            if user_id not in first_session:
+                pending += 1
+                continue
+            if chats.filter(created_at__lt=first_session[user_id]).exists():
+                pending += 1
+            chats = chats.filter(created_at__gte=first_session[user_id])
+        deleted += chats.delete()[0]
+    return deleted, pending
+
+
+def default_cutoff(days=None):
+    days = days if days is not None else getattr(settings, 'ARCHIVE_INACTIVE_DAYS', 30)
+    return timezone.now() - timedelta(days=days)
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+USER_CACHE_VERSION = 1
+
+
+def _key(user_id):
+    return f"user:{USER_CACHE_VERSION}:{user_id}"
+
+
+def get_cache():
+    return caches[getattr(settings, 'HOT_STATE_CACHE_ALIAS', 'default')]
+
+
+def invalidate_user(user_id):
+    get_cache().delete(_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose per-request user lookup (AuthenticationMiddleware) is served
+    from the cache tier. Entries are dropped whenever the User row is saved or deleted,
+    so password changes still invalidate sessions through the session auth hash.
+    """
+
+    def get_user(self, user_id):
+        cache = get_cache()
+        user = cache.get(_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(_key(user_id), user, getattr(settings, 'USER_CACHE_TTL', 300))
+        return user
@@ -0,0 +1,182 @@
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from django.test import override_settings
+from django.utils import timezone
+
+from .models import Message
+from .rendering import message_html
+from .retrieval import BM25Index
+from .synthetic import make_pdf, synthetic_answers, synthetic_chunks, synthetic_queries
+
+RESULTS_VERSION = 1
+# A benchmark regresses when it gets slower than the baseline by more than this fraction
+DEFAULT_TOLERANCE = 0.25
+
+SIZES = {
+    'retrieval': [100, 1000, 10000],   # chunks
+    'ingestion': [10, 50, 200],        # pages
+    'rendering': [10, 100, 500],       # messages in the history
+}
+QUICK_SIZES = {
+    'retrieval': [100, 1000],
+    'ingestion': [5, 20],
+    'rendering': [10, 50],
+}
+
+
+def measure(fn, repeat=5, warmup=1):
+    """Run fn repeatedly; wall-clock stats in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'median_ms': statistics.median(samples),
+        'min_ms': samples[0],
+        'max_ms': samples[-1],
+        'repeat': repeat,
+    }
+
+
+# ---------------------------
+#  Benchmarks
+# ---------------------------
+def bench_retrieval(chunk_count, repeat):
+    """find_relevant_chunks over a prebuilt BM25 index (index build time reported separately)"""
+    from .views import find_relevant_chunks
+
+    chunks = synthetic_chunks(chunk_count)
+    queries = synthetic_queries(20)
+    started = time.perf_counter()
+    index = BM25Index.build(chunks)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    def run():
+        for query in queries:
+            find_relevant_chunks(query, chunks, top_k=3, index=index)
+
+    stats = measure(run, repeat=repeat)
+    stats['per_query_ms'] = stats['median_ms'] / len(queries)
+    stats['index_build_ms'] = build_ms
+    return stats
+
+
+class _BenchPDF:
+    """Just enough of an UploadedPDF for process_pdf; nothing is written to the DB"""
+
+    def __init__(self, path):
+        self.id = 0
+        self.content_id = None
+        self.file = SimpleNamespace(path=path, name=os.path.basename(path))
+        self.faiss_index_path = None
+
+    def save(self, **kwargs):
+        pass
+
+
+def bench_ingestion(pages, repeat):
+    """process_pdf end to end (extract, chunk, write store, build index) on a synthetic PDF"""
+    from .ingestion import process_pdf
+
+    with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp, INGESTION_PROCESSES=1):
+        pdf_path = make_pdf(os.path.join(tmp, f'synthetic_{pages}.pdf'), pages)
+        # process_pdf reports progress with print(); keep it out of the results
+        with redirect_stdout(io.StringIO()):
+            stats = measure(lambda: process_pdf(_BenchPDF(pdf_path)), repeat=repeat)
+    stats['pages_per_s'] = pages / (stats['median_ms'] / 1000)
+    return stats
+
+
+def bench_rendering(history_length, repeat):
+    """Markdown rendering of a whole history: cold (never rendered) vs stored HTML"""
+    answers = synthetic_answers(history_length)
+    now = timezone.now()
+
+    def history(render_version):
+        return [Message(role='assistant', content=a, timestamp=now, render_version=render_version) for a in answers]
+
+    def render_all(messages):
+        stale = []
+        for msg in messages:
+            message_html(msg, stale)
+
+    cold = measure(lambda: render_all(history(0)), repeat=repeat)
+    warm_history = history(0)
+    render_all(warm_history)
+    warm = measure(lambda: render_all(warm_history), repeat=repeat)
+    cold['stored_html_median_ms'] = warm['median_ms']
+    return cold
+
+
+BENCHMARKS = {
+    'retrieval': ('chunks', bench_retrieval),
+    'ingestion': ('pages', bench_ingestion),
+    'rendering': ('messages', bench_rendering),
+}
+
+
+# ---------------------------
+#  Runner / results
+# ---------------------------
+def run_benchmarks(only=None, quick=False, repeat=5, log=None):
+    """Run the suite; returns the JSON-serialisable results document"""
+    sizes = QUICK_SIZES if quick else SIZES
+    results = {}
+    for group, (unit, bench) in BENCHMARKS.items():
+        if only and group not in only:
+            continue
+        for size in sizes[group]:
+            name = f"{group}[{unit}={size}]"
+            # Big ingestion runs are slow; fewer repeats keep the suite usable
+            runs = max(1, repeat // 2) if group == 'ingestion' and size >= 100 else repeat
+            results[name] = bench(size, runs)
+            if log:
+                log(f"{name}: {results[name]['median_ms']:.2f} ms")
+    return {
+        'version': RESULTS_VERSION,
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'quick': quick,
+        'results': results,
+    }
+
+
+def write_results(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_regressions(current, baseline, tolerance=DEFAULT_TOLERANCE, metric='min_ms'):
+    """
+    [(name, baseline_ms, current_ms, ratio)] for benchmarks present in both runs
+    that got slower by more than `tolerance` (0.25 = 25%). Compared on the
+    fastest run by default: it is the least disturbed by other load on the machine.
+    """
+    regressions = []
+    for name, stats in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before or not before.get(metric):
+            continue
+        ratio = stats[metric] / before[metric]
+        if ratio > 1 + tolerance:
+            regressions.append((name, before[metric], stats[metric], ratio))
+    return regressions
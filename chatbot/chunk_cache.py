@@ -0,0 +1,225 @@
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics, vectors
+from .chunk_store import open_chunks
+from .retrieval import MergedIndex, load_index, rerank
+
+
+class ChunkSet:
+    """Chunks (ChunkStore / TextChunks) of one UploadedPDF plus the retrieval structures derived from them"""
+
+    def __init__(self, path, chunks, index, signature, vectors=None):
+        self.path = path
+        self.chunks = chunks
+        self.index = index
+        self.signature = signature
+        # Memory-mapped chunk vectors (dense mode); page cache, not counted in nbytes
+        self.vectors = vectors
+        self.nbytes = estimate_size(chunks, index)
+
+
+def estimate_size(chunks, index):
+    """Rough resident size of a chunk set, used against the cache budget"""
+    size = chunks.resident_bytes
+    if index is not None:
+        # ~ one small list per posting plus the term keys
+        size += sum(len(term) + 56 + 72 * len(postings) for term, postings in index.postings.items())
+        size += 8 * len(index.doc_lens)
+    return size
+
+
+def file_signature(path):
+    """(mtime_ns, size) of the chunks file; None when it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+# ---------------------------
+#  Per-worker LRU cache
+# ---------------------------
+class ChunkCache:
+    """
+    In-process LRU cache of ChunkSets keyed by chunk store path, so uploads
+    sharing deduplicated content share one entry.
+    Entries are revalidated against the chunks file's (mtime, size) and evicted
+    least-recently-used first once the memory budget is exceeded.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, pdf_obj):
+        """Return the ChunkSet for pdf_obj, loading it from disk on a miss"""
+        path = pdf_obj.faiss_index_path
+        if not path:
+            return None
+        signature = file_signature(path)
+        if signature is None:
+            self.invalidate(path)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Binary stores are mmapped (chunk text is read on demand); legacy .txt is read whole
+        with metrics.span('chunk_load'):
+            chunks = open_chunks(path)
+            index = load_index(path, chunks) if len(chunks) else None
+            matrix = vectors.load_vectors(path, chunks) if len(chunks) and vectors.enabled() else None
+        entry = ChunkSet(path, chunks, index, signature, matrix)
+        self.put(entry)
+        return entry
+
+    def put(self, entry):
+        with self._lock:
+            old = self._entries.pop(entry.path, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            if entry.nbytes > self.max_bytes:
+                # Never cache something larger than the whole budget
+                return
+            self._entries[entry.path] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, path):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+chunk_cache = ChunkCache(getattr(settings, 'CHUNK_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+# ---------------------------
+#  Per-user merged index
+# ---------------------------
+class RetrievedChunk:
+    def __init__(self, pdf, chunk_id, text, score, span=None):
+        self.pdf = pdf
+        self.pdf_id = pdf.id
+        self.chunk_id = chunk_id
+        self.text = text
+        self.score = score
+        self.span = span  # (page_start, page_end, start, end) in the document, None if unknown
+
+
+class UserIndexRegistry:
+    """
+    One MergedIndex per user (LRU over users), kept in step with the user's
+    ready PDFs: documents that appear, disappear or whose chunks file changed
+    are added/removed individually instead of rebuilding the whole index.
+    """
+
+    def __init__(self, max_users, cache=chunk_cache):
+        self.max_users = max_users
+        self.cache = cache
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sync(self, user_id, chunk_sets):
+        with self._lock:
+            merged = self._indexes.get(user_id)
+            if merged is None:
+                merged = self._indexes[user_id] = MergedIndex()
+                while len(self._indexes) > self.max_users:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(user_id)
+
+            for pdf_id in set(merged.docs) - set(chunk_sets):
+                merged.remove(pdf_id)
+            for pdf_id, chunk_set in chunk_sets.items():
+                if merged.signature(pdf_id) != chunk_set.signature:
+                    merged.add(pdf_id, chunk_set.signature, chunk_set.index)
+            return merged
+
+    def search(self, user_id, pdfs, query, top_k=3, rerank_candidates=None):
+        """Top-k RetrievedChunks for `query` across all of the given (ready) PDFs"""
+        if rerank_candidates is None:
+            rerank_candidates = getattr(settings, "RAG_RERANK_CANDIDATES", 0)
+        by_id = {pdf.id: pdf for pdf in pdfs}
+        chunk_sets = {}
+        seen = set()
+        for pdf in pdfs:
+            # Several uploads of the same content share one store; search it once
+            if pdf.faiss_index_path in seen:
+                continue
+            seen.add(pdf.faiss_index_path)
+            chunk_set = self.cache.get(pdf)
+            if chunk_set is not None and chunk_set.index is not None:
+                chunk_sets[pdf.id] = chunk_set
+
+        merged = self._sync(user_id, chunk_sets)
+        dense = {
+            pdf_id: chunk_set.vectors for pdf_id, chunk_set in chunk_sets.items()
+            if chunk_set.vectors is not None
+        }
+        if vectors.enabled() and dense:
+            candidates = vectors.search(query, dense, k=max(top_k, rerank_candidates))
+        else:
+            candidates = merged.search(
+                query,
+                {pdf_id: chunk_set.index for pdf_id, chunk_set in chunk_sets.items()},
+                top_k=max(top_k, rerank_candidates),
+            )
+
+        def get_text(key):
+            pdf_id, chunk_id = key
+            return chunk_sets[pdf_id].chunks[chunk_id]
+
+        if rerank_candidates:
+            candidates = rerank(query, candidates, get_text)
+        return [
+            RetrievedChunk(
+                by_id[pdf_id], chunk_id, get_text((pdf_id, chunk_id)), score, chunk_sets[pdf_id].chunks.span(chunk_id)
+            )
+            for score, (pdf_id, chunk_id) in candidates[:top_k]
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+user_indexes = UserIndexRegistry(getattr(settings, 'USER_INDEX_MAX_USERS', 256))
@@ -0,0 +1,284 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from collections import OrderedDict
+
+import zstandard
+
+from .chunking import Chunk
+from .retrieval import CHUNK_SEPARATOR, temp_path_for
+
+# ---------------------------
+#  Binary chunk store format
+# ---------------------------
+# [header][block 0][block 1]...[chunk table][block table], all little-endian.
+#   header       magic, version, flags, chunk_count, chunks_per_block, block_count,
+#                chunk_table_offset, block_table_offset
+#   chunk table  per chunk: offset + length of its UTF-8 text inside its block,
+#                page_start, page_end, start, end (see chunking.Chunk)
+#   block table  per block: file offset, stored length, raw length
+# Chunk i lives in block i // chunks_per_block. Blocks are stored raw, or
+# zstd-compressed one by one when FLAG_ZSTD is set, so reading one chunk only
+# touches (and at most decompresses) its own block.
+MAGIC = b"CHNK"
+FORMAT_VERSION = 1
+FLAG_ZSTD = 0x1
+HEADER = struct.Struct("<4sHHIIIQQ")
+CHUNK_ENTRY = struct.Struct("<IIIIQQ")
+BLOCK_ENTRY = struct.Struct("<QII")
+CHUNKS_PER_BLOCK = 32
+CHUNK_STORE_EXT = ".chunks"
+
+
+def spans_path_for(chunks_path):
+    """Legacy chunks_12.txt -> chunks_12.spans.json: [page_start, page_end, start, end] per chunk"""
+    root, _ = os.path.splitext(chunks_path)
+    return f"{root}.spans.json"
+
+
+def chunk_store_path_for(chunks_path):
+    root, _ = os.path.splitext(chunks_path)
+    return f"{root}{CHUNK_STORE_EXT}"
+
+
+# ---------------------------
+#  Writer (streaming)
+# ---------------------------
+class ChunkWriter:
+    """
+    Appends chunks to a binary chunk store as they are produced, one block at a
+    time. Everything goes to a temp file that replaces the real one only on a
+    clean close, so a failed ingestion never leaves a half-written store behind.
+    """
+
+    def __init__(self, path, compress=False, chunks_per_block=CHUNKS_PER_BLOCK):
+        self.path = path
+        self.count = 0
+        self.compress = compress
+        self.chunks_per_block = chunks_per_block
+        self._entries = []
+        self._blocks = []
+        self._block = []
+        self._compressor = zstandard.ZstdCompressor(level=3) if compress else None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._tmp_path = temp_path_for(path)
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(b"\0" * HEADER.size)  # rewritten on close
+
+    def write(self, chunk):
+        self._block.append(chunk)
+        self.count += 1
+        if len(self._block) >= self.chunks_per_block:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        payload = bytearray()
+        for chunk in self._block:
+            data = chunk.text.encode('utf-8')
+            self._entries.append(CHUNK_ENTRY.pack(
+                len(payload), len(data), chunk.page_start, chunk.page_end, chunk.start, chunk.end
+            ))
+            payload += data
+        stored = self._compressor.compress(bytes(payload)) if self._compressor else payload
+        self._blocks.append(BLOCK_ENTRY.pack(self._file.tell(), len(stored), len(payload)))
+        self._file.write(stored)
+        self._block = []
+
+    def close(self):
+        self._flush_block()
+        chunk_table_offset = self._file.tell()
+        self._file.write(b"".join(self._entries))
+        block_table_offset = self._file.tell()
+        self._file.write(b"".join(self._blocks))
+        self._file.seek(0)
+        self._file.write(HEADER.pack(
+            MAGIC, FORMAT_VERSION, FLAG_ZSTD if self.compress else 0, self.count,
+            self.chunks_per_block, len(self._blocks), chunk_table_offset, block_table_offset,
+        ))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# ---------------------------
+#  Readers
+# ---------------------------
+class ChunkStore:
+    """
+    Random access to a binary chunk store through mmap. Indexing (store[i])
+    reads just that chunk; iteration walks the blocks in order. The file's pages
+    live in the OS page cache, shared by every worker that opens it.
+    """
+
+    BLOCK_CACHE_SIZE = 8
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, self.count, self.chunks_per_block, self.block_count,
+         self._chunk_table, self._block_table) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError(f"Not a chunk store (v{FORMAT_VERSION}): {path}")
+        self.compressed = bool(flags & FLAG_ZSTD)
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        # Tables + decompressed-block cache; the mmapped payload isn't process memory
+        self.resident_bytes = (
+            self.count * CHUNK_ENTRY.size + self.block_count * BLOCK_ENTRY.size
+            + (self.BLOCK_CACHE_SIZE * self.chunks_per_block * 2048 if self.compressed else 0)
+        )
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, chunk_id):
+        if not 0 <= chunk_id < self.count:
+            raise IndexError(chunk_id)
+        return CHUNK_ENTRY.unpack_from(self._mmap, self._chunk_table + chunk_id * CHUNK_ENTRY.size)
+
+    def _block(self, block_id):
+        """(buffer, base offset) holding the block's raw payload"""
+        offset, stored, raw = BLOCK_ENTRY.unpack_from(self._mmap, self._block_table + block_id * BLOCK_ENTRY.size)
+        if not self.compressed:
+            return self._mmap, offset
+        with self._lock:
+            data = self._blocks.get(block_id)
+            if data is not None:
+                self._blocks.move_to_end(block_id)
+                return data, 0
+        # Decompressor objects aren't safe for concurrent use; they're cheap to create
+        data = zstandard.ZstdDecompressor().decompress(self._mmap[offset:offset + stored], max_output_size=raw)
+        with self._lock:
+            self._blocks[block_id] = data
+            while len(self._blocks) > self.BLOCK_CACHE_SIZE:
+                self._blocks.popitem(last=False)
+        return data, 0
+
+    def __getitem__(self, chunk_id):
+        offset, length = self._entry(chunk_id)[:2]
+        data, base = self._block(chunk_id // self.chunks_per_block)
+        return data[base + offset:base + offset + length].decode('utf-8')
+
+    def __iter__(self):
+        for chunk_id in range(self.count):
+            yield self[chunk_id]
+
+    def span(self, chunk_id):
+        """(page_start, page_end, start, end) of a chunk"""
+        return self._entry(chunk_id)[2:]
+
+    def close(self):
+        self._mmap.close()
+
+
+class TextChunks:
+    """Legacy chunks_*.txt (separator-joined) read whole, with spans if they were recorded"""
+
+    def __init__(self, path):
+        self.path = path
+        self.chunks = list(iter_text_chunks(path))
+        self.spans = load_spans(path)
+        if self.spans is not None and len(self.spans) != len(self.chunks):
+            self.spans = None
+        self.resident_bytes = sum(sys.getsizeof(chunk) for chunk in self.chunks)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __getitem__(self, chunk_id):
+        return self.chunks[chunk_id]
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def span(self, chunk_id):
+        return tuple(self.spans[chunk_id]) if self.spans else None
+
+    def close(self):
+        pass
+
+
+def iter_text_chunks(path):
+    """Yield the chunks of a legacy chunks file one at a time (line-streamed, not read whole)"""
+    lines = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() == CHUNK_SEPARATOR:
+                chunk = "".join(lines).strip()
+                if chunk:
+                    yield chunk
+                lines = []
+            else:
+                lines.append(line)
+    chunk = "".join(lines).strip()
+    if chunk:
+        yield chunk
+
+
+def load_spans(chunks_path):
+    try:
+        with open(spans_path_for(chunks_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_chunk_store(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def open_chunks(path):
+    """ChunkStore for binary stores, TextChunks for legacy chunks_*.txt files"""
+    if is_chunk_store(path):
+        return ChunkStore(path)
+    return TextChunks(path)
+
+
+# ---------------------------
+#  Legacy migration
+# ---------------------------
+def migrate_text_chunks(path, compress=False):
+    """
+    Rewrite a legacy chunks_*.txt as a binary store next to it (same chunk ids,
+    so the BM25 index and vectors stay valid) and return the new path.
+    The caller switches the DB path over, then removes the old files.
+    """
+    legacy = TextChunks(path)
+    new_path = chunk_store_path_for(path)
+    with ChunkWriter(new_path, compress=compress) as writer:
+        for chunk_id, text in enumerate(legacy):
+            # Page 0 = span unknown (uploads from before spans were recorded)
+            page_start, page_end, start, end = legacy.span(chunk_id) or (0, 0, 0, 0)
+            writer.write(Chunk(text, page_start, page_end, start, end))
+    return new_path
+
+
+def remove_legacy_files(path):
+    for stale in (path, spans_path_for(path)):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
@@ -0,0 +1,65 @@
+from collections import deque, namedtuple
+
+CHUNK_SIZE = 1000  # Larger chunks for better context
+CHUNK_OVERLAP = 200
+LINE_SEPARATOR = "\n"
+
+# start/end are character offsets into the document as the splitter sees it:
+# every non-empty line of every page, joined by "\n". chunk text == doc[start:end].
+Chunk = namedtuple('Chunk', ['text', 'page_start', 'page_end', 'start', 'end'])
+
+
+def iter_lines(pages):
+    """
+    (page_no, text) pairs -> (line, page_no, offset) for each non-empty line.
+    Page breaks count as line breaks, so words on either side don't get glued.
+    """
+    offset = 0
+    for page_no, text in pages:
+        for line in text.split(LINE_SEPARATOR):
+            if line:
+                yield line, page_no, offset
+                offset += len(line) + len(LINE_SEPARATOR)
+
+
+def _emit(window):
+    """Chunk for the lines in window, stripped, with offsets adjusted to match"""
+    first_line, page_start, start = window[0]
+    last_line, page_end, last_offset = window[-1]
+    raw = LINE_SEPARATOR.join(line for line, _, _ in window)
+    text = raw.lstrip()
+    start += len(raw) - len(text)
+    text = text.rstrip()
+    if not text:
+        return None
+    return Chunk(text, page_start, page_end, start, start + len(text))
+
+
+def iter_chunks(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Streaming equivalent of CharacterTextSplitter(separator="\\n"): lines are
+    packed into chunks of up to chunk_size characters, and each new chunk starts
+    with up to chunk_overlap characters of trailing lines from the previous one,
+    including across page boundaries. Only the current window of lines is held
+    in memory, never the whole document.
+    """
+    sep_len = len(LINE_SEPARATOR)
+    window = deque()
+    total = 0
+    for line, page_no, offset in iter_lines(pages):
+        extra = len(line) + (sep_len if window else 0)
+        if window and total + extra > chunk_size:
+            chunk = _emit(window)
+            if chunk is not None:
+                yield chunk
+            # Keep trailing lines as overlap, while they fit next to the new line
+            while window and (total > chunk_overlap or total + len(line) + sep_len > chunk_size):
+                removed, _, _ = window.popleft()
+                total -= len(removed) + (sep_len if window else 0)
+            extra = len(line) + (sep_len if window else 0)
+        window.append((line, page_no, offset))
+        total += extra
+    if window:
+        chunk = _emit(window)
+        if chunk is not None:
+            yield chunk
@@ -0,0 +1,169 @@
+"""
+Local OpenAI-compatible chat completions server for load tests (no credits burned).
+Run with `manage.py run_fake_llm`; point the app at it with LLM_BASE_URL.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER = (
+    "Based on the document the answer depends on the context you provided and the "
+    "figures reported in the relevant section so please check the details below"
+).split()
+
+
+class FakeLLMConfig:
+    def __init__(self, latency=0.3, jitter=0.1, tokens_per_second=50.0, response_tokens=60,
+                 error_rate=0.0, error_status=500, seed=None):
+        self.latency = latency                      # seconds before the first token
+        self.jitter = jitter                        # +/- uniform noise on latency
+        self.tokens_per_second = tokens_per_second  # generation speed (0 = instant)
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate                # fraction of requests that fail
+        self.error_status = error_status            # e.g. 500, 429, 503
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def roll(self):
+        """(first_token_delay, fail) for one request"""
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        return delay, fail
+
+
+def _prompt_tokens(messages):
+    return sum(len(str(m.get("content", ""))) // 4 + 4 for m in messages)
+
+
+def _reply_tokens(config, messages):
+    """Deterministic-ish reply that echoes the question, split into word tokens"""
+    question = str(messages[-1].get("content", "")) if messages else ""
+    words = question.split()[-12:] + FILLER
+    return [(" " if i else "") + words[i % len(words)] for i in range(config.response_tokens)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    server_version = "FakeLLM/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # one line per request would swamp a load test
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            return self._send_json(200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+        self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "not found"}})
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "invalid JSON"}})
+
+        config = self.server.config
+        delay, fail = config.roll()
+        time.sleep(delay)
+        if fail:
+            headers = {"Retry-After": "1"} if config.error_status in (429, 503) else None
+            return self._send_json(
+                config.error_status, {"error": {"message": "injected failure", "code": config.error_status}}, headers
+            )
+
+        messages = request.get("messages") or []
+        model = request.get("model") or "fake"
+        tokens = _reply_tokens(config, messages)
+        max_tokens = request.get("max_tokens")
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+        usage = {
+            "prompt_tokens": _prompt_tokens(messages),
+            "completion_tokens": len(tokens),
+            "total_tokens": _prompt_tokens(messages) + len(tokens),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        per_token = 1.0 / config.tokens_per_second if config.tokens_per_second else 0.0
+
+        if request.get("stream"):
+            return self._stream(completion_id, model, tokens, per_token, usage)
+
+        time.sleep(per_token * len(tokens))
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id, model, tokens, per_token, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None, **extra):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+
+        try:
+            chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                time.sleep(per_token)
+                chunk({"content": token})
+            chunk({}, finish_reason="stop", usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client cancelled the stream
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeLLMHandler)
+        self.config = config
+
+
+def start_in_thread(config=None, host="127.0.0.1", port=0):
+    """Start a server on a background thread (port 0 = any free port); returns it"""
+    server = FakeLLMServer((host, port), config or FakeLLMConfig())
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server
@@ -0,0 +1,169 @@
+import threading
+
+from django.conf import settings
+
+from . import routing
+from .llm import get_async_openrouter_client, get_openrouter_client
+from .llm_gateway import get_gateway
+from .models import Message
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_unavailable = False
+
+
+# ---------------------------
+#  Token counting (tiktoken)
+# ---------------------------
+def get_encoding():
+    """tiktoken encoding for the chat model, or None if it cannot be loaded (e.g. offline)"""
+    global _encoding, _encoding_unavailable
+    if _encoding is None and not _encoding_unavailable:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_unavailable:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(getattr(settings, 'TIKTOKEN_ENCODING', 'o200k_base'))
+                except Exception as e:
+                    # tiktoken downloads its BPE files on first use; don't retry on every call
+                    print(f"tiktoken unavailable, estimating token counts: {str(e)}")
+                    _encoding_unavailable = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message):
+    # ~4 tokens of per-message framing in the chat format
+    return count_tokens(message["content"]) + 4
+
+
+# ---------------------------
+#  History planning
+# ---------------------------
+def split_history(turns, budget):
+    """
+    Split turns (oldest first) into (overflow, recent): `recent` is the longest
+    suffix that fits in `budget` tokens, `overflow` is everything before it.
+    """
+    used = 0
+    start = len(turns)
+    for i in range(len(turns) - 1, -1, -1):
+        used += message_tokens(turns[i])
+        if used > budget:
+            break
+        start = i
+    return turns[:start], turns[start:]
+
+
+def summary_request(summary, overflow):
+    """Messages asking the model to fold `overflow` turns into the running summary"""
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in overflow)
+    return [
+        {"role": "system", "content": (
+            "You maintain a running summary of a conversation between a user and an AI assistant. "
+            "Update the summary with the new turns. Keep facts, names, decisions and open questions; "
+            "drop pleasantries. Reply with the updated summary only."
+        )},
+        {"role": "user", "content": f"Current summary:\n{summary or '(empty)'}\n\nNew turns:\n{transcript}"},
+    ]
+
+
+def summary_message(summary):
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+
+def _turns(messages):
+    return [{"role": msg.role, "content": msg.content} for msg in messages]
+
+
+def _settings():
+    return (
+        getattr(settings, 'HISTORY_TOKEN_BUDGET', 2000),
+        getattr(settings, 'HISTORY_SUMMARY_BATCH_TOKENS', 500),
+        getattr(settings, 'HISTORY_SUMMARY_MAX_TOKENS', 400),
+    )
+
+
+def _should_fold(overflow, batch_tokens):
+    return overflow and sum(message_tokens(turn) for turn in overflow) >= batch_tokens
+
+
+# ---------------------------
+#  History builders
+# ---------------------------
+def build_history(session):
+    """
+    Conversation history for the prompt: the running summary (if any) plus the
+    most recent turns that fit HISTORY_TOKEN_BUDGET. Turns pushed out of the
+    budget stay in the prompt until they add up to HISTORY_SUMMARY_BATCH_TOKENS,
+    then they are folded into ChatSession.summary (extended, never regenerated).
+    """
+    budget, batch_tokens, max_tokens = _settings()
+    messages = Message.objects.filter(session=session)
+    if session.summary_upto:
+        messages = messages.filter(timestamp__gt=session.summary_upto)
+    messages = list(messages.order_by('timestamp'))
+    overflow, recent = split_history(_turns(messages), budget)
+
+    if _should_fold(overflow, batch_tokens):
+        try:
+            # Through the gateway like any turn: a brownout sheds the summary instead of stalling on it
+            client, gateway = get_openrouter_client(), get_gateway()
+            model = routing.plan()[0][0]
+            with gateway.slot():
+                completion = gateway.call(lambda: client.chat.completions.create(
+                    model=model,
+                    messages=summary_request(session.summary, overflow),
+                    max_tokens=max_tokens,
+                    timeout=gateway.timeout,
+                ))
+            session.summary = completion.choices[0].message.content.strip()
+            session.summary_upto = messages[len(overflow) - 1].timestamp
+            session.save(update_fields=['summary', 'summary_upto'])
+            overflow = []
+        except Exception as e:
+            # Stay within budget (also when shed by the gateway); summary_upto is unchanged
+            # so these turns are retried next time
+            print(f"Error updating conversation summary: {str(e)}")
+            overflow = []
+
+    history = [summary_message(session.summary)] if session.summary else []
+    return history + overflow + recent
+
+
+async def abuild_history(session):
+    """Async ORM / async client variant of build_history"""
+    budget, batch_tokens, max_tokens = _settings()
+    messages = Message.objects.filter(session=session)
+    if session.summary_upto:
+        messages = messages.filter(timestamp__gt=session.summary_upto)
+    messages = [msg async for msg in messages.order_by('timestamp')]
+    overflow, recent = split_history(_turns(messages), budget)
+
+    if _should_fold(overflow, batch_tokens):
+        try:
+            client, gateway = get_async_openrouter_client(), get_gateway()
+            model = routing.plan()[0][0]
+            async with gateway.aslot():
+                completion = await gateway.acall(lambda: client.chat.completions.create(
+                    model=model,
+                    messages=summary_request(session.summary, overflow),
+                    max_tokens=max_tokens,
+                    timeout=gateway.timeout,
+                ))
+            session.summary = completion.choices[0].message.content.strip()
+            session.summary_upto = messages[len(overflow) - 1].timestamp
+            await session.asave(update_fields=['summary', 'summary_upto'])
+            overflow = []
+        except Exception as e:
+            print(f"Error updating conversation summary: {str(e)}")
+            overflow = []
+
+    history = [summary_message(session.summary)] if session.summary else []
+    return history + overflow + recent
@@ -0,0 +1,73 @@
+"""
+Per-user hot state kept in the shared cache tier: the active ChatSession and the
+user's ready PDFs, so a steady-state chat turn does not look them up in the DB.
+Invalidated on new sessions, uploads, ingestion results and (via signals) any
+save/delete of those rows; HOT_STATE_TTL bounds staleness across processes that
+do not share the cache (locmem).
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import ChatSession, UploadedPDF
+
+HOT_STATE_VERSION = 1  # bump when the cached shape changes
+
+
+class HotState:
+    def __init__(self, session, ready_pdfs):
+        self.session = session          # active ChatSession (None until the first turn)
+        self.ready_pdfs = ready_pdfs    # ingested UploadedPDFs, oldest first
+
+
+def enabled():
+    return getattr(settings, 'HOT_STATE_ENABLED', True)
+
+
+def get_cache():
+    return caches[getattr(settings, 'HOT_STATE_CACHE_ALIAS', 'default')]
+
+
+def _key(user_id):
+    return f"hot:{HOT_STATE_VERSION}:{user_id}"
+
+
+def _ttl():
+    return getattr(settings, 'HOT_STATE_TTL', 300)
+
+
+def _load(user_id):
+    session = ChatSession.objects.filter(user_id=user_id, is_active=True).first()
+    pdfs = list(
+        UploadedPDF.objects.filter(user_id=user_id, status='ready')
+        .only('id', 'file', 'original_name', 'faiss_index_path').order_by('id')
+    )
+    return HotState(session, pdfs)
+
+
+def get(user):
+    """HotState of an authenticated user, from the cache or (on a miss) two DB queries"""
+    if not enabled():
+        return _load(user.id)
+    cache = get_cache()
+    state = cache.get(_key(user.id))
+    if state is None:
+        state = _load(user.id)
+        cache.set(_key(user.id), state, _ttl())
+    return state
+
+
+async def aget(user):
+    if not enabled():
+        return await sync_to_async(_load)(user.id)
+    cache = get_cache()
+    state = await cache.aget(_key(user.id))
+    if state is None:
+        state = await sync_to_async(_load)(user.id)
+        await cache.aset(_key(user.id), state, _ttl())
+    return state
+
+
+def invalidate(user_id):
+    if enabled():
+        get_cache().delete(_key(user_id))
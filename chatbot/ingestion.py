@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from PyPDF2 import PdfReader
+
+from . import hot_state, metrics, vectors
+from .chunk_cache import chunk_cache
+from .chunk_store import CHUNK_STORE_EXT, ChunkStore, ChunkWriter, open_chunks
+from .chunking import iter_chunks
+from .models import IngestionJob, PdfContent, UploadedPDF
+from .pdf_extract import iter_pages
+from .retrieval import BM25Builder, index_path_for
+
+
+# ---------------------------
+#  Utility: Extract + Process PDF
+# ---------------------------
+def chunks_path_for(pdf_obj):
+    """Content-addressed for deduplicated uploads, per upload for older ones"""
+    name = pdf_obj.content.sha256[:32] if pdf_obj.content_id else pdf_obj.id
+    return os.path.join(settings.MEDIA_ROOT, "pdfs", f"chunks_{name}{CHUNK_STORE_EXT}")
+
+
+def process_pdf(pdf_obj, progress=None):
+    """
+    Extract text, split into chunks, and save for text search.
+    Streams page -> text -> chunk -> file, so memory stays bounded by a few pages
+    whatever the document size. Returns the number of chunks written.
+    progress(pages_done, pages_total, chunks_count) is called as work advances.
+    """
+    try:
+        pdf_path = pdf_obj.file.path
+        reader = PdfReader(pdf_path)
+        pages_total = len(reader.pages)
+        chunks_path = chunks_path_for(pdf_obj)
+        builder = BM25Builder()
+
+        # Chunks are appended to disk as they are produced (the writer creates the directory)
+        extract = metrics.span('ingest_extract')
+        with extract, ChunkWriter(chunks_path, compress=getattr(settings, 'CHUNK_STORE_COMPRESS', False)) as writer:
+            def pages():
+                # Large files are extracted by a process pool; pages still arrive in order
+                for page_no, text in iter_pages(
+                    pdf_path, reader,
+                    workers=getattr(settings, 'INGESTION_PROCESSES', 1),
+                    min_pages=getattr(settings, 'INGESTION_PARALLEL_MIN_PAGES', 64),
+                ):
+                    yield page_no, text
+                    if progress:
+                        progress(page_no, pages_total, writer.count)
+
+            for chunk in iter_chunks(pages()):
+                writer.write(chunk)
+                # Build the BM25 inverted index once, at ingest time
+                builder.add(chunk.text)
+
+            # Check if text was extracted
+            if not writer.count:
+                raise ValueError("No text could be extracted from the PDF")
+
+        print(f"Successfully extracted {writer.count} chunks from PDF: {pdf_obj.file.name}")
+
+        metrics.count_pages(pages_total)
+
+        with metrics.span('ingest_index'):
+            builder.build().save(index_path_for(chunks_path))
+        # Chunk embeddings (float32 .npy under FAISS_INDEX_PATH) when dense retrieval is on
+        if vectors.enabled():
+            with metrics.span('ingest_vectors'), closing(ChunkStore(chunks_path)) as store:
+                vectors.build_vectors(store, chunks_path)
+        # Drop any stale cache entry; the chunks are loaded again on the first question
+        chunk_cache.invalidate(chunks_path)
+
+        # Save path to DB
+        pdf_obj.faiss_index_path = chunks_path  # Reusing this field for chunks path
+        pdf_obj.save(update_fields=['faiss_index_path'])
+        if pdf_obj.content_id:
+            # Later uploads of the same bytes reuse these artifacts
+            PdfContent.objects.filter(pk=pdf_obj.content_id).update(chunks_path=chunks_path)
+        if progress:
+            progress(pages_total, pages_total, writer.count)
+
+        print(f"Successfully processed PDF: {pdf_obj.file.name}")
+        print(f"Chunks saved to: {chunks_path}")
+        return writer.count
+
+    except Exception as e:
+        print(f"Error processing PDF {pdf_obj.file.name}: {str(e)}")
+        raise e
+
+
+# ---------------------------
+#  Job Queue (DB-backed)
+# ---------------------------
+class JobProgress:
+    """Progress callback that writes to the job row at most every PROGRESS_INTERVAL seconds"""
+
+    PROGRESS_INTERVAL = 1.0
+
+    def __init__(self, job):
+        self.job = job
+        self._last_write = 0.0
+
+    def __call__(self, pages_done, pages_total, chunks_count):
+        now = time.monotonic()
+        finished = pages_done >= pages_total
+        if not finished and now - self._last_write < self.PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        IngestionJob.objects.filter(pk=self.job.pk).update(
+            pages_done=pages_done, pages_total=pages_total, chunks_count=chunks_count
+        )
+
+
+def claim_job(job_id=None):
+    """
+    Atomically move one queued job to 'running' and return it (None if there is nothing to do).
+    Uses a conditional UPDATE so concurrent workers never claim the same job.
+    """
+    candidates = IngestionJob.objects.filter(status='queued')
+    if job_id is not None:
+        candidates = candidates.filter(pk=job_id)
+    for job_pk in candidates.order_by('created_at').values_list('pk', flat=True)[:5]:
+        claimed = IngestionJob.objects.filter(pk=job_pk, status='queued').update(
+            status='running', started_at=timezone.now()
+        )
+        if claimed:
+            return IngestionJob.objects.select_related('pdf', 'pdf__content').get(pk=job_pk)
+    return None
+
+
+def run_job(job):
+    """Process a claimed job's PDF, recording progress, result and errors on the job"""
+    pdf_obj = job.pdf
+    content = pdf_obj.content
+    if content is not None and content.chunks_path and os.path.exists(content.chunks_path):
+        # Same bytes were ingested (e.g. by another job) since this one was queued
+        return attach_content(job, pdf_obj, content)
+    UploadedPDF.objects.filter(pk=pdf_obj.pk).update(status='processing')
+    try:
+        chunks_count = process_pdf(pdf_obj, progress=JobProgress(job))
+    except Exception as e:
+        IngestionJob.objects.filter(pk=job.pk).update(
+            status='failed', error=str(e), finished_at=timezone.now()
+        )
+        UploadedPDF.objects.filter(pk=pdf_obj.pk).update(status='failed')
+        return False
+    IngestionJob.objects.filter(pk=job.pk).update(
+        status='done', chunks_count=chunks_count, finished_at=timezone.now()
+    )
+    UploadedPDF.objects.filter(pk=pdf_obj.pk).update(status='ready')
+    hot_state.invalidate(pdf_obj.user_id)
+    return True
+
+
+def attach_content(job, pdf_obj, content):
+    """Finish a job by pointing its PDF at already-ingested shared artifacts"""
+    with closing(open_chunks(content.chunks_path)) as chunks:
+        chunks_count = len(chunks)
+    IngestionJob.objects.filter(pk=job.pk).update(
+        status='done', chunks_count=chunks_count, finished_at=timezone.now()
+    )
+    UploadedPDF.objects.filter(pk=pdf_obj.pk).update(faiss_index_path=content.chunks_path, status='ready')
+    hot_state.invalidate(pdf_obj.user_id)
+    return True
+
+
+def run_pending_jobs(limit=None):
+    """Claim and run queued jobs until the queue is empty (or limit jobs ran)"""
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+def requeue_stale_jobs(older_than_seconds):
+    """Put 'running' jobs whose worker died back on the queue"""
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    return IngestionJob.objects.filter(status='running', started_at__lt=cutoff).update(
+        status='queued', started_at=None
+    )
+
+
+# ---------------------------
+#  In-process worker pool
+# ---------------------------
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'INGESTION_THREADS', 1),
+                thread_name_prefix='pdf-ingest',
+            )
+        return _executor
+
+
+def _drain_queue():
+    try:
+        run_pending_jobs()
+    except Exception as e:
+        print(f"Ingestion worker error: {str(e)}")
+    finally:
+        # Pool threads are reused; don't leak their DB connections
+        connections.close_all()
+
+
+def enqueue(pdf_obj):
+    """
+    Create an ingestion job for pdf_obj and dispatch it according to INGESTION_MODE:
+      'thread' - run on the in-process thread pool once the transaction commits
+      'worker' - leave it for `manage.py run_ingestion_worker`
+      'sync'   - run inline (tests / debugging)
+    """
+    job = IngestionJob.objects.create(pdf=pdf_obj)
+    mode = getattr(settings, 'INGESTION_MODE', 'thread')
+    if mode == 'sync':
+        claimed = claim_job(job.pk)
+        if claimed is not None:
+            run_job(claimed)
+    elif mode == 'thread':
+        transaction.on_commit(lambda: get_executor().submit(_drain_queue))
+    return job
+
+
+def job_status(job):
+    """JSON-serialisable view of a job for the status endpoint"""
+    return {
+        'job_id': job.id,
+        'pdf_id': job.pdf_id,
+        'status': job.status,
+        'pages_done': job.pages_done,
+        'pages_total': job.pages_total,
+        'chunks_count': job.chunks_count,
+        'error': job.error or None,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+CHAT_MODEL = "openai/gpt-4o-mini"
+
+_client = None
+_client_lock = threading.Lock()
+# AsyncOpenAI/httpx pools are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _base_url():
+    """LLM_BASE_URL points the clients elsewhere, e.g. at `manage.py run_fake_llm`"""
+    return getattr(settings, 'LLM_BASE_URL', None) or OPENROUTER_BASE_URL
+
+
+def _api_key():
+    api_key = getattr(settings, 'OPENROUTER_API_KEY', None)
+    if not api_key:
+        if _base_url() != OPENROUTER_BASE_URL:
+            return "local"  # stub / self-hosted servers don't check it
+        raise RuntimeError("OPENROUTER_API_KEY is not set")
+    return api_key
+
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=getattr(settings, 'LLM_POOL_MAX_CONNECTIONS', 100),
+        max_keepalive_connections=getattr(settings, 'LLM_POOL_MAX_KEEPALIVE', 20),
+        keepalive_expiry=getattr(settings, 'LLM_POOL_KEEPALIVE_EXPIRY', 60.0),
+    )
+
+
+# ✅ OpenRouter client setup (lazy, one per process)
+def get_openrouter_client():
+    """Process-wide sync client; reuses its keep-alive connection pool across requests"""
+    global _client
+    if _client is None:
+        api_key = _api_key()
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    base_url=_base_url(),
+                    api_key=api_key,
+                    timeout=15.0,
+                    max_retries=0,  # retries are the LLM gateway's job (llm_gateway.py)
+                    http_client=DefaultHttpxClient(limits=_pool_limits()),
+                )
+    return _client
+
+
+def get_async_openrouter_client():
+    """Async client shared by every request running on the current event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            base_url=_base_url(),
+            api_key=_api_key(),
+            timeout=15.0,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=_pool_limits()),
+        )
+        _async_clients[loop] = client
+    return client
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import re
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Prefix of the user message compose_messages builds for RAG turns
+RAG_PROMPT_PREFIX = "Based on the following document content, please answer the user's question."
+
+_WS_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[\s?!.]+$")
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    with _stats_lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {**_stats, 'hit_ratio': (_stats['hits'] / lookups) if lookups else 0.0}
+
+
+def enabled():
+    return getattr(settings, 'LLM_CACHE_ENABLED', True)
+
+
+def get_cache():
+    return caches[getattr(settings, 'LLM_CACHE_ALIAS', 'llm')]
+
+
+def normalize(text):
+    """Case/whitespace/trailing-punctuation insensitive form of a question"""
+    return _TRAILING_PUNCT_RE.sub("", _WS_RE.sub(" ", text).strip().lower())
+
+
+def is_rag_turn(messages):
+    return messages[-1]["role"] == "user" and messages[-1]["content"].startswith(RAG_PROMPT_PREFIX)
+
+
+def cache_key(model, messages):
+    """
+    Hash of the exact payload. With LLM_CACHE_NORMALIZED, RAG turns are keyed on
+    the model + normalized question-with-context only, so the same question about
+    the same retrieved chunks hits regardless of the conversation around it.
+    """
+    if getattr(settings, 'LLM_CACHE_NORMALIZED', False) and is_rag_turn(messages):
+        payload = {'model': model, 'rag': normalize(messages[-1]["content"])}
+    else:
+        payload = {'model': model, 'messages': messages}
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return f"llm:{digest}"
+
+
+def cache_keys(models, messages):
+    """
+    Keys under which any of `models` may have stored an answer to `messages`.
+    Answers are stored under the model that produced them (routing picks the
+    model per turn), so a lookup checks every configured one.
+    """
+    return [cache_key(model, messages) for model in models]
+
+
+def _first(keys, found):
+    answer = next((found[key] for key in keys if key in found), None)
+    _count('hits' if answer is not None else 'misses')
+    return answer
+
+
+def get(keys):
+    """First cached answer among `keys` (one cache round trip), or None"""
+    return _first(keys, get_cache().get_many(keys))
+
+
+def set(key, answer):
+    get_cache().set(key, answer)
+    _count('stores')
+
+
+async def aget(keys):
+    return _first(keys, await get_cache().aget_many(keys))
+
+
+async def aset(key, answer):
+    await get_cache().aset(key, answer)
+    _count('stores')
@@ -0,0 +1,376 @@
+"""
+Process-wide gate in front of the LLM clients: bounded concurrency with a
+bounded wait queue, jittered retries for failures that are safe to retry, and
+a circuit breaker that fails fast while the upstream is timing out.
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import openai
+from django.conf import settings
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+# The upstream never ran the completion for these, so sending it again is safe
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+
+class GatewayBusy(Exception):
+    """The request was not sent upstream; the client should retry after retry_after seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(GatewayBusy):
+    pass
+
+
+def is_retryable(exc):
+    """Connection failures before a reply and 429/502/503/504; never timeouts (the call may have run)"""
+    if isinstance(exc, openai.APITimeoutError):
+        return False
+    if isinstance(exc, openai.APIConnectionError):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code in RETRYABLE_STATUSES
+
+
+def is_upstream_failure(exc):
+    """Failures that say the upstream is unhealthy (timeouts, connection errors, 5xx)"""
+    if isinstance(exc, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+
+def _retry_after_header(exc):
+    response = getattr(exc, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+# ---------------------------
+#  Circuit breaker
+# ---------------------------
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive upstream failures. After `reset_timeout`
+    seconds a single probe request is let through: success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        return max(1, math.ceil(self.opened_at + self.reset_timeout - time.monotonic()))
+
+    def is_open(self):
+        """Cheap check before queueing; does not claim the probe"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == HALF_OPEN and self._probing
+
+    def allow(self):
+        """True if a call may go upstream now (claims the probe when half-open)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def abandon(self):
+        """The probe was cancelled before it said anything: let the next call probe instead"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, healthy):
+        with self._lock:
+            self._probing = False
+            if healthy:
+                self.state, self.failures = CLOSED, 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                if self.state != OPEN:
+                    print(f"LLM circuit breaker opened after {self.failures} consecutive failure(s)")
+                self.state, self.opened_at = OPEN, time.monotonic()
+
+
+# ---------------------------
+#  Concurrency slots + wait queue
+# ---------------------------
+class _ThreadWaiter:
+    def __init__(self):
+        self.event = threading.Event()
+
+    def grant(self):
+        self.event.set()
+        return True
+
+
+class _AsyncWaiter:
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def grant(self):
+        if self.loop.is_closed():
+            return False
+        self.loop.call_soon_threadsafe(self._set)
+        return True
+
+    def _set(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class Slots:
+    """
+    Semaphore shared by threads and event loops, FIFO, with a bounded number of
+    waiters. A released slot is handed straight to the oldest waiter.
+    """
+
+    def __init__(self, limit, max_waiting):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def _enqueue(self, waiter):
+        """Take a free slot (returns None) or queue `waiter`; raises when the queue is full"""
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return None
+            if len(self._waiters) >= self.max_waiting:
+                raise GatewayBusy("LLM queue is full", retry_after=1)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter):
+        """True if waiter left the queue without a slot; False if a slot was granted meanwhile"""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+    def acquire(self, timeout):
+        waiter = self._enqueue(_ThreadWaiter())
+        if waiter is None or waiter.event.wait(timeout) or not self._abandon(waiter):
+            return
+        raise GatewayBusy("Timed out waiting for an LLM slot", retry_after=1)
+
+    async def aacquire(self, timeout):
+        waiter = self._enqueue(_AsyncWaiter(asyncio.get_running_loop()))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise GatewayBusy("Timed out waiting for an LLM slot", retry_after=1)
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self.release()  # granted while being cancelled: pass it on
+            raise
+
+    def try_acquire(self):
+        """Take a slot only if one is free and nobody is queued for it"""
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            return False
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                if self._waiters.popleft().grant():
+                    return  # slot handed over, `active` unchanged
+            self.active -= 1
+
+
+# ---------------------------
+#  Gateway
+# ---------------------------
+class LLMGateway:
+    def __init__(self, max_concurrency=16, max_waiting=32, queue_timeout=10.0, max_retries=2,
+                 backoff=0.5, backoff_max=8.0, breaker_threshold=5, breaker_reset=30.0, timeout=90.0):
+        self.slots = Slots(max_concurrency, max_waiting)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._stats_lock = threading.Lock()
+        self._stats = {'rejected_queue': 0, 'rejected_breaker': 0, 'retries': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return {
+            'in_flight': self.slots.active,
+            'queue_depth': self.slots.waiting,
+            'max_concurrency': self.slots.limit,
+            'max_queue': self.slots.max_waiting,
+            'breaker_state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            **counters,
+        }
+
+    def admit(self):
+        """Fail fast (GatewayBusy) if a call would be rejected right now; reserves nothing"""
+        if self.breaker.is_open():
+            self._count('rejected_breaker')
+            raise CircuitOpen("LLM upstream is unavailable", retry_after=self.breaker.retry_after())
+        if self.slots.active >= self.slots.limit and self.slots.waiting >= self.slots.max_waiting:
+            self._count('rejected_queue')
+            raise GatewayBusy("LLM queue is full", retry_after=1)
+
+    def _backoff(self, attempt, exc):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))  # full jitter
+        hinted = _retry_after_header(exc)
+        if hinted is not None and hinted <= self.backoff_max:
+            delay = max(delay, hinted)
+        return delay
+
+    def _check_breaker(self):
+        """Raise CircuitOpen unless the call may go upstream; True if it is the half-open probe"""
+        if not self.breaker.allow():
+            self._count('rejected_breaker')
+            raise CircuitOpen("LLM upstream is unavailable", retry_after=self.breaker.retry_after())
+        return self.breaker.state == HALF_OPEN
+
+    # Sync ---------------------------------------------------------------
+    @contextmanager
+    def slot(self):
+        """Hold one upstream slot (e.g. for the whole life of a stream)"""
+        self.admit()
+        try:
+            self.slots.acquire(self.queue_timeout)
+        except GatewayBusy:
+            self._count('rejected_queue')
+            raise
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def try_slot(self):
+        """Spare slot for optional work (hedged requests): True if taken; release with slots.release()"""
+        return not self.breaker.is_open() and self.slots.try_acquire()
+
+    def call(self, fn):
+        """Run fn() (inside slot()) through the breaker, retrying retryable failures"""
+        for attempt in range(self.max_retries + 1):
+            probe = self._check_breaker()
+            try:
+                result = fn()
+            except Exception as exc:
+                self.breaker.record(not is_upstream_failure(exc))
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                self._count('retries')
+                time.sleep(self._backoff(attempt, exc))
+                continue
+            except BaseException:
+                if probe:
+                    self.breaker.abandon()
+                raise
+            self.breaker.record(True)
+            return result
+
+    # Async --------------------------------------------------------------
+    @asynccontextmanager
+    async def aslot(self):
+        self.admit()
+        try:
+            await self.slots.aacquire(self.queue_timeout)
+        except GatewayBusy:
+            self._count('rejected_queue')
+            raise
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    async def acall(self, fn):
+        for attempt in range(self.max_retries + 1):
+            probe = self._check_breaker()
+            try:
+                result = await fn()
+            except Exception as exc:
+                self.breaker.record(not is_upstream_failure(exc))
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                self._count('retries')
+                await asyncio.sleep(self._backoff(attempt, exc))
+                continue
+            except BaseException:
+                # Cancelled (client gone, losing hedge): neither healthy nor a failure
+                if probe:
+                    self.breaker.abandon()
+                raise
+            self.breaker.record(True)
+            return result
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide gateway, configured from settings on first use"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway(
+                    max_concurrency=getattr(settings, 'LLM_MAX_CONCURRENCY', 16),
+                    max_waiting=getattr(settings, 'LLM_MAX_QUEUE', 32),
+                    queue_timeout=getattr(settings, 'LLM_QUEUE_TIMEOUT', 10.0),
+                    max_retries=getattr(settings, 'LLM_MAX_RETRIES', 2),
+                    backoff=getattr(settings, 'LLM_RETRY_BACKOFF', 0.5),
+                    backoff_max=getattr(settings, 'LLM_RETRY_BACKOFF_MAX', 8.0),
+                    breaker_threshold=getattr(settings, 'LLM_BREAKER_THRESHOLD', 5),
+                    breaker_reset=getattr(settings, 'LLM_BREAKER_RESET', 30.0),
+                    timeout=getattr(settings, 'LLM_TIMEOUT', 90.0),
+                )
+    return _gateway
+
+
+def reset_gateway():
+    """Drop the gateway so the next call rebuilds it from settings (tests)"""
+    global _gateway
+    with _gateway_lock:
+        _gateway = None
@@ -0,0 +1,139 @@
+"""
+End-to-end load generator: many synthetic users register/log in, upload a PDF
+and hold concurrent chat conversations against a running instance of the app.
+Run with `manage.py load_test`; pair with `manage.py run_fake_llm` so no real
+LLM credits are spent.
+"""
+import asyncio
+import math
+import random
+import time
+
+import httpx
+
+from .synthetic import synthetic_queries
+
+LLM_ERROR_PREFIX = "Error contacting model"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Latency samples and error counts per endpoint label"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, endpoint, seconds, ok):
+        self.samples.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            report[endpoint] = {
+                'requests': len(ordered),
+                'errors': self.errors.get(endpoint, 0),
+                'throughput_rps': len(ordered) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(ordered, 50) * 1000,
+                'p95_ms': percentile(ordered, 95) * 1000,
+                'p99_ms': percentile(ordered, 99) * 1000,
+                'max_ms': ordered[-1] * 1000,
+            }
+        return {'elapsed_s': elapsed, 'endpoints': report}
+
+
+class SyntheticUser:
+    def __init__(self, client, recorder, username, password):
+        self.client = client
+        self.recorder = recorder
+        self.username = username
+        self.password = password
+
+    def _csrf_headers(self, extra=None):
+        headers = {'X-CSRFToken': self.client.cookies.get('csrftoken', '')}
+        headers.update(extra or {})
+        return headers
+
+    async def request(self, endpoint, method, url, ok_statuses=(200,), check=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code in ok_statuses and (check is None or check(response))
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    async def sign_in(self):
+        await self.request('GET /register/', 'GET', '/register/')
+        data = {'username': self.username, 'email': '', 'password1': self.password, 'password2': self.password}
+        response = await self.request(
+            'POST /register/', 'POST', '/register/', ok_statuses=(302, 200), data=data, headers=self._csrf_headers()
+        )
+        if response is not None and response.status_code == 302:
+            return True
+        # Already registered by an earlier run: log in instead
+        await self.request('GET /login/', 'GET', '/login/')
+        response = await self.request(
+            'POST /login/', 'POST', '/login/', ok_statuses=(302,),
+            data={'username': self.username, 'password': self.password}, headers=self._csrf_headers(),
+        )
+        return response is not None and response.status_code == 302
+
+    async def upload(self, name, pdf_bytes):
+        await self.request(
+            'POST /upload-pdf/', 'POST', '/upload-pdf/', ok_statuses=(201, 202),
+            files={'pdf': (name, pdf_bytes, 'application/pdf')},
+            headers=self._csrf_headers({'Accept': 'application/json'}),
+        )
+
+    async def chat(self, message, stream=False):
+        if stream:
+            endpoint, url = 'POST /chat/stream/', '/chat/stream/'
+            check = lambda r: 'event: done' in r.text and 'event: error' not in r.text  # noqa: E731
+        else:
+            endpoint, url = 'POST /', '/'
+            check = lambda r: not r.json().get('response', '').startswith(LLM_ERROR_PREFIX)  # noqa: E731
+        await self.request(endpoint, 'POST', url, data={'message': message}, headers=self._csrf_headers(), check=check)
+
+
+async def run_user(index, options, recorder, semaphore, pdf_bytes):
+    rnd = random.Random(index)
+    questions = synthetic_queries(options['turns'], seed=index)
+    async with semaphore:
+        async with httpx.AsyncClient(
+            base_url=options['target'], timeout=options['timeout'], follow_redirects=False,
+        ) as client:
+            user = SyntheticUser(client, recorder, f"{options['user_prefix']}{index}", 'load-test-pw-1')
+            if not await user.sign_in():
+                return
+            if pdf_bytes is not None:
+                await user.upload(f"load_{index % 5}.pdf", pdf_bytes)
+            for question in questions:
+                await user.chat(question, stream=options['stream'])
+                if options['think_time']:
+                    await asyncio.sleep(rnd.uniform(0, options['think_time']))
+
+
+async def run_load(options, pdf_bytes=None):
+    """options: target, users, turns, concurrency, stream, timeout, think_time, user_prefix"""
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(options['concurrency'])
+    await asyncio.gather(*(
+        run_user(index, options, recorder, semaphore, pdf_bytes) for index in range(options['users'])
+    ))
+    recorder.finished = time.perf_counter()
+    return recorder.summary()
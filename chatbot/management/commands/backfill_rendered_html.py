@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.models import Chat, Message
+from chatbot.rendering import RENDER_VERSION, render_markdown
+
+
+class Command(BaseCommand):
+    help = "Render and store markdown HTML for messages rendered by an older (or no) renderer version"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        messages = self.backfill(
+            Message.objects.filter(role='assistant').exclude(render_version=RENDER_VERSION),
+            'content', 'content_html', batch_size,
+        )
+        chats = self.backfill(
+            Chat.objects.exclude(render_version=RENDER_VERSION),
+            'response', 'response_html', batch_size,
+        )
+        self.stdout.write(f"Rendered {messages} message(s) and {chats} legacy chat(s) at version {RENDER_VERSION}")
+
+    def backfill(self, queryset, source_field, html_field, batch_size):
+        total = 0
+        while True:
+            # Each batch drops out of the queryset once updated, so always take the first page
+            batch = list(queryset.only('pk', source_field)[:batch_size])
+            if not batch:
+                return total
+            for row in batch:
+                setattr(row, html_field, render_markdown(getattr(row, source_field)))
+                row.render_version = RENDER_VERSION
+            queryset.model.objects.bulk_update(batch, [html_field, 'render_version'])
+            total += len(batch)
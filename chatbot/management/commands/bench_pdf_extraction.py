@@ -0,0 +1,49 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from PyPDF2 import PdfReader
+
+from chatbot.pdf_extract import get_pool, iter_pages
+from chatbot.synthetic import make_pdf
+
+
+class Command(BaseCommand):
+    help = "Compare serial vs process-pool page extraction on a synthetic PDF"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=400)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--repeat', type=int, default=3, help="Best of N runs per mode")
+
+    def extract(self, pdf_path, workers):
+        best, texts = None, None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            reader = PdfReader(pdf_path)
+            texts = [text for _, text in iter_pages(pdf_path, reader, workers=workers, min_pages=1)]
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, texts
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        pages, workers = options['pages'], options['workers']
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = make_pdf(os.path.join(tmp, 'synthetic.pdf'), pages)
+            # Start the workers before timing so pool spawn-up isn't counted
+            if workers > 1:
+                pool = get_pool(workers)
+                for future in [pool.submit(int) for _ in range(workers)]:
+                    future.result()
+
+            serial, serial_texts = self.extract(pdf_path, 1)
+            parallel, parallel_texts = self.extract(pdf_path, workers)
+
+        if serial_texts != parallel_texts:
+            self.stderr.write("Parallel extraction returned different text than serial")
+        self.stdout.write(f"pages={pages} cpus={os.cpu_count()} workers={workers}")
+        self.stdout.write(f"serial:   {serial:.2f}s ({pages / serial:.0f} pages/s)")
+        self.stdout.write(f"parallel: {parallel:.2f}s ({pages / parallel:.0f} pages/s)")
+        self.stdout.write(f"speedup:  {serial / parallel:.2f}x")
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.archive import compact_legacy_chats, compact_sessions, default_cutoff, inactive_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        "Move chat sessions inactive for longer than --inactive-days into ArchivedSession "
+        "(zstd-compressed transcripts) and delete their ChatSession/Message rows, then drop "
+        "legacy Chat rows that are already stored elsewhere. Runs one transaction per batch, "
+        "so it can be stopped at any point and re-run to resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive-days', type=int, default=getattr(settings, 'ARCHIVE_INACTIVE_DAYS', 30))
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'ARCHIVE_BATCH_SIZE', 200))
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Stop after this many batches (the next run continues)")
+        parser.add_argument('--time-limit', type=float, default=None,
+                            help="Stop starting new batches after this many seconds")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be archived")
+        parser.add_argument('--skip-legacy', action='store_true', help="Leave the legacy Chat table alone")
+
+    def handle(self, *args, **options):
+        cutoff = default_cutoff(options['inactive_days'])
+
+        if options['dry_run']:
+            self.stdout.write(f"{inactive_sessions(cutoff).count()} session(s) inactive since before {cutoff:%Y-%m-%d %H:%M}")
+            return
+
+        def progress(sessions, messages):
+            self.stdout.write(f"  archived {sessions} session(s), {messages} message(s)")
+
+        sessions, messages, done = compact_sessions(
+            cutoff,
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            time_limit=options['time_limit'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(f"Archived {sessions} session(s) with {messages} message(s)")
+        if not done:
+            self.stdout.write("Stopped early; run again to continue")
+            return
+
+        if not options['skip_legacy']:
+            deleted, pending = compact_legacy_chats(cutoff)
+            self.stdout.write(f"Deleted {deleted} legacy chat row(s)")
+            if pending:
+                self.stdout.write(
+                    f"{pending} user(s) have legacy chats not yet imported; run `manage.py migrate_legacy_chats` first"
+                )
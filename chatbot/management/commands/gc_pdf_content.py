@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.uploads import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Delete shared PDF content (file, chunk store, index, vectors) no upload refers to any more"
+
+    def handle(self, *args, **options):
+        collected = collect_garbage()
+        self.stdout.write(f"Collected {collected} unreferenced PDF content item(s)")
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+
+from chatbot.loadgen import run_load
+from chatbot.synthetic import make_pdf
+
+
+class Command(BaseCommand):
+    help = "Drive concurrent synthetic users (login, PDF upload, chat turns) against a running server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', default='http://127.0.0.1:8000', help="Base URL of the app under test")
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--turns', type=int, default=5, help="Chat turns per user")
+        parser.add_argument('--concurrency', type=int, default=10, help="Users active at the same time")
+        parser.add_argument('--stream', action='store_true', help="Chat through /chat/stream/ instead of POST /")
+        parser.add_argument('--pdf', help="PDF each user uploads (default: a synthetic one)")
+        parser.add_argument('--pdf-pages', type=int, default=20, help="Pages of the synthetic PDF")
+        parser.add_argument('--no-upload', action='store_true')
+        parser.add_argument('--think-time', type=float, default=0.0, help="Max random pause between turns (s)")
+        parser.add_argument('--timeout', type=float, default=120.0)
+        parser.add_argument('--user-prefix', default='loadtest_')
+        parser.add_argument('--output', help="Also write the report as JSON here")
+
+    def handle(self, *args, **options):
+        pdf_bytes = None
+        if not options['no_upload']:
+            if options['pdf']:
+                with open(options['pdf'], 'rb') as f:
+                    pdf_bytes = f.read()
+            else:
+                with tempfile.TemporaryDirectory() as tmp:
+                    with open(make_pdf(os.path.join(tmp, 'load.pdf'), options['pdf_pages']), 'rb') as f:
+                        pdf_bytes = f.read()
+
+        report = asyncio.run(run_load(options, pdf_bytes))
+
+        self.stdout.write(f"{options['users']} users x {options['turns']} turns, "
+                          f"concurrency {options['concurrency']}, {report['elapsed_s']:.1f}s")
+        self.stdout.write(f"{'endpoint':<22}{'reqs':>7}{'errs':>6}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for endpoint, stats in report['endpoints'].items():
+            self.stdout.write(
+                f"{endpoint:<22}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>8.1f}"
+                f"{stats['p50_ms']:>9.0f}{stats['p95_ms']:>9.0f}{stats['p99_ms']:>9.0f}"
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
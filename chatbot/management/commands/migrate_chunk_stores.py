@@ -0,0 +1,33 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot import hot_state
+from chatbot.chunk_cache import chunk_cache
+from chatbot.chunk_store import is_chunk_store, migrate_text_chunks, remove_legacy_files
+from chatbot.models import UploadedPDF
+
+
+class Command(BaseCommand):
+    help = "Convert legacy chunks_*.txt files to the binary chunk store (they are also read as-is)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-text', action='store_true', help="Leave the old .txt files in place")
+
+    def handle(self, *args, **options):
+        compress = getattr(settings, 'CHUNK_STORE_COMPRESS', False)
+        migrated = 0
+        for pdf in UploadedPDF.objects.exclude(faiss_index_path__isnull=True).exclude(faiss_index_path='').iterator():
+            path = pdf.faiss_index_path
+            if not os.path.exists(path) or is_chunk_store(path):
+                continue
+            new_path = migrate_text_chunks(path, compress=compress)
+            UploadedPDF.objects.filter(pk=pdf.pk).update(faiss_index_path=new_path)
+            chunk_cache.invalidate(path)
+            # update() sends no signal: drop the cached ready PDFs still holding the old path
+            hot_state.invalidate(pdf.user_id)
+            if not options['keep_text']:
+                remove_legacy_files(path)
+            migrated += 1
+        self.stdout.write(f"Migrated {migrated} chunk file(s)")
@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min
+
+from chatbot import hot_state
+from chatbot.models import ArchivedSession, Chat, ChatSession, Message
+from chatbot.rendering import RENDER_VERSION, render_markdown
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy legacy Chat rows that predate a user's first (possibly archived) session into an imported "
+        "ChatSession, which becomes the active one when the user has no (non-empty) active "
+        "session so the history stays on the chat page. Runs one transaction per user and "
+        "skips users already imported, so it is safe to re-run or resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help="Delete each user's legacy Chat rows once their history is in ChatSession/Message")
+
+    def handle(self, *args, **options):
+        # compact_sessions moves old sessions (imported ones included) into ArchivedSession
+        imported_users = set(
+            ChatSession.objects.filter(imported_from_legacy=True).values_list('user_id', flat=True)
+        ) | set(
+            ArchivedSession.objects.filter(imported_from_legacy=True).values_list('user_id', flat=True)
+        )
+        user_ids = Chat.objects.values_list('user_id', flat=True).distinct().order_by('user_id')
+        imported = sessions = deleted = 0
+
+        for user_id in user_ids:
+            with transaction.atomic():
+                if user_id not in imported_users:
+                    count = self.import_user(user_id)
+                    if count:
+                        imported += count
+                        sessions += 1
+                if options['delete']:
+                    # Rows after the cutoff were dual-written and already exist as Messages
+                    deleted += Chat.objects.filter(user_id=user_id).delete()[0]
+
+        self.stdout.write(f"Imported {imported} legacy chat(s) into {sessions} session(s); deleted {deleted} row(s)")
+
+    def import_user(self, user_id):
+        # Chats newer than the first real session were dual-written alongside Messages
+        firsts = [
+            model.objects.filter(user_id=user_id, imported_from_legacy=False)
+            .aggregate(first=Min('created_at'))['first']
+            for model in (ChatSession, ArchivedSession)
+        ]
+        cutoff = min((first for first in firsts if first is not None), default=None)
+        chats = Chat.objects.filter(user_id=user_id).order_by('created_at', 'id')
+        if cutoff is not None:
+            chats = chats.filter(created_at__lt=cutoff)
+        chats = list(chats)
+        if not chats:
+            return 0
+
+        # The chat page shows the active session only. Without one (or with an empty one, which
+        # used to show the legacy chats instead) the import becomes the active session;
+        # otherwise it is kept as an earlier, inactive session.
+        active = ChatSession.objects.filter(user_id=user_id, is_active=True).first()
+        if active is not None and not Message.objects.filter(session=active).exists():
+            ChatSession.objects.filter(pk=active.pk).update(is_active=False)
+            active = None
+        session = ChatSession.objects.create(user_id=user_id, is_active=active is None, imported_from_legacy=True)
+        turn = []
+        for chat in chats:
+            html = chat.response_html if chat.render_version == RENDER_VERSION else render_markdown(chat.response)
+            turn.append(Message(session=session, role='user', content=chat.message, timestamp=chat.created_at))
+            turn.append(Message(
+                session=session, role='assistant', content=chat.response,
+                content_html=html, render_version=RENDER_VERSION,
+                timestamp=chat.created_at + timedelta(microseconds=1),
+            ))
+        Message.objects.bulk_create(turn, batch_size=500)
+        ChatSession.objects.filter(pk=session.pk).update(
+            created_at=chats[0].created_at, updated_at=chats[-1].created_at
+        )
+        hot_state.invalidate(user_id)
+        return len(chats)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.benchmarks import (
+    BENCHMARKS, DEFAULT_TOLERANCE, find_regressions, load_results, run_benchmarks, write_results,
+)
+
+
+class Command(BaseCommand):
+    help = "Run the retrieval / ingestion / rendering micro-benchmarks and compare against a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="Run just these groups")
+        parser.add_argument('--quick', action='store_true', help="Smaller sizes (CI smoke run)")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark (median reported)")
+        parser.add_argument('--output', help="Write the results JSON here")
+        parser.add_argument('--baseline', help="Results JSON of an earlier run to check for regressions")
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                            help="Allowed slowdown vs the baseline before failing (0.25 = 25%%)")
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            only=options['only'], quick=options['quick'], repeat=options['repeat'], log=self.stdout.write,
+        )
+        if options['output']:
+            write_results(results, options['output'])
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            regressions = find_regressions(results, load_results(options['baseline']), options['tolerance'])
+            for name, before, after, ratio in regressions:
+                self.stderr.write(f"REGRESSION {name}: {before:.2f} ms -> {after:.2f} ms ({ratio:.2f}x)")
+            if regressions:
+                raise CommandError(f"{len(regressions)} benchmark(s) slower than the baseline")
+            self.stdout.write("No regressions against the baseline")
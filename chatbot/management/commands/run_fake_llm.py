@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.fake_llm import FakeLLMConfig, FakeLLMServer
+
+
+class Command(BaseCommand):
+    help = "Serve a fake OpenAI-compatible /v1/chat/completions API for load tests (set LLM_BASE_URL to it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.3, help="Seconds before the first token")
+        parser.add_argument('--jitter', type=float, default=0.1, help="+/- seconds of random latency noise")
+        parser.add_argument('--tokens-per-second', type=float, default=50.0, help="0 = whole reply at once")
+        parser.add_argument('--response-tokens', type=int, default=60)
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests that fail (0-1)")
+        parser.add_argument('--error-status', type=int, default=500, help="HTTP status of injected failures")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        config = FakeLLMConfig(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            tokens_per_second=options['tokens_per_second'],
+            response_tokens=options['response_tokens'],
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            seed=options['seed'],
+        )
+        server = FakeLLMServer((options['host'], options['port']), config)
+        self.stdout.write(f"Fake LLM listening on http://{options['host']}:{options['port']}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {config.requests} request(s), {config.errors} injected error(s)")
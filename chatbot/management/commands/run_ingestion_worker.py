@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.ingestion import requeue_stale_jobs, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Process queued PDF ingestion jobs (use with INGESTION_MODE=worker)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--stale-after', type=int, default=3600,
+                            help="Requeue 'running' jobs started more than this many seconds ago")
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        while True:
+            ran = run_pending_jobs()
+            if ran:
+                self.stdout.write(f"Processed {ran} job(s)")
+            if options['once']:
+                break
+            if not ran:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,234 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+
+# Seconds; covers fast DB phases up to slow LLM turns
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Phase timings of the request being handled (None outside of MetricsMiddleware)
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', False)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+# ---------------------------
+#  Metric types (process-local)
+# ---------------------------
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, values)} {total}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_labels(self.label_names, values, [("le", bound)])} {count}')
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, values, [("le", "+Inf")])} {series[-1]}')
+                lines.append(f'{self.name}_sum{_labels(self.label_names, values)} {series[-2]}')
+                lines.append(f'{self.name}_count{_labels(self.label_names, values)} {series[-1]}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'chatbot_request_duration_seconds', 'Request latency by view', ['view', 'method', 'status'])
+PHASE_SECONDS = Histogram(
+    'chatbot_phase_duration_seconds', 'Time spent per phase (db, retrieval, llm, render, ingest_*)', ['phase'])
+LLM_REQUESTS = Counter('chatbot_llm_requests_total', 'LLM calls by outcome (ok, error, cached, rejected)', ['outcome'])
+LLM_TOKENS = Counter('chatbot_llm_tokens_total', 'LLM tokens reported by the provider', ['kind'])
+LLM_MODEL_REPLIES = Counter('chatbot_llm_model_replies_total', 'Replies by the model that answered', ['model'])
+LLM_HEDGES = Counter('chatbot_llm_hedged_requests_total', 'Hedged turns by the request that won', ['winner'])
+INGESTED_PAGES = Counter('chatbot_ingested_pages_total', 'PDF pages ingested')
+METRICS = [REQUEST_SECONDS, PHASE_SECONDS, LLM_REQUESTS, LLM_TOKENS, LLM_MODEL_REPLIES, LLM_HEDGES, INGESTED_PAGES]
+
+
+# ---------------------------
+#  Timing spans
+# ---------------------------
+class RequestTimings:
+    def __init__(self):
+        self.phases = {}  # phase -> [seconds, count]
+
+    def add(self, phase, seconds):
+        entry = self.phases.setdefault(phase, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def server_timing(self, total=None):
+        """Server-Timing header value, durations in ms"""
+        parts = [f'{phase};dur={seconds * 1000:.1f}' for phase, (seconds, _) in self.phases.items()]
+        if total is not None:
+            parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def record(phase, seconds):
+    PHASE_SECONDS.observe(seconds, phase)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def _span(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+_NOOP = nullcontext()
+
+
+def span(phase):
+    """
+    `with metrics.span('retrieval'): ...` times a phase into the phase histogram
+    and, inside a request, its Server-Timing header. A shared no-op when disabled.
+    """
+    if not enabled():
+        return _NOOP
+    return _span(phase)
+
+
+def count_llm(outcome, usage=None):
+    if not enabled():
+        return
+    LLM_REQUESTS.inc(outcome)
+    if usage is not None:
+        LLM_TOKENS.inc('prompt', amount=getattr(usage, 'prompt_tokens', 0) or 0)
+        LLM_TOKENS.inc('completion', amount=getattr(usage, 'completion_tokens', 0) or 0)
+
+
+def count_model(model):
+    if enabled() and model:
+        LLM_MODEL_REPLIES.inc(model)
+
+
+def count_hedge(winner):
+    if enabled():
+        LLM_HEDGES.inc(winner)
+
+
+def count_pages(pages):
+    if enabled():
+        INGESTED_PAGES.inc(amount=pages)
+
+
+def time_query(execute, sql, params, many, context):
+    """connection.execute_wrapper: every ORM query counts towards the 'db' phase"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - started)
+
+
+# ---------------------------
+#  Exposition
+# ---------------------------
+def _cache_lines(prefix, help_name, stats):
+    lines = []
+    for key, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('stores', 'counter')):
+        if key in stats:
+            name = f'{prefix}_{key}_total'
+            lines += [f'# HELP {name} {help_name} {key}', f'# TYPE {name} {kind}', f'{name} {stats[key]}']
+    name = f'{prefix}_hit_ratio'
+    lines += [f'# HELP {name} {help_name} hit ratio', f'# TYPE {name} gauge', f'{name} {stats["hit_ratio"]}']
+    return lines
+
+
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def _gateway_lines(stats):
+    def sample(name, kind, help, value):
+        return [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+    lines = []
+    lines += sample('chatbot_llm_in_flight', 'gauge', 'LLM calls holding a gateway slot', stats['in_flight'])
+    lines += sample('chatbot_llm_queue_depth', 'gauge', 'Requests waiting for a gateway slot', stats['queue_depth'])
+    lines += sample('chatbot_llm_max_concurrency', 'gauge', 'Gateway slot limit', stats['max_concurrency'])
+    lines += sample('chatbot_llm_breaker_state', 'gauge', 'Circuit breaker (0 closed, 1 half-open, 2 open)',
+                    BREAKER_STATES[stats['breaker_state']])
+    lines += sample('chatbot_llm_retries_total', 'counter', 'Upstream calls retried', stats['retries'])
+    name = 'chatbot_llm_rejected_total'
+    lines += [f'# HELP {name} Requests shed by the gateway', f'# TYPE {name} counter',
+              f'{name}{{reason="queue"}} {stats["rejected_queue"]}',
+              f'{name}{{reason="breaker"}} {stats["rejected_breaker"]}']
+    return lines
+
+
+def _latency_lines(snapshot):
+    lines = []
+    for stat in ('ewma', 'p95'):
+        name = f'chatbot_llm_latency_{stat}_seconds'
+        lines += [f'# HELP {name} Rolling chat completion latency per model ({stat})', f'# TYPE {name} gauge']
+        lines += [f'{name}{_labels(["model"], [model])} {values[stat]}'
+                  for model, values in snapshot.items() if values[stat] is not None]
+    return lines
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format"""
+    from . import llm_cache
+    from .chunk_cache import chunk_cache
+    from .llm_gateway import get_gateway
+    from .routing import tracker
+
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _cache_lines('chatbot_chunk_cache', 'Chunk cache', chunk_cache.stats())
+    lines += _cache_lines('chatbot_llm_cache', 'LLM response cache', llm_cache.stats())
+    lines += _gateway_lines(get_gateway().stats())
+    lines += _latency_lines(tracker.snapshot())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_rendered_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='imported_from_legacy',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_legacy_chat_import'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='chat_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', '-updated_at'], name='session_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'timestamp', 'message_id'], name='message_session_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedpdf',
+            index=models.Index(fields=['user', 'status', 'id'], name='pdf_user_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_pdf_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='model',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
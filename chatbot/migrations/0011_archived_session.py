@@ -0,0 +1,46 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0010_message_model'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSession',
+            fields=[
+                ('session_id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('imported_from_legacy', models.BooleanField(default=False)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('transcript', models.BinaryField()),
+            ],
+            options={
+                'ordering': ['-updated_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(condition=models.Q(('is_active', False)), fields=['updated_at', 'session_id'], name='session_inactive_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedsession',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedsession',
+            index=models.Index(fields=['user', '-updated_at'], name='archived_user_updated_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 # Existing Chat model (keeping for backward compatibility)
@@ -8,6 +9,15 @@ class Chat(models.Model):
     message = models.TextField()  
     response = models.TextField() 
     created_at = models.DateTimeField(auto_now_add=True)
+    # Rendered markdown of `response`, produced by rendering.RENDER_VERSION
+    response_html = models.TextField(blank=True, default='')
+    render_version = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # legacy history page: filter(user=...).order_by('-created_at', '-id')
+            models.Index(fields=['user', 'created_at', 'id'], name='chat_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username}: {self.message}'
@@ -20,9 +30,28 @@ class ChatSession(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Rolling summary of turns that no longer fit the prompt's history budget
+    summary = models.TextField(blank=True, default='')
+    summary_upto = models.DateTimeField(blank=True, null=True)  # timestamp of the last summarized message
+    imported_from_legacy = models.BooleanField(default=False)  # created by `migrate_legacy_chats`
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # active session lookup: filter(user=..., is_active=True) ordered by -updated_at.
+            # Partial so it only holds active sessions (and matches Django's bare boolean WHERE).
+            models.Index(
+                fields=['user', '-updated_at'],
+                condition=models.Q(is_active=True),
+                name='session_user_active_idx',
+            ),
+            # compaction: inactive sessions by last activity (`manage.py compact_sessions`)
+            models.Index(
+                fields=['updated_at', 'session_id'],
+                condition=models.Q(is_active=False),
+                name='session_inactive_updated_idx',
+            ),
+        ]
     
     def __str__(self):
         return f'Session {self.session_id} - {self.user.username}'
@@ -40,22 +69,115 @@ class Message(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set on insert; not auto_now_add so imported/bulk-created turns can carry their own time
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # Rendered markdown of `content` (assistant messages), produced by rendering.RENDER_VERSION
+    content_html = models.TextField(blank=True, default='')
+    render_version = models.PositiveSmallIntegerField(default=0)
+    # Model that produced an assistant reply (blank for user turns and cached replies)
+    model = models.CharField(max_length=100, blank=True, default='')
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # session history + keyset pagination on (timestamp, message_id)
+            models.Index(fields=['session', 'timestamp', 'message_id'], name='message_session_ts_idx'),
+        ]
     
     def __str__(self):
         return f'{self.role}: {self.content[:50]}...'
 
 
+# 🆕 Cold storage for inactive sessions: the transcript as one zstd-compressed JSON blob
+class ArchivedSession(models.Model):
+    session_id = models.UUIDField(primary_key=True, editable=False)  # id of the ChatSession it replaced
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()  # last activity of the session
+    archived_at = models.DateTimeField(default=timezone.now)
+    summary = models.TextField(blank=True, default='')
+    imported_from_legacy = models.BooleanField(default=False)
+    message_count = models.PositiveIntegerField(default=0)
+    transcript = models.BinaryField()  # see archive.encode_transcript
+
+    class Meta:
+        ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user', '-updated_at'], name='archived_user_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'Archived session {self.session_id} - {self.message_count} messages'
+
+
+# 🆕 One stored copy of a PDF's bytes (by SHA-256), shared by every upload of it
+class PdfContent(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to="pdfs/")
+    size = models.BigIntegerField(default=0)
+    # Chunk store (+ index/vectors next to it) once the content has been ingested
+    chunks_path = models.CharField(max_length=255, blank=True, null=True)
+    # Number of UploadedPDF rows pointing here; artifacts are deleted when it drops to 0
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.sha256[:12]} ({self.ref_count} refs)'
+
+
 # 🆕 New model for uploaded PDFs
 class UploadedPDF(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)  
     file = models.FileField(upload_to="pdfs/")   # stored in MEDIA_ROOT/pdfs/
     uploaded_at = models.DateTimeField(auto_now_add=True)
     faiss_index_path = models.CharField(max_length=255, blank=True, null=True)  
     # optional: store path to FAISS index for this PDF
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # Name the user uploaded it under (file.name is the shared content-addressed copy)
+    original_name = models.CharField(max_length=255, blank=True, default='')
+    # Shared, content-addressed file + artifacts (null for uploads from before dedup)
+    content = models.ForeignKey(
+        PdfContent, on_delete=models.SET_NULL, blank=True, null=True, related_name='uploads'
+    )
+
+    class Meta:
+        indexes = [
+            # latest ready document: filter(user=..., status='ready').last() (ordered by -id)
+            models.Index(fields=['user', 'status', 'id'], name='pdf_user_status_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.file.name}'
+
+
+# 🆕 Background ingestion job for an uploaded PDF
+class IngestionJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    pdf = models.ForeignKey(UploadedPDF, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    pages_total = models.PositiveIntegerField(default=0)
+    pages_done = models.PositiveIntegerField(default=0)
+    chunks_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'Job {self.id} ({self.status}) - {self.pdf.file.name}'
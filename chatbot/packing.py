@@ -0,0 +1,129 @@
+"""
+RAG context packing. Retrieved chunks overlap (CHUNK_OVERLAP characters of each
+chunk repeat the end of the previous one), so chunks that touch or overlap in
+the source document are merged into one passage by their stored offsets, and
+passages are added greedily by score until the token budget is spent.
+"""
+import os
+
+from .history import count_tokens
+
+# Chunk offsets index the document's non-empty lines joined by "\n": a gap of one
+# character between two chunks is just that line break.
+ADJACENT_GAP = 1
+
+
+class Passage:
+    """A contiguous stretch of one document, built from one or more chunks"""
+
+    def __init__(self, chunk, span):
+        self.pdf = chunk.pdf
+        self.score = chunk.score
+        self.page_start, self.page_end, self.start, self.end = span
+        self.text = chunk.text
+
+    def absorb(self, chunk, span):
+        """Extend with a chunk starting at or just after this passage's end"""
+        page_start, page_end, start, end = span
+        if start - self.end == ADJACENT_GAP:
+            self.text += "\n" + chunk.text
+        elif end > self.end:
+            self.text += chunk.text[self.end - start:]
+        self.page_start = min(self.page_start, page_start)
+        self.page_end = max(self.page_end, page_end)
+        self.end = max(self.end, end)
+        self.score = max(self.score, chunk.score)
+
+    def label(self):
+        name = self.pdf.original_name or os.path.basename(self.pdf.file.name)
+        if not self.page_start:
+            return f"[Source: {name}]"
+        pages = f"p. {self.page_start}" if self.page_start == self.page_end else f"pp. {self.page_start}-{self.page_end}"
+        return f"[Source: {name}, {pages}]"
+
+    def render(self):
+        return f"{self.label()}\n{self.text}"
+
+
+def _known(span):
+    # Page 0 marks chunks migrated from stores that never recorded offsets
+    return span is not None and span[0] > 0
+
+
+def _passages(selected):
+    """Merge the selected (chunk, span) pairs of each document into passages"""
+    passages = []
+    by_pdf = {}
+    for chunk, span in selected:
+        if _known(span):
+            by_pdf.setdefault(chunk.pdf_id, []).append((chunk, span))
+        else:
+            passages.append(Passage(chunk, (0, 0, 0, 0)))
+    for chunks in by_pdf.values():
+        chunks.sort(key=lambda item: item[1][2])
+        current = None
+        for chunk, span in chunks:
+            if current is not None and span[2] - current.end <= ADJACENT_GAP:
+                current.absorb(chunk, span)
+            else:
+                current = Passage(chunk, span)
+                passages.append(current)
+    return passages
+
+
+def _new_text(chunk, span, covered):
+    """The part of chunk's text not already covered by selected chunks of the same document"""
+    if not _known(span):
+        return chunk.text
+    _, _, start, end = span
+    pieces, cursor = [], start
+    for covered_start, covered_end in sorted(covered):
+        if covered_end <= cursor or covered_start >= end:
+            continue
+        if covered_start > cursor:
+            pieces.append(chunk.text[cursor - start:covered_start - start])
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        pieces.append(chunk.text[cursor - start:])
+    return "".join(pieces)
+
+
+def pack(results, budget, count=count_tokens):
+    """
+    Passages for the prompt from score-ordered RetrievedChunks: each chunk is
+    charged only for text not already selected (plus a source label when it
+    starts a new passage), and skipped when it no longer fits the budget.
+    Returns passages, best first.
+    """
+    selected, used = [], 0
+    covered = {}  # pdf_id -> [(start, end)] of selected chunks with known offsets
+    seen_texts = set()
+    for chunk in results:
+        span = chunk.span
+        if not _known(span) and chunk.text in seen_texts:
+            continue
+        text = _new_text(chunk, span, covered.get(chunk.pdf_id, ()))
+        if not text.strip():
+            continue  # already fully included via its neighbours
+        joins = _known(span) and any(
+            span[2] - ADJACENT_GAP <= end and start - ADJACENT_GAP <= span[3]
+            for start, end in covered.get(chunk.pdf_id, ())
+        )
+        cost = count(text)
+        if not joins:
+            cost += count(Passage(chunk, span if _known(span) else (0, 0, 0, 0)).label()) + 1
+        if used + cost > budget:
+            continue
+        used += cost
+        selected.append((chunk, span))
+        seen_texts.add(chunk.text)
+        if _known(span):
+            covered.setdefault(chunk.pdf_id, []).append((span[2], span[3]))
+
+    passages = _passages(selected)
+    passages.sort(key=lambda passage: passage.score, reverse=True)
+    return passages
+
+
+def render(passages):
+    return "\n\n".join(passage.render() for passage in passages)
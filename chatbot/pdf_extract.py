@@ -0,0 +1,78 @@
+"""
+Page text extraction, serial or sharded across a process pool.
+
+Kept free of Django imports: pool workers are started with 'spawn' and only
+need to import this module and PyPDF2.
+"""
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def extract_range(pdf_path, first, last):
+    """Text of pages [first, last) (0-based); runs in a pool worker with its own reader"""
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(first, last)]
+
+
+def get_pool(workers):
+    """Process-wide pool, recreated only if the worker count changes"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # 'spawn', not fork: the parent holds DB connections and running threads
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+
+def iter_pages_serial(reader):
+    for page_no, page in enumerate(reader.pages, start=1):
+        yield page_no, page.extract_text() or ""
+
+
+def iter_pages_parallel(pdf_path, pages_total, workers, shard_size):
+    """
+    Yield (page_no, text) in page order while shards of shard_size pages are
+    extracted by `workers` processes. At most 2 * workers shards are in flight,
+    so finished-but-unconsumed text stays bounded.
+    """
+    pool = get_pool(workers)
+    shards = deque((first, min(first + shard_size, pages_total)) for first in range(0, pages_total, shard_size))
+    in_flight = deque()
+    try:
+        while shards or in_flight:
+            while shards and len(in_flight) < 2 * workers:
+                first, last = shards.popleft()
+                in_flight.append((first, pool.submit(extract_range, pdf_path, first, last)))
+            first, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield first + offset + 1, text
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+
+
+def iter_pages(pdf_path, reader, workers=1, min_pages=64, shard_size=None):
+    """
+    (page_no, text) for every page, in order. Files with fewer than min_pages
+    pages (or workers <= 1) are read serially: spinning up workers and reopening
+    the file in each costs more than it saves on small documents.
+    """
+    pages_total = len(reader.pages)
+    if workers <= 1 or pages_total < max(min_pages, 2):  # a single page can't be split
+        return iter_pages_serial(reader)
+    if shard_size is None:
+        # Every shard re-opens (re-parses) the file: ~4 shards per worker balances
+        # that cost against stragglers at the end
+        shard_size = max(16, -(-pages_total // (4 * workers)))
+    return iter_pages_parallel(pdf_path, pages_total, workers, shard_size)
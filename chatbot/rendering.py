@@ -0,0 +1,29 @@
+import markdown2
+
+MARKDOWN_EXTRAS = ["fenced-code-blocks", "tables", "strike", "cuddled-lists"]
+
+# Bump when the renderer or its extras change; stored HTML with an older
+# version is re-rendered lazily on read (or in bulk by `backfill_rendered_html`).
+RENDER_VERSION = 1
+
+
+def render_markdown(text):
+    return markdown2.markdown(text, extras=MARKDOWN_EXTRAS)
+
+
+def message_html(msg, stale):
+    """Stored HTML of an assistant Message, re-rendering it (and collecting it in `stale`) if outdated"""
+    if msg.render_version != RENDER_VERSION:
+        msg.content_html = render_markdown(msg.content)
+        msg.render_version = RENDER_VERSION
+        stale.append(msg)
+    return msg.content_html
+
+
+def chat_html(chat, stale):
+    """Stored HTML of a legacy Chat response, re-rendering it if outdated"""
+    if chat.render_version != RENDER_VERSION:
+        chat.response_html = render_markdown(chat.response)
+        chat.render_version = RENDER_VERSION
+        stale.append(chat)
+    return chat.response_html
@@ -0,0 +1,265 @@
+import heapq
+import json
+import math
+import os
+import re
+import uuid
+from collections import Counter
+from difflib import SequenceMatcher
+
+from django.conf import settings
+
+INDEX_VERSION = 1
+CHUNK_SEPARATOR = "---CHUNK_SEPARATOR---"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """Lowercase word tokens used for both indexing and querying"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def index_path_for(chunks_path):
+    """chunks_12.txt -> chunks_12.index.json (stored next to the chunks file)"""
+    root, _ = os.path.splitext(chunks_path)
+    return f"{root}.index.json"
+
+
+def temp_path_for(path):
+    """Unique sibling temp file for an atomic write; concurrent writers of `path` never share one"""
+    return f"{path}.{uuid.uuid4().hex}.tmp"
+
+
+# ---------------------------
+#  BM25 Inverted Index
+# ---------------------------
+class BM25Index:
+    """
+    Term -> postings index over a fixed list of chunks.
+
+    Postings are stored as {term: [[chunk_id, term_freq], ...]} together with
+    the token length of every chunk, so a query only touches the postings of
+    its own terms instead of scanning every chunk.
+    """
+
+    def __init__(self, postings, doc_lens, k1=1.5, b=0.75):
+        self.postings = postings
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(doc_lens)
+        self.avgdl = (sum(doc_lens) / self.doc_count) if self.doc_count else 0.0
+
+    @classmethod
+    def build(cls, chunks):
+        builder = BM25Builder()
+        for chunk in chunks:
+            builder.add(chunk)
+        return builder.build()
+
+    def to_dict(self):
+        return {
+            "version": INDEX_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "doc_lens": self.doc_lens,
+            "postings": self.postings,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version: {data.get('version')}")
+        return cls(data["postings"], data["doc_lens"], k1=data["k1"], b=data["b"])
+
+    def save(self, path):
+        tmp_path = temp_path_for(path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+
+    def score(self, query):
+        """Return {chunk_id: bm25_score} for chunks sharing a term with the query"""
+        scores = {}
+        if not self.doc_count:
+            return scores
+        k1, b, avgdl = self.k1, self.b, self.avgdl or 1.0
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for chunk_id, tf in postings:
+                norm = k1 * (1 - b + b * self.doc_lens[chunk_id] / avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, top_k=3):
+        """Top-k (score, chunk_id) pairs, best first"""
+        scores = self.score(query)
+        return heapq.nlargest(top_k, ((s, i) for i, s in scores.items()))
+
+
+class BM25Builder:
+    """Accumulates postings one chunk at a time, so chunk text needn't be kept around"""
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_lens = []
+
+    def add(self, chunk):
+        chunk_id = len(self.doc_lens)
+        tokens = tokenize(chunk)
+        self.doc_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, []).append([chunk_id, tf])
+
+    def build(self):
+        return BM25Index(self.postings, self.doc_lens)
+
+
+# ---------------------------
+#  Index persistence helpers
+# ---------------------------
+def build_index(chunks, chunks_path):
+    """Build a BM25 index for the chunks and persist it next to the chunks file"""
+    index = BM25Index.build(chunks)
+    index.save(index_path_for(chunks_path))
+    return index
+
+
+def load_index(chunks_path, chunks=None):
+    """
+    Load the persisted index for a chunks file.
+    Legacy uploads without an index get one built (and saved) on first use, and
+    an unreadable index or one covering a different number of chunks is rebuilt.
+    """
+    path = index_path_for(chunks_path)
+    if os.path.exists(path):
+        try:
+            index = BM25Index.load(path)
+            if chunks is None or index.doc_count == len(chunks):
+                return index
+            print(f"Rebuilding stale index {path}: {index.doc_count} chunks indexed, {len(chunks)} stored")
+        except (ValueError, KeyError, json.JSONDecodeError) as e:
+            print(f"Rebuilding unreadable index {path}: {str(e)}")
+    if chunks is None:
+        return None
+    return build_index(chunks, chunks_path)
+
+
+# ---------------------------
+#  Query-time retrieval
+# ---------------------------
+def rerank(query, candidates, get_text):
+    """
+    Rerank BM25 candidates with the (expensive) sequence similarity.
+    candidates: list of (bm25_score, key), best first; get_text(key) returns the chunk text.
+    """
+    if not candidates:
+        return []
+    query_lower = query.lower()
+    best = candidates[0][0] or 1.0
+    reranked = []
+    for bm25_score, key in candidates:
+        sequence_similarity = SequenceMatcher(None, query_lower, get_text(key).lower()).ratio()
+        combined_score = (bm25_score / best) * 0.7 + sequence_similarity * 0.3
+        reranked.append((combined_score, key))
+    reranked.sort(key=lambda x: x[0], reverse=True)
+    return reranked
+
+
+def search_chunks(query, chunks, index, top_k=3, rerank_candidates=None):
+    """Return the top_k chunk ids for the query, optionally reranked"""
+    if rerank_candidates is None:
+        rerank_candidates = getattr(settings, "RAG_RERANK_CANDIDATES", 0)
+    candidates = index.search(query, max(top_k, rerank_candidates))
+    if rerank_candidates:
+        candidates = rerank(query, candidates, chunks.__getitem__)
+    return [chunk_id for _, chunk_id in candidates[:top_k]]
+
+
+# ---------------------------
+#  Merged multi-document index
+# ---------------------------
+class MergedIndex:
+    """
+    BM25 across several documents' indexes using corpus-wide statistics.
+
+    Only aggregate statistics (document frequency per term, chunk count, total
+    length) are kept here; postings stay in each document's BM25Index. Adding
+    or removing a document adjusts the aggregates without touching the others.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}  # doc_id -> (signature, chunk_count, total_len, {term: df})
+        self.df = Counter()
+        self.doc_count = 0
+        self.total_len = 0
+
+    def add(self, doc_id, signature, index):
+        self.remove(doc_id)
+        doc_freqs = {term: len(postings) for term, postings in index.postings.items()}
+        total_len = sum(index.doc_lens)
+        self.docs[doc_id] = (signature, index.doc_count, total_len, doc_freqs)
+        self.df.update(doc_freqs)
+        self.doc_count += index.doc_count
+        self.total_len += total_len
+
+    def remove(self, doc_id):
+        entry = self.docs.pop(doc_id, None)
+        if entry is None:
+            return
+        _, chunk_count, total_len, doc_freqs = entry
+        self.df.subtract(doc_freqs)
+        for term in doc_freqs:
+            if self.df[term] <= 0:
+                del self.df[term]
+        self.doc_count -= chunk_count
+        self.total_len -= total_len
+
+    def signature(self, doc_id):
+        entry = self.docs.get(doc_id)
+        return entry[0] if entry else None
+
+    def search(self, query, indexes, top_k=3):
+        """
+        Top-k (score, (doc_id, chunk_id)) across documents, best first.
+        indexes: {doc_id: BM25Index}. Selection uses a bounded min-heap of size top_k.
+        """
+        if not self.doc_count:
+            return []
+        k1, b = self.k1, self.b
+        avgdl = (self.total_len / self.doc_count) or 1.0
+        terms = []
+        for term in set(tokenize(query)):
+            df = self.df.get(term)
+            if df:
+                terms.append((term, math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))))
+
+        heap = []
+        for doc_id, index in indexes.items():
+            scores = {}
+            for term, idf in terms:
+                for chunk_id, tf in index.postings.get(term, ()):
+                    norm = k1 * (1 - b + b * index.doc_lens[chunk_id] / avgdl)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+            for chunk_id, score in scores.items():
+                item = (score, (doc_id, chunk_id))
+                if len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        return sorted(heap, reverse=True)
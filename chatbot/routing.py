@@ -0,0 +1,277 @@
+"""
+Latency-aware model routing with hedged requests. Each configured model keeps a
+rolling latency estimate (EWMA + p95); a turn goes to the fastest one and, if it
+has not answered after the hedge delay, a second request goes to the
+next-fastest. The first answer wins and the other request is cancelled.
+"""
+import asyncio
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from . import metrics
+from .llm import CHAT_MODEL
+from .llm_gateway import get_gateway, is_upstream_failure
+
+EWMA_ALPHA = 0.2
+WINDOW = 200  # samples per model for the p95
+MIN_P95_SAMPLES = 20
+FALLBACK_HEDGE_DELAY = 2.0  # seconds, until the primary has enough samples for a p95
+
+Reply = namedtuple('Reply', ['content', 'model', 'usage'])
+
+
+def chat_models():
+    return list(getattr(settings, 'LLM_MODELS', None) or [CHAT_MODEL])
+
+
+# ---------------------------
+#  Latency tracking
+# ---------------------------
+class LatencyTracker:
+    def __init__(self, alpha=EWMA_ALPHA, window=WINDOW):
+        self.alpha = alpha
+        self.window = window
+        self._ewma = {}
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, seconds):
+        with self._lock:
+            previous = self._ewma.get(model)
+            self._ewma[model] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def failure(self, model, seconds, exc):
+        """
+        An upstream failure (timeout, connection error, 5xx) counts as at least as
+        slow as the request timeout. Anything else (a 4xx, a breaker or queue
+        shedding the call locally) says nothing about the model's speed.
+        """
+        if is_upstream_failure(exc):
+            self.observe(model, max(seconds, get_gateway().timeout))
+
+    def ewma(self, model):
+        with self._lock:
+            return self._ewma.get(model)
+
+    def p95(self, model):
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < MIN_P95_SAMPLES:
+            return None
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def ranked(self, models):
+        """Fastest first; models without samples keep their configured order, after measured ones"""
+        order = {model: i for i, model in enumerate(models)}
+        return sorted(models, key=lambda m: (self.ewma(m) is None, self.ewma(m) or 0.0, order[m]))
+
+    def snapshot(self):
+        return {model: {'ewma': self.ewma(model), 'p95': self.p95(model)} for model in chat_models()}
+
+    def clear(self):
+        with self._lock:
+            self._ewma.clear()
+            self._samples.clear()
+
+
+tracker = LatencyTracker()
+
+
+def hedge_delay(model):
+    """Seconds to wait on `model` before hedging; None when hedging is off"""
+    value = str(getattr(settings, 'LLM_HEDGE_DELAY', 'p95')).strip().lower()
+    if value in ('', 'off', '0'):
+        return None
+    if value == 'p95':
+        return tracker.p95(model) or FALLBACK_HEDGE_DELAY
+    return float(value)
+
+
+def plan():
+    """(ranked models, hedge delay or None) for the next turn"""
+    models = tracker.ranked(chat_models())
+    delay = hedge_delay(models[0]) if len(models) > 1 else None
+    return models, delay
+
+
+def _reply(completion, model):
+    return Reply(completion.choices[0].message.content.strip(), model, getattr(completion, 'usage', None))
+
+
+# ---------------------------
+#  Sync (worker threads)
+# ---------------------------
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = 2 * getattr(settings, 'LLM_MAX_CONCURRENCY', 16)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-hedge')
+    return _executor
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Attempt:
+    """One streamed request of a hedged pair; cancel() closes its HTTP response"""
+
+    def __init__(self, model):
+        self.model = model
+        self.cancelled = threading.Event()
+        self.stream = None
+
+    def cancel(self):
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def run(self, client, messages, **kwargs):
+        gateway = get_gateway()
+        started = time.monotonic()
+        parts, usage = [], None
+        try:
+            # Streamed so a losing request can be cut off from another thread
+            self.stream = gateway.call(lambda: client.chat.completions.create(
+                model=self.model, messages=messages, timeout=gateway.timeout,
+                stream=True, stream_options={"include_usage": True}, **kwargs,
+            ))
+            for chunk in self.stream:
+                if self.cancelled.is_set():
+                    raise _Cancelled()
+                usage = getattr(chunk, 'usage', None) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+            if self.cancelled.is_set():
+                raise _Cancelled()
+        except Exception as exc:
+            if self.cancelled.is_set():
+                raise _Cancelled()
+            tracker.failure(self.model, time.monotonic() - started, exc)
+            raise
+        finally:
+            if self.stream is not None:
+                self.stream.close()
+        tracker.observe(self.model, time.monotonic() - started)
+        return Reply("".join(parts).strip(), self.model, usage)
+
+
+def _single(client, model, messages, **kwargs):
+    gateway = get_gateway()
+    with gateway.slot():
+        started = time.monotonic()
+        try:
+            completion = gateway.call(lambda: client.chat.completions.create(
+                model=model, messages=messages, timeout=gateway.timeout, **kwargs,
+            ))
+        except Exception as exc:
+            tracker.failure(model, time.monotonic() - started, exc)
+            raise
+    tracker.observe(model, time.monotonic() - started)
+    return _reply(completion, model)
+
+
+def complete(client, messages, **kwargs):
+    """
+    Chat completion from the fastest model, hedged to the next-fastest after the
+    hedge delay (or at once if the first one fails). Returns a Reply.
+    """
+    models, delay = plan()
+    if delay is None:
+        return _single(client, models[0], messages, **kwargs)
+
+    gateway = get_gateway()
+    executor = _get_executor()
+    with gateway.slot():
+        primary = _Attempt(models[0])
+        futures = {executor.submit(primary.run, client, messages, **kwargs): primary}
+        hedge_slot = False
+        try:
+            done, _ = wait(futures, timeout=delay)
+            if not done or next(iter(done)).exception() is not None:
+                # A hedge only uses a spare slot: it must not queue behind real turns
+                hedge_slot = gateway.try_slot()
+                if hedge_slot:
+                    hedge = _Attempt(models[1])
+                    futures[executor.submit(hedge.run, client, messages, **kwargs)] = hedge
+            pending, error = set(futures), None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if len(futures) > 1:
+                            metrics.count_hedge('primary' if futures[future] is primary else 'hedge')
+                        return future.result()
+                    error = error or future.exception()
+            raise error
+        finally:
+            for attempt in futures.values():
+                attempt.cancel()
+            if hedge_slot:
+                gateway.slots.release()
+
+
+# ---------------------------
+#  Async (event loop)
+# ---------------------------
+async def _acall(client, model, messages, **kwargs):
+    gateway = get_gateway()
+    started = time.monotonic()
+    try:
+        completion = await gateway.acall(lambda: client.chat.completions.create(
+            model=model, messages=messages, timeout=gateway.timeout, **kwargs,
+        ))
+    except Exception as exc:
+        tracker.failure(model, time.monotonic() - started, exc)
+        raise
+    tracker.observe(model, time.monotonic() - started)
+    return _reply(completion, model)
+
+
+async def acomplete(client, messages, **kwargs):
+    """Async counterpart of complete(); the losing request's task is cancelled"""
+    models, delay = plan()
+    gateway = get_gateway()
+    async with gateway.aslot():
+        if delay is None:
+            return await _acall(client, models[0], messages, **kwargs)
+
+        primary = asyncio.ensure_future(_acall(client, models[0], messages, **kwargs))
+        tasks = {primary}
+        hedge_slot = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done or primary.exception() is not None:
+                hedge_slot = gateway.try_slot()
+                if hedge_slot:
+                    tasks.add(asyncio.ensure_future(_acall(client, models[1], messages, **kwargs)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            metrics.count_hedge('primary' if task is primary else 'hedge')
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if hedge_slot:
+                gateway.slots.release()
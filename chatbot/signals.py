@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import hot_state
+from .auth_backends import invalidate_user
+from .models import ChatSession, UploadedPDF
+from .uploads import release_content
+
+
+@receiver(post_delete, sender=UploadedPDF)
+def release_pdf_content(sender, instance, **kwargs):
+    """Deleting an upload (directly or via its user) drops its reference to the shared content"""
+    if instance.content_id:
+        release_content(instance.content_id)
+
+
+@receiver(post_save, sender=ChatSession)
+@receiver(post_delete, sender=ChatSession)
+@receiver(post_save, sender=UploadedPDF)
+@receiver(post_delete, sender=UploadedPDF)
+def invalidate_hot_state(sender, instance, **kwargs):
+    """New/changed sessions and uploads (incl. summaries, ingestion results) refresh the cached state"""
+    hot_state.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
@@ -0,0 +1,104 @@
+import random
+
+# Common words first; everything is plain ASCII letters, so no PDF string escaping needed
+WORDS = (
+    "the of and to in is for that on with as by this are from at be an or it "
+    "report revenue policy engine river mountain contract tenant invoice sensor "
+    "pressure valve latency throughput budget quarter forecast warranty clause "
+    "battery voltage module firmware customer shipment inventory supplier audit"
+).split()
+
+
+
+def _vocabulary(size=5000, seed=12345):
+    """WORDS followed by pronounceable pseudo-words; rank order drives the Zipf weights"""
+    rnd = random.Random(seed)
+    syllables = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+    vocabulary = list(WORDS)
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        word = "".join(rnd.choice(syllables) for _ in range(rnd.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+
+VOCABULARY = _vocabulary()
+# Zipf-like (1/rank) frequencies, roughly the shape of real text
+_CUM_WEIGHTS = []
+_total = 0.0
+for _rank in range(len(VOCABULARY)):
+    _total += 1.0 / (_rank + 1)
+    _CUM_WEIGHTS.append(_total)
+
+
+def synthetic_text(rnd, words=12):
+    return " ".join(rnd.choices(VOCABULARY, cum_weights=_CUM_WEIGHTS, k=words))
+
+
+def make_pdf(path, pages, lines_per_page=45, seed=0):
+    """
+    Write a deterministic text-only PDF of `pages` pages (Helvetica, one text
+    object per page) for ingestion benchmarks. Same arguments -> same bytes.
+    """
+    rnd = random.Random(seed)
+    font_obj = 3 + 2 * pages
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{3 + 2 * i} 0 R" for i in range(pages)), pages)).encode(),
+    ]
+    for i in range(pages):
+        lines = ["BT /F1 10 Tf 40 800 Td 14 TL"]
+        for _ in range(lines_per_page):
+            lines.append(f"({synthetic_text(rnd)} page{i + 1}) Tj T*")
+        lines.append("ET")
+        stream = "\n".join(lines).encode()
+        objects.append((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_obj} 0 R >> >> >>"
+        ).encode())
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+    return path
+
+
+def synthetic_chunks(count, words_per_chunk=150, seed=0):
+    """Deterministic chunk texts shaped like CHUNK_SIZE=1000 splitter output"""
+    rnd = random.Random(seed)
+    return [synthetic_text(rnd, words_per_chunk) for _ in range(count)]
+
+
+def synthetic_queries(count, seed=1):
+    rnd = random.Random(seed)
+    return [synthetic_text(rnd, rnd.randint(3, 8)) + "?" for _ in range(count)]
+
+
+def synthetic_markdown(rnd):
+    """An assistant-style answer: heading, paragraph, list, code block, table"""
+    items = "\n".join(f"- **{rnd.choice(WORDS)}**: {synthetic_text(rnd, 8)}" for _ in range(4))
+    rows = "\n".join(f"| {rnd.choice(WORDS)} | {rnd.randint(1, 999)} |" for _ in range(3))
+    return (
+        f"## {synthetic_text(rnd, 3).title()}\n\n{synthetic_text(rnd, 40)}\n\n{items}\n\n"
+        f"```python\nvalue = {rnd.randint(1, 99)}  # {synthetic_text(rnd, 4)}\n```\n\n"
+        f"| Name | Count |\n|------|-------|\n{rows}\n"
+    )
+
+
+def synthetic_answers(count, seed=2):
+    rnd = random.Random(seed)
+    return [synthetic_markdown(rnd) for _ in range(count)]
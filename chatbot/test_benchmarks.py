@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from .benchmarks import find_regressions, load_results, run_benchmarks, write_results
+from .synthetic import synthetic_chunks
+
+
+class BenchmarkSuiteTests(SimpleTestCase):
+    """
+    Smoke-runs the micro-benchmarks (quick sizes, one timed run each).
+    Set BENCHMARK_BASELINE=<results.json> to also fail on regressions against it;
+    full runs: `manage.py run_benchmarks --output results.json [--baseline old.json]`.
+    """
+
+    def test_corpus_is_deterministic(self):
+        self.assertEqual(synthetic_chunks(5), synthetic_chunks(5))
+        self.assertNotEqual(synthetic_chunks(5, seed=1), synthetic_chunks(5))
+
+    def test_suite_runs_and_round_trips(self):
+        results = run_benchmarks(quick=True, repeat=1)
+        self.assertEqual(
+            {name.split('[')[0] for name in results['results']}, {'retrieval', 'ingestion', 'rendering'}
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'results.json')
+            write_results(results, path)
+            self.assertEqual(load_results(path)['results'].keys(), results['results'].keys())
+
+        baseline_path = os.getenv('BENCHMARK_BASELINE')
+        if baseline_path:
+            regressions = find_regressions(results, load_results(baseline_path))
+            self.assertEqual(regressions, [], "benchmarks slower than the baseline")
+
+    def test_find_regressions(self):
+        baseline = {'results': {'a': {'min_ms': 10.0}, 'b': {'min_ms': 10.0}}}
+        current = {'results': {'a': {'min_ms': 12.0}, 'b': {'min_ms': 13.0}, 'new': {'min_ms': 1.0}}}
+        self.assertEqual([name for name, *_ in find_regressions(current, baseline, tolerance=0.25)], ['b'])
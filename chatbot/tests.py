@@ -1,3 +1,1817 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import closing
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipIf
 
-# Create your tests here.
+import httpx
+import numpy as np
+import openai
+from PyPDF2 import PdfReader
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .llm_gateway import CircuitOpen, GatewayBusy, LLMGateway, get_gateway, reset_gateway
+from . import archive, fake_llm, hot_state, llm_cache, loadgen, packing, pdf_extract, routing, vectors
+from .chunk_cache import ChunkCache, UserIndexRegistry, file_signature, user_indexes
+from .chunk_store import (
+    ChunkStore, ChunkWriter, TextChunks, chunk_store_path_for, is_chunk_store, open_chunks, spans_path_for,
+)
+from .chunking import Chunk, iter_chunks
+from .history import abuild_history, build_history, message_tokens, summary_message
+from .ingestion import claim_job, run_job
+from .retrieval import CHUNK_SEPARATOR, BM25Index, MergedIndex, build_index, index_path_for, load_index
+from .synthetic import make_pdf
+from .uploads import store_upload
+from .views import compose_messages, retrieve_context
+from .models import ArchivedSession, Chat, ChatSession, IngestionJob, Message, PdfContent, UploadedPDF
+from .rendering import RENDER_VERSION, render_markdown
+
+
+def make_message(session, role, content):
+    """Message as save_chat_turn writes it (assistant HTML rendered up front)"""
+    html = render_markdown(content) if role == 'assistant' else ''
+    return Message(session=session, role=role, content=content, content_html=html, render_version=RENDER_VERSION)
+
+
+class ViewTestCase(TestCase):
+    """Starts every test with empty caches (sessions, users and hot state outlive the DB rollback)"""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+
+def fake_completion(text="Hello **there**"):
+    client = mock.Mock()
+    client.chat.completions.create.return_value = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=text))]
+    )
+    return client
+
+
+# ---------------------------
+#  Query-count regression tests
+# ---------------------------
+@override_settings(CHAT_LEGACY_READ=False, CHAT_LEGACY_DUAL_WRITE=False)
+class HotPathQueryCountTests(ViewTestCase):
+    """
+    Exact query counts for the chat hot paths. If one of these fails, a view
+    started issuing more queries (often an N+1) - fix the view, don't bump the number.
+    Counts are for the steady state: the Django session, the user and the per-user
+    hot state (active session, ready PDFs) are already in the cache tier.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', password='pw')
+        cls.session = ChatSession.objects.create(user=cls.user)
+        Message.objects.bulk_create([
+            make_message(cls.session, 'user' if i % 2 == 0 else 'assistant', f'message {i}')
+            for i in range(40)
+        ])
+        UploadedPDF.objects.create(user=cls.user, file='pdfs/manual.pdf', status='ready')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.client.get(reverse('chatbot'))  # warm the caches
+
+    def add_messages(self, count):
+        Message.objects.bulk_create([
+            make_message(self.session, 'assistant', f'extra {i}') for i in range(count)
+        ])
+
+    def test_chatbot_view_get(self):
+        # one page of messages
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('chatbot'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_chatbot_view_get_is_independent_of_history_length(self):
+        self.add_messages(200)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('chatbot'))
+
+    def test_chatbot_view_post(self):
+        # history, then savepoint + bulk INSERT + updated_at UPDATE + release
+        client = fake_completion()
+        queries_before_llm = []
+
+        def create(**kwargs):
+            queries_before_llm.append(len(queries))
+            return mock.DEFAULT
+
+        client.chat.completions.create.side_effect = create
+        with CaptureQueriesContext(connection) as queries:
+            with mock.patch('chatbot.views.get_openrouter_client', return_value=client):
+                with self.assertNumQueries(5):
+                    response = self.client.post(reverse('chatbot'), {'message': 'hi'})
+        self.assertEqual(queries_before_llm, [1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Message.objects.filter(session=self.session).count(), 42)
+        self.assertEqual(response.json()['model'], 'openai/gpt-4o-mini')
+
+    def test_start_new_session(self):
+        # deactivate UPDATE, INSERT
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('new_session'))
+        self.assertEqual(response.status_code, 200)
+        # The hot state follows the new session
+        with mock.patch('chatbot.views.get_openrouter_client', return_value=fake_completion()):
+            response = self.client.post(reverse('chatbot'), {'message': 'hi'})
+        self.assertEqual(response.json()['session_id'], str(ChatSession.objects.get(user=self.user, is_active=True).pk))
+
+    @override_settings(INGESTION_MODE='worker')
+    def test_upload_pdf(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        upload = SimpleUploadedFile('doc.pdf', b'%PDF-1.4 test', content_type='application/pdf')
+        # content lookup, then one transaction: PdfContent INSERT (in its own savepoint),
+        # UploadedPDF INSERT, IngestionJob INSERT
+        with self.settings(MEDIA_ROOT=media_root), self.assertNumQueries(8):
+            response = self.client.post(reverse('upload_pdf'), {'pdf': upload}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+
+    @override_settings(INGESTION_MODE='worker')
+    def test_upload_pdf_already_ingested(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        chunks_path = os.path.join(media_root, 'chunks_shared.chunks')
+        open(chunks_path, 'wb').close()
+        data = b'%PDF-1.4 handbook'
+        PdfContent.objects.create(
+            sha256=hashlib.sha256(data).hexdigest(), file='pdfs/handbook.pdf', chunks_path=chunks_path, ref_count=1
+        )
+        upload = SimpleUploadedFile('handbook.pdf', data, content_type='application/pdf')
+        # content lookup, then one transaction: ref_count UPDATE, UploadedPDF INSERT (ready, no job)
+        with self.settings(MEDIA_ROOT=media_root), self.assertNumQueries(5):
+            response = self.client.post(reverse('upload_pdf'), {'pdf': upload}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        pdf = UploadedPDF.objects.get(pk=response.json()['pdf_id'])
+        self.assertEqual((pdf.status, pdf.faiss_index_path, pdf.original_name), ('ready', chunks_path, 'handbook.pdf'))
+        self.assertEqual(PdfContent.objects.get().ref_count, 2)
+        # The upload dropped the cached state, so the new document is used at once
+        self.assertIn(pdf.id, [p.id for p in hot_state.get(self.user).ready_pdfs])
+
+
+# ---------------------------
+#  Index usage (EXPLAIN)
+# ---------------------------
+class HotQueryIndexTests(TestCase):
+    """The hot queries must be answered from their composite indexes, not a table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bob', password='pw')
+        cls.session = ChatSession.objects.create(user=cls.user)
+
+    def explain(self, queryset):
+        if connection.vendor == 'sqlite':
+            return queryset.explain()
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be seq-scanned
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+        self.skipTest(f'No EXPLAIN check for {connection.vendor}')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.explain(queryset)
+        self.assertIn(index_name, plan)
+        self.assertNotIn('SCAN chatbot_', plan)  # SQLite full scan
+        self.assertNotIn('Seq Scan', plan)  # Postgres full scan
+
+    def test_active_session_lookup(self):
+        self.assertUsesIndex(
+            ChatSession.objects.filter(user=self.user, is_active=True)[:1], 'session_user_active_idx'
+        )
+
+    def test_session_history(self):
+        self.assertUsesIndex(
+            Message.objects.filter(session=self.session).order_by('timestamp'), 'message_session_ts_idx'
+        )
+
+    def test_session_history_keyset_page(self):
+        self.assertUsesIndex(
+            Message.objects.filter(session=self.session).order_by('-timestamp', '-message_id')[:31],
+            'message_session_ts_idx',
+        )
+
+    def test_latest_ready_pdf(self):
+        self.assertUsesIndex(
+            UploadedPDF.objects.filter(user=self.user, status='ready').order_by('-id')[:1],
+            'pdf_user_status_idx',
+        )
+
+
+# ---------------------------
+#  Metrics
+# ---------------------------
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='', CHAT_LEGACY_READ=False, CHAT_LEGACY_DUAL_WRITE=False)
+class MetricsTests(ViewTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bob', password='pw', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_server_timing_and_metrics_endpoint(self):
+        client = fake_completion()
+        client.chat.completions.create.return_value.usage = SimpleNamespace(prompt_tokens=12, completion_tokens=3)
+        with mock.patch('chatbot.views.get_openrouter_client', return_value=client):
+            response = self.client.post(reverse('chatbot'), {'message': 'hi'})
+        timing = response['Server-Timing']
+        for phase in ('db;dur=', 'history;dur=', 'llm;dur=', 'render;dur=', 'save;dur=', 'total;dur='):
+            self.assertIn(phase, timing)
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('chatbot_request_duration_seconds_count{view="chatbot",method="POST",status="200"}', body)
+        self.assertIn('chatbot_llm_tokens_total{kind="prompt"}', body)
+        self.assertIn('chatbot_llm_cache_hit_ratio', body)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_staff_only_without_token(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(User.objects.create_user(username='eve', password='pw'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('chatbot'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+# ---------------------------
+#  LLM gateway
+# ---------------------------
+def upstream_error(status):
+    request = httpx.Request('POST', 'http://llm/v1/chat/completions')
+    return openai.APIStatusError('upstream', response=httpx.Response(status, request=request), body=None)
+
+
+def upstream_timeout():
+    return openai.APITimeoutError(request=httpx.Request('POST', 'http://llm/v1/chat/completions'))
+
+
+class LLMGatewayTests(SimpleTestCase):
+    def gateway(self, **kwargs):
+        return LLMGateway(**{'backoff': 0, 'breaker_reset': 60, **kwargs})
+
+    def test_retries_only_retryable_failures(self):
+        gateway = self.gateway(max_retries=2)
+        fn = mock.Mock(side_effect=[upstream_error(503), upstream_error(502), 'ok'])
+        self.assertEqual(gateway.call(fn), 'ok')
+        self.assertEqual(gateway.stats()['retries'], 2)
+
+        for exc in (upstream_timeout(), upstream_error(500), upstream_error(400)):
+            fn = mock.Mock(side_effect=exc)
+            with self.assertRaises(type(exc)):
+                gateway.call(fn)
+            self.assertEqual(fn.call_count, 1)
+
+    def test_breaker_opens_then_probes(self):
+        gateway = self.gateway(max_retries=0, breaker_threshold=2)
+        for _ in range(2):
+            with self.assertRaises(openai.APITimeoutError):
+                gateway.call(mock.Mock(side_effect=upstream_timeout()))
+        self.assertEqual(gateway.stats()['breaker_state'], 'open')
+        with self.assertRaises(CircuitOpen):
+            gateway.admit()
+
+        gateway.breaker.opened_at -= 61
+        self.assertTrue(gateway.breaker.allow())  # the single probe
+        self.assertFalse(gateway.breaker.allow())
+        gateway.breaker.record(True)
+        self.assertEqual(gateway.call(lambda: 'ok'), 'ok')
+        self.assertEqual(gateway.stats()['breaker_state'], 'closed')
+
+    def test_cancelled_probe_releases_the_breaker(self):
+        gateway = self.gateway(max_retries=0, breaker_threshold=1)
+        with self.assertRaises(openai.APITimeoutError):
+            gateway.call(mock.Mock(side_effect=upstream_timeout()))
+        gateway.breaker.opened_at -= 61
+
+        async def cancel_probe():
+            probe = asyncio.ensure_future(gateway.acall(lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0.01)
+            self.assertTrue(gateway.breaker.is_open())  # probe in flight
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+
+        asyncio.run(cancel_probe())
+        # Still half-open (nothing was learned), but the next call may probe
+        self.assertEqual(gateway.stats()['breaker_state'], 'half_open')
+        gateway.admit()
+        self.assertEqual(asyncio.run(gateway.acall(lambda: asyncio.sleep(0, 'ok'))), 'ok')
+        self.assertEqual(gateway.stats()['breaker_state'], 'closed')
+
+    def test_full_queue_rejects(self):
+        gateway = self.gateway(max_concurrency=1, max_waiting=0, queue_timeout=0.01)
+        with gateway.slot():
+            self.assertEqual(gateway.stats()['in_flight'], 1)
+            with self.assertRaises(GatewayBusy):
+                with gateway.slot():
+                    pass
+        self.assertEqual(gateway.stats()['in_flight'], 0)
+        self.assertEqual(gateway.stats()['rejected_queue'], 1)
+
+
+class LLMGatewayViewTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        self.client.force_login(User.objects.create_user(username='carol', password='pw'))
+
+    @override_settings(LLM_MAX_RETRIES=0, LLM_BREAKER_THRESHOLD=1, LLM_BREAKER_RESET=60)
+    def test_open_breaker_returns_503(self):
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = upstream_timeout()
+        with mock.patch('chatbot.views.get_openrouter_client', return_value=client):
+            first = self.client.post(reverse('chatbot'), {'message': 'hi'})
+            second = self.client.post(reverse('chatbot'), {'message': 'hi again'})
+        self.assertEqual(first.status_code, 200)  # the timeout itself is reported as the reply
+        self.assertEqual(second.status_code, 503)
+        self.assertGreaterEqual(int(second['Retry-After']), 1)
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+        self.assertEqual(self.client.post(reverse('chatbot_stream'), {'message': 'hi'}).status_code, 503)
+
+
+# ---------------------------
+#  Model routing / hedging
+# ---------------------------
+class FakeStream:
+    def __init__(self, model, delay):
+        self.model, self.delay, self.closed = model, delay, False
+
+    def __iter__(self):
+        for word in ('answer', 'from', self.model):
+            time.sleep(self.delay)
+            if self.closed:
+                raise httpx.ReadError('response closed')
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + ' '))], usage=None)
+
+    def close(self):
+        self.closed = True
+
+
+@override_settings(LLM_MODELS=['slow', 'fast'], LLM_HEDGE_DELAY='0.05', LLM_MAX_RETRIES=0)
+class RoutingTests(SimpleTestCase):
+    def setUp(self):
+        reset_gateway()
+        routing.tracker.clear()
+        self.addCleanup(reset_gateway)
+        self.addCleanup(routing.tracker.clear)
+
+    def test_ranked_by_ewma(self):
+        self.assertEqual(routing.plan()[0], ['slow', 'fast'])  # configured order until measured
+        routing.tracker.observe('slow', 3.0)
+        routing.tracker.observe('fast', 0.5)
+        self.assertEqual(routing.plan()[0], ['fast', 'slow'])
+
+    def test_sync_hedge_wins_and_cancels_primary(self):
+        streams = {}
+
+        def create(model, **kwargs):
+            streams[model] = FakeStream(model, delay={'slow': 0.5, 'fast': 0.01}[model])
+            return streams[model]
+
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = create
+        started = time.monotonic()
+        reply = routing.complete(client, [{'role': 'user', 'content': 'hi'}])
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual((reply.model, reply.content), ('fast', 'answer from fast'))
+        self.assertTrue(streams['slow'].closed)
+        self.assertIsNotNone(routing.tracker.ewma('fast'))
+        self.assertEqual(get_gateway().stats()['in_flight'], 0)
+
+    def test_async_hedge_wins_and_cancels_primary(self):
+        cancelled = []
+
+        async def create(model, **kwargs):
+            try:
+                await asyncio.sleep({'slow': 1.0, 'fast': 0.01}[model])
+            except asyncio.CancelledError:
+                cancelled.append(model)
+                raise
+            return fake_completion(f'answer from {model}').chat.completions.create.return_value
+
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = create
+        reply = asyncio.run(routing.acomplete(client, [{'role': 'user', 'content': 'hi'}]))
+        self.assertEqual((reply.model, reply.content), ('fast', 'answer from fast'))
+        self.assertEqual(cancelled, ['slow'])
+
+    @override_settings(LLM_HEDGE_DELAY='off')
+    def test_hedging_off_uses_one_model(self):
+        client = fake_completion('only one')
+        reply = routing.complete(client, [{'role': 'user', 'content': 'hi'}])
+        self.assertEqual((reply.model, reply.content), ('slow', 'only one'))
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+
+    @override_settings(LLM_BREAKER_RESET=60)
+    def test_cancelled_hedge_probe_releases_the_breaker(self):
+        breaker = get_gateway().breaker
+
+        async def create(model, **kwargs):
+            if model == 'slow':
+                # Other turns open the breaker meanwhile, and its reset timeout passes
+                breaker.state, breaker.opened_at = 'open', time.monotonic() - 61
+            await asyncio.sleep(10)
+
+        async def turn():
+            client = mock.Mock()
+            client.chat.completions.create.side_effect = create
+            task = asyncio.ensure_future(routing.acomplete(client, [{'role': 'user', 'content': 'hi'}]))
+            await asyncio.sleep(0.2)
+            # The hedge went out as the half-open probe; then the client goes away
+            self.assertEqual(client.chat.completions.create.call_count, 2)
+            self.assertTrue(breaker.is_open())
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(turn())
+        self.assertFalse(breaker.is_open())
+        get_gateway().admit()
+        self.assertEqual(get_gateway().stats()['in_flight'], 0)
+
+    @override_settings(LLM_HEDGE_DELAY='off')
+    def test_only_upstream_failures_are_penalized(self):
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = upstream_error(400)
+        with self.assertRaises(openai.APIStatusError):
+            routing.complete(client, [{'role': 'user', 'content': 'hi'}])
+        self.assertIsNone(routing.tracker.ewma('slow'))
+
+        client.chat.completions.create.side_effect = upstream_error(502)
+        with self.assertRaises(openai.APIStatusError):
+            routing.complete(client, [{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(routing.tracker.ewma('slow'), get_gateway().timeout)
+
+
+# ---------------------------
+#  Chunking
+# ---------------------------
+try:
+    from langchain_text_splitters import CharacterTextSplitter
+except ImportError:  # no longer a dependency; only used to check equivalence
+    CharacterTextSplitter = None
+
+
+def random_pages(seed):
+    """A few pages of random lines: empty ones, short ones and some longer than a chunk"""
+    rnd = random.Random(seed)
+    pages = []
+    for page_no in range(1, rnd.randint(1, 6) + 1):
+        lines = []
+        for _ in range(rnd.randint(0, 30)):
+            words = rnd.choice([0, 1, 8, 24, 60, 240]) if rnd.random() < 0.1 else rnd.randint(0, 30)
+            lines.append(" ".join(rnd.choice(["pump", "filter", "valve", "a", "warranty"]) for _ in range(words)))
+        pages.append((page_no, "\n".join(lines)))
+    return pages
+
+
+def splitter_document(pages):
+    return "\n".join(line for _, text in pages for line in text.split("\n") if line)
+
+
+class ChunkingTests(SimpleTestCase):
+    @skipIf(CharacterTextSplitter is None, "langchain-text-splitters is not installed")
+    def test_matches_character_text_splitter(self):
+        splitter = CharacterTextSplitter(separator="\n", chunk_size=1000, chunk_overlap=200)
+        # It warns about every over-long chunk (a single line longer than chunk_size)
+        self.enterContext(mock.patch('langchain_text_splitters.base.logger'))
+        for seed in range(200):
+            pages = random_pages(seed)
+            chunks = list(iter_chunks(pages))
+            expected = splitter.split_text("\n".join(text for _, text in pages))
+            self.assertEqual([chunk.text for chunk in chunks], expected, f"seed {seed}")
+            doc = splitter_document(pages)
+            for chunk in chunks:
+                self.assertEqual(doc[chunk.start:chunk.end], chunk.text)
+
+    def test_overlap_crosses_page_boundaries(self):
+        pages = [(1, "\n".join(f"page one line {i:02}" for i in range(6))),
+                 (2, "\n".join(f"page two line {i:02}" for i in range(6)))]
+        chunks = list(iter_chunks(pages, chunk_size=60, chunk_overlap=20))
+        doc = splitter_document(pages)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertLess(chunk.start, previous.end)  # starts inside the previous chunk
+            self.assertLessEqual(previous.end - chunk.start, 20)
+        spanning = [chunk for chunk in chunks if chunk.page_start != chunk.page_end]
+        self.assertEqual(len(spanning), 1)
+        self.assertEqual((spanning[0].page_start, spanning[0].page_end), (1, 2))
+        self.assertIn("page one line 05\npage two line 00", spanning[0].text)
+        self.assertEqual(doc[spanning[0].start:spanning[0].end], spanning[0].text)
+        self.assertEqual(chunks[0].page_start, 1)
+        self.assertEqual(chunks[-1].page_end, 2)
+
+    def test_pages_without_text_are_skipped(self):
+        chunks = list(iter_chunks([(1, ""), (2, "\n\nonly text\n"), (3, "")]))
+        self.assertEqual(chunks, [Chunk("only text", 2, 2, 0, 9)])
+
+    def test_line_longer_than_chunk_size_is_kept_whole(self):
+        long_line = "x" * 150
+        chunks = list(iter_chunks([(1, f"short before\n{long_line}\nshort after")], chunk_size=100, chunk_overlap=20))
+        self.assertEqual([chunk.text for chunk in chunks], ["short before", long_line, "short after"])
+        self.assertEqual((chunks[1].start, chunks[1].end), (13, 163))
+
+
+# ---------------------------
+#  Context packing
+# ---------------------------
+class ContextPackingTests(SimpleTestCase):
+    def setUp(self):
+        lines = [f"line {i} of the handbook about topic {i % 7}" for i in range(600)]
+        pages = [(page_no, "\n".join(lines[i:i + 30])) for page_no, i in enumerate(range(0, 600, 30), start=1)]
+        self.document = "\n".join(lines)
+        self.chunks = list(iter_chunks(pages))
+        self.pdf = SimpleNamespace(id=1, original_name='handbook.pdf', file=SimpleNamespace(name='pdfs/abc.pdf'))
+
+    def hit(self, chunk_id, score, span=True):
+        chunk = self.chunks[chunk_id]
+        return SimpleNamespace(
+            pdf=self.pdf, pdf_id=1, chunk_id=chunk_id, text=chunk.text, score=score,
+            span=tuple(chunk[1:]) if span else None,
+        )
+
+    def test_overlapping_chunks_are_merged_without_repeats(self):
+        passages = packing.pack([self.hit(3, 9.0), self.hit(4, 8.0), self.hit(10, 5.0)], budget=10_000)
+        self.assertEqual(len(passages), 2)
+        merged = passages[0]
+        self.assertEqual(merged.text, self.document[self.chunks[3].start:self.chunks[4].end])
+        self.assertLess(len(merged.text), len(self.chunks[3].text) + len(self.chunks[4].text))
+        self.assertTrue(packing.render(passages).startswith('[Source: handbook.pdf, p'))
+
+    def test_budget_is_filled_by_score(self):
+        one = packing.count_tokens(self.chunks[0].text) + 20
+        passages = packing.pack([self.hit(10, 9.0), self.hit(20, 8.0), self.hit(11, 7.0)], budget=2 * one)
+        # chunk 11 overlaps 10, so it is cheaper than 20 but comes later in score order
+        self.assertEqual([p.start for p in passages], [self.chunks[10].start, self.chunks[20].start])
+
+    def test_unknown_spans_are_deduplicated_by_text(self):
+        passages = packing.pack([self.hit(3, 9.0, span=False), self.hit(3, 8.0, span=False)], budget=10_000)
+        self.assertEqual([p.render() for p in passages], [f"[Source: handbook.pdf]\n{self.chunks[3].text}"])
+
+
+# ---------------------------
+#  Session archive
+# ---------------------------
+@override_settings(CHAT_LEGACY_READ=False, CHAT_LEGACY_DUAL_WRITE=False)
+class SessionArchiveTests(ViewTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='erin', password='pw')
+        cls.old = ChatSession.objects.create(user=cls.user, is_active=False, summary='earlier talk')
+        Message.objects.bulk_create([
+            make_message(cls.old, 'user' if i % 2 == 0 else 'assistant', f'old message {i}')
+            for i in range(25)
+        ])
+        cls.recent = ChatSession.objects.create(user=cls.user, is_active=False)
+        Message.objects.bulk_create([make_message(cls.recent, 'user', 'recent question')])
+        cls.active = ChatSession.objects.create(user=cls.user)
+        Message.objects.bulk_create([make_message(cls.active, 'user', 'current question')])
+        long_ago = timezone.now() - timedelta(days=90)
+        ChatSession.objects.filter(pk__in=[cls.old.pk, cls.active.pk]).update(updated_at=long_ago)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def compact(self, *args):
+        out = StringIO()
+        call_command('compact_sessions', '--inactive-days=30', *args, stdout=out)
+        return out.getvalue()
+
+    def test_moves_only_old_inactive_sessions(self):
+        old_messages = list(Message.objects.filter(session=self.old).values_list('content', flat=True))
+        output = self.compact()
+
+        self.assertIn("Archived 1 session(s) with 25 message(s)", output)
+        self.assertFalse(ChatSession.objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(Message.objects.filter(session_id=self.old.pk).exists())
+        self.assertEqual(Message.objects.filter(session__in=[self.recent, self.active]).count(), 2)
+
+        archived = ArchivedSession.objects.get(pk=self.old.pk)
+        self.assertEqual((archived.message_count, archived.summary), (25, 'earlier talk'))
+        transcript = archive.decode_transcript(archived.transcript)
+        self.assertEqual([msg['content'] for msg in transcript], old_messages)
+
+    def test_resumes_in_batches_and_is_idempotent(self):
+        for i in range(3):
+            session = ChatSession.objects.create(user=self.user, is_active=False)
+            Message.objects.bulk_create([make_message(session, 'user', f'batch {i}')])
+        ChatSession.objects.filter(is_active=False).exclude(pk=self.recent.pk).update(
+            updated_at=timezone.now() - timedelta(days=60)
+        )
+
+        output = self.compact('--batch-size=2', '--max-batches=1')
+        self.assertIn("Stopped early", output)
+        self.assertEqual(ArchivedSession.objects.count(), 2)
+
+        self.compact('--batch-size=2')
+        self.assertEqual(ArchivedSession.objects.count(), 4)
+        self.assertIn("Archived 0 session(s)", self.compact())
+        self.assertEqual(ArchivedSession.objects.count(), 4)
+        self.assertEqual(ChatSession.objects.filter(user=self.user).count(), 2)
+
+    def test_dry_run_changes_nothing(self):
+        self.assertIn("1 session(s) inactive", self.compact('--dry-run'))
+        self.assertTrue(ChatSession.objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(ArchivedSession.objects.exists())
+
+    def test_history_view_reads_the_archive(self):
+        hot_page = self.client.get(reverse('chat_history'), {'session': self.old.pk, 'limit': 10}).json()
+        self.compact()
+
+        url = reverse('chat_history')
+        page = self.client.get(url, {'session': self.old.pk, 'limit': 10}).json()
+        self.assertTrue(page['archived'])
+        self.assertEqual(page['messages'], hot_page['messages'])
+        self.assertEqual(page['next_cursor'], hot_page['next_cursor'])
+
+        seen = [msg['content'] for msg in page['messages']]
+        while page['next_cursor']:
+            page = self.client.get(url, {'session': self.old.pk, 'limit': 10, 'cursor': page['next_cursor']}).json()
+            seen = [msg['content'] for msg in page['messages']] + seen
+        self.assertEqual(seen, [f'old message {i}' for i in range(25)])
+
+    def test_archive_is_private(self):
+        self.compact()
+        other = User.objects.create_user(username='frank', password='pw')
+        self.client.force_login(other)
+        response = self.client.get(reverse('chat_history'), {'session': self.old.pk})
+        self.assertEqual(response.status_code, 404)
+
+    def test_stale_html_is_rendered_on_read(self):
+        Message.objects.filter(session=self.old, role='assistant').update(content_html='', render_version=0)
+        self.compact()
+        page = self.client.get(reverse('chat_history'), {'session': self.old.pk, 'limit': 2}).json()
+        self.assertEqual(page['messages'][0]['html'], render_markdown('old message 23'))
+
+    def test_drops_legacy_chats_already_imported(self):
+        before = timezone.now() - timedelta(days=120)
+        Chat.objects.bulk_create([Chat(user=self.user, message='m', response='r') for _ in range(2)])
+        Chat.objects.update(created_at=before)
+        waiting = User.objects.create_user(username='gina', password='pw')
+        Chat.objects.create(user=waiting, message='m', response='r')
+        Chat.objects.filter(user=waiting).update(created_at=before)
+
+        # erin's Chat rows predate her first session: only gone once they were imported
+        self.assertIn("2 user(s) have legacy chats not yet imported", self.compact())
+        self.assertEqual(Chat.objects.count(), 3)
+
+        imported = ChatSession.objects.create(user=self.user, is_active=False, imported_from_legacy=True)
+        ChatSession.objects.filter(pk=imported.pk).update(updated_at=before)
+        output = self.compact()
+        self.assertIn("Deleted 2 legacy chat row(s)", output)
+        self.assertIn("1 user(s) have legacy chats not yet imported", output)
+        self.assertEqual(list(Chat.objects.values_list('user_id', flat=True)), [waiting.pk])
+
+
+# ---------------------------
+#  BM25 retrieval
+# ---------------------------
+class BM25IndexTests(SimpleTestCase):
+    CHUNKS = [
+        "The pump pressure is measured in bar at the outlet valve.",
+        "Warranty terms cover the pump for two years.",
+        "Replace the filter every six months; filter cartridges are sold separately.",
+        "Nothing relevant here at all.",
+    ]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.chunks_path = os.path.join(self.tmp, 'chunks_1.txt')
+
+    def test_ranks_by_bm25(self):
+        index = BM25Index.build(self.CHUNKS)
+        self.assertEqual([chunk_id for _, chunk_id in index.search("filter cartridge filter", top_k=3)], [2])
+        ranked = [chunk_id for _, chunk_id in index.search("pump pressure", top_k=3)]
+        self.assertEqual(ranked, [0, 1])
+        self.assertEqual(index.search("unknown words", top_k=3), [])
+
+    def test_persist_and_reload(self):
+        index = build_index(self.CHUNKS, self.chunks_path)
+        self.assertTrue(os.path.exists(index_path_for(self.chunks_path)))
+        loaded = load_index(self.chunks_path)
+        self.assertEqual(loaded.to_dict(), index.to_dict())
+        self.assertEqual(loaded.search("pump", top_k=2), index.search("pump", top_k=2))
+
+    def test_builds_on_first_use(self):
+        self.assertIsNone(load_index(self.chunks_path))  # no index and no chunks to build from
+        index = load_index(self.chunks_path, self.CHUNKS)
+        self.assertEqual(index.doc_count, len(self.CHUNKS))
+        self.assertTrue(os.path.exists(index_path_for(self.chunks_path)))
+
+    def test_rebuilds_unreadable_index(self):
+        with open(index_path_for(self.chunks_path), 'w') as f:
+            f.write('{"version": 1, "postings"')
+        with mock.patch('builtins.print'):
+            index = load_index(self.chunks_path, self.CHUNKS)
+        self.assertEqual(index.doc_count, len(self.CHUNKS))
+        self.assertEqual(BM25Index.load(index_path_for(self.chunks_path)).doc_count, len(self.CHUNKS))
+
+    def test_rebuilds_stale_index(self):
+        build_index(self.CHUNKS[:2], self.chunks_path)
+        with mock.patch('builtins.print'):
+            self.assertEqual(load_index(self.chunks_path, self.CHUNKS).doc_count, len(self.CHUNKS))
+
+        data = BM25Index.build(self.CHUNKS).to_dict()
+        data['version'] = 0
+        with open(index_path_for(self.chunks_path), 'w') as f:
+            json.dump(data, f)
+        with mock.patch('builtins.print'):
+            self.assertEqual(load_index(self.chunks_path, self.CHUNKS).doc_count, len(self.CHUNKS))
+        self.assertEqual(BM25Index.load(index_path_for(self.chunks_path)).to_dict()['version'], 1)
+
+
+# ---------------------------
+#  Chunk cache
+# ---------------------------
+def write_store(path, texts, compress=False):
+    with ChunkWriter(path, compress=compress) as writer:
+        offset = 0
+        for text in texts:
+            writer.write(Chunk(text, 1, 1, offset, offset + len(text)))
+            offset += len(text) + 1
+    return path
+
+
+class ChunkCacheTests(SimpleTestCase):
+    TEXTS = ["alpha pump manual", "beta filter notes", "gamma valve pressure"]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def pdf(self, name, texts=TEXTS):
+        path = write_store(os.path.join(self.tmp, f'chunks_{name}.chunks'), texts)
+        return SimpleNamespace(faiss_index_path=path)
+
+    def test_hits_and_misses(self):
+        cache = ChunkCache(max_bytes=10 * 1024 * 1024)
+        pdf = self.pdf('a')
+        first = cache.get(pdf)
+        self.assertEqual(list(first.chunks), self.TEXTS)
+        self.assertIs(cache.get(pdf), first)
+        self.assertIsNone(cache.get(SimpleNamespace(faiss_index_path=os.path.join(self.tmp, 'missing.chunks'))))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_evicts_least_recently_used_at_capacity(self):
+        a, b, c = self.pdf('a'), self.pdf('b'), self.pdf('c')
+        size = ChunkCache(max_bytes=10 * 1024 * 1024).get(a).nbytes
+        cache = ChunkCache(max_bytes=2 * size)
+        cache.get(a)
+        cache.get(b)
+        cache.get(a)  # b is now least recently used
+        cache.get(c)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['bytes'], 2 * size)
+        hits = cache.hits
+        cache.get(a)
+        cache.get(c)
+        self.assertEqual(cache.hits, hits + 2)
+        cache.get(b)
+        self.assertEqual(cache.misses, 4)
+
+    def test_never_caches_entries_over_budget(self):
+        cache = ChunkCache(max_bytes=1)
+        pdf = self.pdf('a')
+        self.assertIsNotNone(cache.get(pdf))
+        cache.get(pdf)
+        self.assertEqual((cache.misses, cache.stats()['entries']), (2, 0))
+
+    def test_reloads_when_file_changes(self):
+        cache = ChunkCache(max_bytes=10 * 1024 * 1024)
+        pdf = self.pdf('a')
+        cache.get(pdf)
+
+        write_store(pdf.faiss_index_path, self.TEXTS + ["delta gear box"])  # size changes
+        with mock.patch('builtins.print'):  # its BM25 index is stale now
+            self.assertEqual(len(cache.get(pdf).chunks), 4)
+
+        st = os.stat(pdf.faiss_index_path)
+        os.utime(pdf.faiss_index_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))  # mtime only
+        entry = cache.get(pdf)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(entry.signature, file_signature(pdf.faiss_index_path))
+
+        os.remove(pdf.faiss_index_path)
+        self.assertIsNone(cache.get(pdf))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+# ---------------------------
+#  Multi-document retrieval
+# ---------------------------
+class MergedIndexTests(SimpleTestCase):
+    MANUAL = [
+        "The pump pressure is measured in bar at the outlet valve.",
+        "Warranty terms cover the pump for two years.",
+        "Replace the filter every six months.",
+    ]
+    NOTES = [
+        "Filter cartridges are sold separately; the filter housing is not.",
+        "Pump noise usually means air in the pump inlet.",
+    ]
+
+    def assertSameRanking(self, merged, expected):
+        self.assertEqual([key for _, key in merged], [key for _, key in expected])
+        for (score, _), (want, _) in zip(merged, expected):
+            self.assertAlmostEqual(score, want)
+
+    def test_matches_one_index_over_both_corpora(self):
+        merged = MergedIndex()
+        merged.add('manual', 'v1', BM25Index.build(self.MANUAL))
+        merged.add('notes', 'v1', BM25Index.build(self.NOTES))
+        indexes = {'manual': BM25Index.build(self.MANUAL), 'notes': BM25Index.build(self.NOTES)}
+        combined = BM25Index.build(self.MANUAL + self.NOTES)
+        offset = len(self.MANUAL)
+        where = lambda i: ('manual', i) if i < offset else ('notes', i - offset)  # noqa: E731
+        for query in ("pump filter", "filter cartridges", "pump pressure valve", "warranty"):
+            expected = [(score, where(i)) for score, i in combined.search(query, top_k=10)]
+            self.assertSameRanking(merged.search(query, indexes, top_k=10), expected)
+            # The bounded heap keeps only the best top_k
+            self.assertSameRanking(merged.search(query, indexes, top_k=2), expected[:2])
+
+        merged.remove('notes')
+        del indexes['notes']
+        only = BM25Index.build(self.MANUAL)
+        self.assertSameRanking(
+            merged.search("pump filter", indexes, top_k=10),
+            [(score, ('manual', i)) for score, i in only.search("pump filter", top_k=10)],
+        )
+        self.assertNotIn('cartridges', merged.df)
+
+    def test_re_adding_a_document_replaces_it(self):
+        merged = MergedIndex()
+        merged.add('manual', 'v1', BM25Index.build(self.MANUAL))
+        merged.add('manual', 'v2', BM25Index.build(self.NOTES))
+        self.assertEqual((merged.signature('manual'), merged.doc_count), ('v2', len(self.NOTES)))
+        notes = BM25Index.build(self.NOTES)
+        self.assertEqual(dict(merged.df), {term: len(postings) for term, postings in notes.postings.items()})
+        merged.remove('manual')
+        self.assertEqual((merged.doc_count, merged.total_len, dict(merged.df)), (0, 0, {}))
+        self.assertEqual(merged.search("pump", {}), [])
+
+
+@override_settings(RAG_RETRIEVER='bm25', RAG_RERANK_CANDIDATES=0)
+class UserIndexRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.registry = UserIndexRegistry(max_users=1, cache=ChunkCache(max_bytes=10 * 1024 * 1024))
+
+    def pdf(self, pdf_id, texts, name=None):
+        path = write_store(os.path.join(self.tmp, f'chunks_{name or pdf_id}.chunks'), texts)
+        return SimpleNamespace(id=pdf_id, faiss_index_path=path)
+
+    def test_searches_across_documents(self):
+        manual = self.pdf(1, MergedIndexTests.MANUAL)
+        notes = self.pdf(2, MergedIndexTests.NOTES)
+        results = self.registry.search(7, [manual, notes], "filter cartridges", top_k=2)
+        self.assertEqual([(r.pdf_id, r.chunk_id) for r in results], [(2, 0), (1, 2)])
+        self.assertEqual(results[0].text, MergedIndexTests.NOTES[0])
+        self.assertIs(results[1].pdf, manual)
+        self.assertEqual(results[0].span[:2], (1, 1))
+
+    def test_follows_added_removed_and_changed_documents(self):
+        manual = self.pdf(1, MergedIndexTests.MANUAL)
+        notes = self.pdf(2, MergedIndexTests.NOTES)
+        self.registry.search(7, [manual], "pump")
+        merged = self.registry._indexes[7]
+        self.assertEqual(set(merged.docs), {1})
+
+        self.registry.search(7, [manual, notes], "pump")
+        self.assertIs(self.registry._indexes[7], merged)  # updated in place, not rebuilt
+        self.assertEqual((set(merged.docs), merged.doc_count), ({1, 2}, 5))
+
+        write_store(notes.faiss_index_path, ["Pump seals wear out."])
+        with mock.patch('builtins.print'):  # the old BM25 index is stale
+            results = self.registry.search(7, [manual, notes], "seals")
+        self.assertEqual([(r.pdf_id, r.text) for r in results], [(2, "Pump seals wear out.")])
+        self.assertEqual(merged.doc_count, 4)
+
+        self.registry.search(7, [notes], "pump")
+        self.assertEqual((set(merged.docs), merged.doc_count), ({2}, 1))
+
+        self.registry.search(8, [notes], "pump")  # max_users=1: the other user's index goes
+        self.assertEqual(list(self.registry._indexes), [8])
+
+    def test_shared_store_is_searched_once(self):
+        first = self.pdf(1, MergedIndexTests.MANUAL, name='shared')
+        second = SimpleNamespace(id=2, faiss_index_path=first.faiss_index_path)  # same bytes uploaded again
+        results = self.registry.search(7, [first, second], "pump", top_k=5)
+        self.assertEqual([r.pdf_id for r in results], [1, 1])
+        self.assertEqual(set(self.registry._indexes[7].docs), {1})
+
+
+@override_settings(RAG_RETRIEVER='bm25', RAG_RERANK_CANDIDATES=0)
+class RetrieveContextTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        user_indexes.clear()
+        self.addCleanup(user_indexes.clear)
+        self.enterContext(mock.patch('builtins.print'))
+        self.user = User.objects.create_user(username='rita', password='pw')
+
+    def upload(self, name, texts):
+        path = write_store(os.path.join(self.tmp, f'chunks_{name}.chunks'), texts)
+        return UploadedPDF.objects.create(
+            user=self.user, file=f'pdfs/{name}.pdf', original_name=f'{name}.pdf', status='ready', faiss_index_path=path,
+        )
+
+    def test_context_from_every_ready_pdf(self):
+        manual = self.upload('manual', MergedIndexTests.MANUAL)
+        notes = self.upload('notes', MergedIndexTests.NOTES)
+        gone = self.upload('gone', ["Pump filter details that were deleted."])
+        os.remove(gone.faiss_index_path)
+
+        context = retrieve_context("pump filter", self.user.id, [manual, notes, gone])
+        self.assertIn('[Source: manual.pdf, p. 1]', context)
+        self.assertIn('[Source: notes.pdf, p. 1]', context)
+        self.assertIn(MergedIndexTests.NOTES[1], context)
+        self.assertNotIn('gone.pdf', context)
+        self.assertNotIn('deleted', context)
+
+        self.assertEqual(retrieve_context("pump filter", self.user.id, []), "")
+
+
+# ---------------------------
+#  Ingestion jobs
+# ---------------------------
+class IngestionJobTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root, RAG_RETRIEVER='bm25'))
+        self.enterContext(mock.patch('builtins.print'))
+        os.makedirs(os.path.join(media_root, 'pdfs'))
+        self.media_root = media_root
+        self.user = User.objects.create_user(username='ivan', password='pw')
+
+    def queue(self, data=None, user=None):
+        path = os.path.join(self.media_root, 'pdfs', f'doc{IngestionJob.objects.count()}.pdf')
+        if data is None:
+            make_pdf(path, pages=2, lines_per_page=20)
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+        pdf = UploadedPDF.objects.create(user=user or self.user, file=os.path.relpath(path, self.media_root))
+        return IngestionJob.objects.create(pdf=pdf)
+
+    def test_claims_each_job_once(self):
+        first, second = self.queue(), self.queue()
+        self.assertEqual(claim_job(first.pk).pk, first.pk)
+        self.assertIsNone(claim_job(first.pk))
+        self.assertEqual(claim_job().pk, second.pk)
+        self.assertIsNone(claim_job())
+        self.assertEqual(set(IngestionJob.objects.values_list('status', flat=True)), {'running'})
+
+    def test_run_job_success(self):
+        job = self.queue()
+        self.assertTrue(run_job(claim_job(job.pk)))
+        job.refresh_from_db()
+        pdf = job.pdf
+        self.assertEqual((job.status, job.pages_done, job.pages_total), ('done', 2, 2))
+        self.assertGreater(job.chunks_count, 0)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(pdf.status, 'ready')
+        self.assertTrue(os.path.exists(pdf.faiss_index_path))
+
+    def test_run_job_failure(self):
+        job = self.queue(data=b'%PDF-1.4 not really a pdf')
+        self.assertFalse(run_job(claim_job(job.pk)))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.error)
+        self.assertEqual(job.pdf.status, 'failed')
+
+    def test_status_endpoint(self):
+        queued, done = self.queue(), self.queue()
+        failed = self.queue(data=b'broken')
+        run_job(claim_job(done.pk))
+        run_job(claim_job(failed.pk))
+        url = lambda job: reverse('ingestion_status', args=[job.pk])  # noqa: E731
+
+        self.assertEqual(self.client.get(url(queued)).status_code, 401)
+        self.client.force_login(self.user)
+        body = self.client.get(url(queued)).json()
+        self.assertEqual((body['job_id'], body['pdf_id'], body['status']), (queued.pk, queued.pdf_id, 'queued'))
+        self.assertIsNone(body['started_at'])
+        body = self.client.get(url(done)).json()
+        self.assertEqual((body['status'], body['pages_done'], body['error']), ('done', 2, None))
+        self.assertIsNotNone(body['finished_at'])
+        body = self.client.get(url(failed)).json()
+        self.assertEqual(body['status'], 'failed')
+        self.assertTrue(body['error'])
+
+        other = User.objects.create_user(username='judy', password='pw')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url(done)).status_code, 404)
+
+    @override_settings(INGESTION_MODE='worker')
+    def test_failed_upload_takes_no_reference(self):
+        data = b'%PDF-1.4 shared'
+        PdfContent.objects.create(sha256=hashlib.sha256(data).hexdigest(), file='pdfs/shared.pdf', ref_count=1)
+        upload = SimpleUploadedFile('shared.pdf', data, content_type='application/pdf')
+        with mock.patch('chatbot.uploads.enqueue', side_effect=RuntimeError('queue down')):
+            with self.assertRaises(RuntimeError):
+                store_upload(self.user, upload, hashlib.sha256(data).hexdigest())
+        self.assertEqual(PdfContent.objects.get().ref_count, 1)
+        self.assertFalse(UploadedPDF.objects.exists())
+
+        data = b'%PDF-1.4 fresh'
+        upload = SimpleUploadedFile('fresh.pdf', data, content_type='application/pdf')
+        with mock.patch('chatbot.uploads.enqueue', side_effect=RuntimeError('queue down')):
+            with self.assertRaises(RuntimeError):
+                store_upload(self.user, upload, hashlib.sha256(data).hexdigest())
+        self.assertEqual(PdfContent.objects.count(), 1)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'pdfs')), [])
+
+
+# ---------------------------
+#  Shared PDF content (reference counting / GC)
+# ---------------------------
+class PdfContentGCTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        vector_root = os.path.join(media_root, 'vectors')
+        self.enterContext(self.settings(MEDIA_ROOT=media_root, FAISS_INDEX_PATH=vector_root))
+        self.user = User.objects.create_user(username='gus', password='pw')
+
+    def content(self, uploads=1):
+        """A fully ingested PdfContent with `uploads` UploadedPDFs; returns (content, pdfs, artifact paths)"""
+        chunks_path = write_store(os.path.join(settings.MEDIA_ROOT, 'pdfs', 'chunks_abc.chunks'), ['pump manual'])
+        build_index(['pump manual'], chunks_path)
+        os.makedirs(settings.FAISS_INDEX_PATH)
+        np.save(vectors.vectors_path_for(chunks_path), np.zeros((1, 4), dtype=np.float32))
+        name = default_storage.save('pdfs/abc.pdf', ContentFile(b'%PDF-1.4 shared'))
+        content = PdfContent.objects.create(sha256='abc', file=name, chunks_path=chunks_path, ref_count=uploads)
+        pdfs = [
+            UploadedPDF.objects.create(user=self.user, file=name, content=content, status='ready',
+                                       faiss_index_path=chunks_path)
+            for _ in range(uploads)
+        ]
+        paths = [
+            default_storage.path(name), chunks_path, index_path_for(chunks_path), vectors.vectors_path_for(chunks_path),
+        ]
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        return content, pdfs, paths
+
+    def test_last_reference_collects_everything_after_commit(self):
+        content, (first, second), paths = self.content(uploads=2)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            first.delete()
+        self.assertEqual(callbacks, [])
+        self.assertEqual(PdfContent.objects.get(pk=content.pk).ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            second.delete()
+        # Nothing is removed before the transaction commits
+        self.assertTrue(PdfContent.objects.filter(pk=content.pk).exists())
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(PdfContent.objects.filter(pk=content.pk).exists())
+        self.assertEqual([path for path in paths if os.path.exists(path)], [])
+
+    def test_new_reference_blocks_collection(self):
+        content, (pdf,), paths = self.content()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            pdf.delete()
+        # An upload of the same bytes takes a reference before the callback runs
+        PdfContent.objects.filter(pk=content.pk).update(ref_count=F('ref_count') + 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(PdfContent.objects.get(pk=content.pk).ref_count, 1)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+    def test_gc_command_sweeps_leftovers(self):
+        content, (pdf,), paths = self.content()
+        pdf.delete()  # the on_commit collection never runs here, as after a crash
+        self.assertEqual(PdfContent.objects.get(pk=content.pk).ref_count, 0)
+        out = StringIO()
+        call_command('gc_pdf_content', stdout=out)
+        self.assertIn('Collected 1 unreferenced PDF content item(s)', out.getvalue())
+        self.assertEqual([path for path in paths if os.path.exists(path)], [])
+
+
+# ---------------------------
+#  Streaming chat (server-sent events)
+# ---------------------------
+class FakeAsyncStream:
+    """AsyncStream stand-in: yields `tokens`, holding after the first one until `gate` is set"""
+
+    def __init__(self, tokens, gate=None, error=None):
+        self.tokens, self.gate, self.error = tokens, gate, error
+        self.closed = False
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for i, token in enumerate(self.tokens):
+            if i == 1 and self.gate is not None:
+                await self.gate.wait()
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))], usage=None)
+        if self.error is not None:
+            raise self.error
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=5, completion_tokens=len(self.tokens)))
+
+    async def close(self):
+        self.closed = True
+
+
+def async_stream_client(stream):
+    async def create(**kwargs):
+        return stream
+
+    client = mock.Mock()
+    client.chat.completions.create.side_effect = create
+    return client
+
+
+def parse_sse(raw):
+    """[(event, data)] of a chunk of server-sent events"""
+    events = []
+    for block in raw.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+@override_settings(CHAT_LEGACY_DUAL_WRITE=False, LLM_CACHE_ENABLED=False, LLM_MODELS=['fast'])
+class StreamingChatTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_gateway()
+        routing.tracker.clear()
+        self.addCleanup(reset_gateway)
+        self.addCleanup(routing.tracker.clear)
+        self.user = User.objects.create_user(username='kim', password='pw')
+
+    async def open_stream(self, stream, message='hi'):
+        await self.async_client.aforce_login(self.user)
+        # The body is produced lazily, after post() returns: keep the client patched until the test ends
+        self.enterContext(mock.patch('chatbot.views.get_async_openrouter_client',
+                                     return_value=async_stream_client(stream)))
+        response = await self.async_client.post(reverse('chatbot_stream'), {'message': message})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response.streaming_content.__aiter__()
+
+    async def test_tokens_are_flushed_as_they_arrive(self):
+        gate = asyncio.Event()
+        events = await self.open_stream(FakeAsyncStream(['Hello', ' world'], gate=gate))
+        # The upstream is still waiting on the gate: a buffered response would block here
+        first = await asyncio.wait_for(events.__anext__(), timeout=2)
+        self.assertEqual(parse_sse(first.decode()), [('token', {'token': 'Hello'})])
+        gate.set()
+        rest = [parse_sse(chunk.decode())[0][0] async for chunk in events]
+        self.assertEqual(rest, ['token', 'done'])
+
+    async def test_token_and_done_events(self):
+        events = await self.open_stream(FakeAsyncStream(['Hello', ' **world**']))
+        received = [event for chunk in [c async for c in events] for event in parse_sse(chunk.decode())]
+        self.assertEqual([name for name, _ in received], ['token', 'token', 'done'])
+        done = received[-1][1]
+        self.assertEqual(done['response'], render_markdown('Hello **world**'))
+        self.assertEqual((done['model'], done['cached']), ('fast', False))
+
+        saved = [(m.role, m.content, m.model) async for m in Message.objects.filter(session__user=self.user)]
+        self.assertEqual(saved, [('user', 'hi', ''), ('assistant', 'Hello **world**', 'fast')])
+        self.assertEqual(get_gateway().stats()['in_flight'], 0)
+        # Streamed turns feed the routing latency estimate too
+        self.assertIsNotNone(routing.tracker.ewma('fast'))
+
+    async def test_upstream_error_event(self):
+        error = openai.APIConnectionError(request=httpx.Request('POST', 'http://llm/'))
+        events = await self.open_stream(FakeAsyncStream(['Hel'], error=error))
+        received = [event for chunk in [c async for c in events] for event in parse_sse(chunk.decode())]
+        self.assertEqual([name for name, _ in received], ['token', 'error', 'done'])
+        self.assertTrue(received[1][1]['error'].startswith('Error contacting model'))
+        reply = await Message.objects.filter(session__user=self.user, role='assistant').aget()
+        self.assertTrue(reply.content.startswith('Error contacting model'))
+        self.assertGreaterEqual(routing.tracker.ewma('fast'), get_gateway().timeout)
+
+    async def test_disconnect_saves_partial_turn(self):
+        stream = FakeAsyncStream(['Hello', ' world'], gate=asyncio.Event())  # never released
+        events = await self.open_stream(stream)
+        first = await asyncio.wait_for(events.__anext__(), timeout=2)
+        self.assertEqual(parse_sse(first.decode())[0], ('token', {'token': 'Hello'}))
+
+        # The server cancels the response task when the client goes away
+        reader = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.05)
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertTrue(stream.closed)
+        saved = [(m.role, m.content) async for m in Message.objects.filter(session__user=self.user)]
+        self.assertEqual(saved, [('user', 'hi'), ('assistant', 'Hello')])
+        self.assertEqual(get_gateway().stats()['in_flight'], 0)
+
+
+# ---------------------------
+#  Conversation history budget
+# ---------------------------
+def word_tokens(text):
+    return len(text.split())
+
+
+@override_settings(HISTORY_TOKEN_BUDGET=30, HISTORY_SUMMARY_BATCH_TOKENS=20, HISTORY_SUMMARY_MAX_TOKENS=50)
+class HistoryBudgetTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch('chatbot.history.count_tokens', word_tokens))
+        reset_gateway()
+        routing.tracker.clear()
+        self.addCleanup(reset_gateway)
+        self.addCleanup(routing.tracker.clear)
+        self.session = ChatSession.objects.create(user=User.objects.create_user(username='lena', password='pw'))
+        start = timezone.now() - timedelta(hours=1)
+        self.messages = [
+            Message(session=self.session, role='user' if i % 2 == 0 else 'assistant',
+                    content=f'turn {i} has five words', timestamp=start + timedelta(seconds=i))
+            for i in range(10)
+        ]
+        Message.objects.bulk_create(self.messages)  # 5 + 4 framing = 9 tokens each
+
+    def contents(self, history):
+        return [turn['content'] for turn in history]
+
+    @override_settings(HISTORY_SUMMARY_BATCH_TOKENS=100)
+    def test_overflow_below_batch_stays_in_prompt(self):
+        client = fake_completion('unused')
+        with mock.patch('chatbot.history.get_openrouter_client', return_value=client):
+            history = build_history(self.session)
+        self.assertEqual(len(history), 10)
+        self.assertLessEqual(sum(message_tokens(turn) for turn in history), 30 + 100)
+        client.chat.completions.create.assert_not_called()
+
+    def test_old_turns_fold_into_summary(self):
+        client = fake_completion('They talked about turns 0 to 6.')
+        with mock.patch('chatbot.history.get_openrouter_client', return_value=client):
+            history = build_history(self.session)
+            self.assertEqual(history[0], summary_message('They talked about turns 0 to 6.'))
+            self.assertEqual(self.contents(history[1:]), [f'turn {i} has five words' for i in (7, 8, 9)])
+            self.assertLessEqual(sum(message_tokens(turn) for turn in history[1:]), 30)
+            folded = client.chat.completions.create.call_args.kwargs['messages'][-1]['content']
+            self.assertIn('turn 6 has five words', folded)
+            self.assertNotIn('turn 7 has five words', folded)
+
+            self.session.refresh_from_db()
+            self.assertEqual(self.session.summary_upto, self.messages[6].timestamp)
+            # Already folded turns are not sent again
+            self.assertEqual(len(build_history(self.session)), 4)
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+
+    def test_failed_summary_keeps_budget(self):
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = upstream_timeout()
+        with mock.patch('chatbot.history.get_openrouter_client', return_value=client), \
+                mock.patch('builtins.print') as printed:
+            history = build_history(self.session)
+        self.assertEqual(self.contents(history), [f'turn {i} has five words' for i in (7, 8, 9)])
+        self.assertIn('Error updating conversation summary', printed.call_args.args[0])
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.summary, self.session.summary_upto), ('', None))
+
+    async def test_async_fold(self):
+        async def create(**kwargs):
+            return fake_completion('Async summary.').chat.completions.create.return_value
+
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = create
+        with mock.patch('chatbot.history.get_async_openrouter_client', return_value=client):
+            history = await abuild_history(self.session)
+        self.assertEqual(history[0], summary_message('Async summary.'))
+        self.assertEqual(len(history), 4)
+
+    @override_settings(LLM_MODELS=['summarizer', 'backup'], LLM_TIMEOUT=7)
+    def test_summary_goes_through_the_gateway(self):
+        client = fake_completion('Summary.')
+        with mock.patch('chatbot.history.get_openrouter_client', return_value=client):
+            build_history(self.session)
+        kwargs = client.chat.completions.create.call_args.kwargs
+        self.assertEqual((kwargs['model'], kwargs['timeout']), ('summarizer', 7))
+        self.assertEqual(get_gateway().stats()['in_flight'], 0)
+
+    @override_settings(LLM_MAX_RETRIES=0, LLM_BREAKER_THRESHOLD=1, LLM_BREAKER_RESET=60)
+    def test_open_breaker_sheds_the_summary(self):
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = upstream_timeout()
+        with mock.patch('chatbot.history.get_openrouter_client', return_value=client), \
+                mock.patch('builtins.print'):
+            build_history(self.session)  # opens the breaker
+            history = build_history(self.session)
+        self.assertEqual(client.chat.completions.create.call_count, 1)  # second summary failed fast
+        self.assertEqual(self.contents(history), [f'turn {i} has five words' for i in (7, 8, 9)])
+
+
+# ---------------------------
+#  History pagination (keyset)
+# ---------------------------
+@override_settings(CHAT_LEGACY_READ=False, CHAT_LEGACY_DUAL_WRITE=False)
+class HistoryPaginationTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='mona', password='pw')
+        self.session = ChatSession.objects.create(user=self.user)
+        start = timezone.now() - timedelta(hours=1)
+        # Pairs share a timestamp, so ties are broken by message_id
+        Message.objects.bulk_create([
+            Message(session=self.session, role='user', content=f'm{i}', timestamp=start + timedelta(seconds=i // 2))
+            for i in range(25)
+        ])
+        self.client.force_login(self.user)
+
+    def page(self, cursor=None, limit=7):
+        params = {'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(reverse('chat_history'), params)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        return [msg['id'] for msg in body['messages']], body['next_cursor']
+
+    def expected_ids(self):
+        return [str(pk) for pk in Message.objects.filter(session=self.session)
+                .order_by('timestamp', 'message_id').values_list('message_id', flat=True)]
+
+    def test_pages_have_no_duplicates_or_gaps(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            ids, cursor = self.page(cursor)
+            seen = ids + seen
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(pages, 4)
+        self.assertEqual(seen, self.expected_ids())
+
+    def test_cursor_is_stable_across_inserts(self):
+        all_ids = self.expected_ids()
+        first, cursor = self.page()
+        self.assertEqual(first, all_ids[-7:])
+        Message.objects.bulk_create([make_message(self.session, 'assistant', f'new {i}') for i in range(5)])
+        second, _ = self.page(cursor)
+        self.assertEqual(second, all_ids[-14:-7])
+
+    def test_rejects_bad_cursor_and_limit(self):
+        for params in ({'cursor': 'garbage'}, {'cursor': 'not-a-date|%s' % uuid.uuid4()},
+                       {'cursor': '2024-01-01T00:00:00+00:00|not-a-uuid'}, {'limit': 'ten'}):
+            response = self.client.get(reverse('chat_history'), params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+# ---------------------------
+#  Legacy chat import
+# ---------------------------
+@override_settings(CHAT_LEGACY_READ=False, CHAT_LEGACY_DUAL_WRITE=False)
+class LegacyChatImportTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='nina', password='pw')
+        Chat.objects.bulk_create([
+            Chat(user=self.user, message=f'old question {i}', response=f'old answer {i}') for i in range(3)
+        ])
+        for i, chat in enumerate(Chat.objects.order_by('id')):
+            Chat.objects.filter(pk=chat.pk).update(created_at=timezone.now() - timedelta(days=10 - i))
+
+    def migrate(self):
+        call_command('migrate_legacy_chats', stdout=StringIO())
+
+    def shown_on_chat_page(self):
+        self.client.force_login(self.user)
+        return [msg['content'] for msg in self.client.get(reverse('chatbot')).context['session_messages']]
+
+    def test_import_is_shown_when_there_is_no_active_session(self):
+        self.migrate()
+        imported = ChatSession.objects.get(user=self.user)
+        self.assertTrue(imported.is_active and imported.imported_from_legacy)
+        shown = self.shown_on_chat_page()
+        self.assertEqual(shown[:2], ['old question 0', 'old answer 0'])
+        self.assertEqual(len(shown), 6)
+
+    def test_import_replaces_an_empty_active_session(self):
+        self.assertEqual(self.shown_on_chat_page(), [])  # creates (and caches) an empty active session
+        empty = ChatSession.objects.get(user=self.user)
+        self.migrate()
+        self.assertFalse(ChatSession.objects.get(pk=empty.pk).is_active)
+        self.assertEqual(len(self.shown_on_chat_page()), 6)
+
+    def test_import_stays_inactive_next_to_a_used_session(self):
+        current = ChatSession.objects.create(user=self.user)
+        Message.objects.bulk_create([make_message(current, 'user', 'new question')])
+        self.migrate()
+        imported = ChatSession.objects.get(user=self.user, imported_from_legacy=True)
+        self.assertFalse(imported.is_active)
+        self.assertEqual(Message.objects.filter(session=imported).count(), 6)
+        self.assertEqual(self.shown_on_chat_page(), ['new question'])
+
+        self.migrate()  # re-running imports nothing twice
+        self.assertEqual(ChatSession.objects.filter(user=self.user).count(), 2)
+
+    def test_archived_sessions_are_not_imported_again(self):
+        # A real session from before the legacy rows: they were dual-written, nothing to import
+        dual = ChatSession.objects.create(user=self.user, is_active=False)
+        Message.objects.bulk_create([make_message(dual, 'user', 'old question 0')])
+        ChatSession.objects.filter(pk=dual.pk).update(
+            created_at=timezone.now() - timedelta(days=20), updated_at=timezone.now() - timedelta(days=20)
+        )
+        archive.compact_sessions(archive.default_cutoff(days=15))
+        self.assertFalse(ChatSession.objects.filter(user=self.user).exists())
+        self.migrate()
+        self.assertFalse(ChatSession.objects.filter(user=self.user).exists())
+
+        # An imported session that was archived since
+        other = User.objects.create_user(username='omar', password='pw')
+        Chat.objects.create(user=other, message='q', response='a')
+        Chat.objects.filter(user=other).update(created_at=timezone.now() - timedelta(days=40))
+        self.migrate()
+        ChatSession.objects.filter(user=other).update(is_active=False, updated_at=timezone.now() - timedelta(days=40))
+        archive.compact_sessions(archive.default_cutoff(days=30))
+        self.assertTrue(ArchivedSession.objects.filter(user=other, imported_from_legacy=True).exists())
+        self.migrate()
+        self.assertFalse(ChatSession.objects.filter(user=other).exists())
+
+
+# ---------------------------
+#  Pre-rendered HTML backfill
+# ---------------------------
+class BackfillRenderedHtmlTests(TestCase):
+    def test_renders_stale_rows(self):
+        user = User.objects.create_user(username='lena', password='pw')
+        session = ChatSession.objects.create(user=user)
+        Message.objects.bulk_create([
+            Message(session=session, role='assistant', content=f'**answer {i}**', render_version=0) for i in range(3)
+        ] + [
+            Message(session=session, role='user', content='**question**', render_version=0),
+            Message(session=session, role='assistant', content='**fresh**', content_html='<p>kept</p>',
+                    render_version=RENDER_VERSION),
+        ])
+        Chat.objects.bulk_create([Chat(user=user, message='q', response=f'*old {i}*') for i in range(2)])
+
+        out = StringIO()
+        call_command('backfill_rendered_html', '--batch-size', '2', stdout=out)
+        self.assertIn(f'Rendered 3 message(s) and 2 legacy chat(s) at version {RENDER_VERSION}', out.getvalue())
+        for msg in Message.objects.filter(role='assistant').exclude(content='**fresh**'):
+            self.assertEqual((msg.content_html, msg.render_version), (render_markdown(msg.content), RENDER_VERSION))
+        for chat in Chat.objects.all():
+            self.assertEqual(chat.response_html, render_markdown(chat.response))
+            self.assertEqual(chat.render_version, RENDER_VERSION)
+        self.assertEqual(Message.objects.get(content='**fresh**').content_html, '<p>kept</p>')
+        self.assertEqual(Message.objects.get(role='user').content_html, '')
+
+        out = StringIO()
+        call_command('backfill_rendered_html', stdout=out)
+        self.assertIn('Rendered 0 message(s) and 0 legacy chat(s)', out.getvalue())
+
+
+# ---------------------------
+#  LLM response cache
+# ---------------------------
+class LLMCacheKeyTests(SimpleTestCase):
+    def rag_turn(self, question, history=()):
+        content = f"{llm_cache.RAG_PROMPT_PREFIX} ...\n\nDocument Content:\nctx\n\nUser Question: {question}"
+        return [{'role': 'system', 'content': 'sys'}, *history, {'role': 'user', 'content': content}]
+
+    def test_normalize(self):
+        self.assertEqual(llm_cache.normalize("  What   is\nthe WARRANTY?? "), "what is the warranty")
+
+    @override_settings(LLM_CACHE_NORMALIZED=True)
+    def test_normalized_rag_keys_ignore_history_and_spelling(self):
+        history = [{'role': 'user', 'content': 'earlier'}, {'role': 'assistant', 'content': 'reply'}]
+        key = llm_cache.cache_key('m', self.rag_turn('What is the warranty?'))
+        self.assertEqual(llm_cache.cache_key('m', self.rag_turn('what is  the warranty', history)), key)
+        self.assertNotEqual(llm_cache.cache_key('other', self.rag_turn('What is the warranty?')), key)
+        plain = [{'role': 'user', 'content': 'hi'}]
+        self.assertNotEqual(llm_cache.cache_key('m', plain), llm_cache.cache_key('m', history + plain))
+
+    @override_settings(LLM_CACHE_NORMALIZED=False)
+    def test_exact_keys_by_default(self):
+        self.assertNotEqual(llm_cache.cache_key('m', self.rag_turn('What is the warranty?')),
+                            llm_cache.cache_key('m', self.rag_turn('what is the warranty')))
+
+
+@override_settings(CHAT_LEGACY_DUAL_WRITE=False, LLM_CACHE_ENABLED=True, LLM_MODELS=['first', 'second'],
+                   LLM_HEDGE_DELAY='off')
+class LLMCacheViewTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_gateway()
+        routing.tracker.clear()
+        self.addCleanup(reset_gateway)
+        self.addCleanup(routing.tracker.clear)
+        self.client.force_login(User.objects.create_user(username='omar', password='pw'))
+
+    def ask(self, client):
+        with mock.patch('chatbot.views.get_openrouter_client', return_value=client):
+            return self.client.post(reverse('chatbot'), {'message': 'hi'}).json()
+
+    def test_hit_flag_and_answering_model(self):
+        routing.tracker.observe('second', 0.1)  # measured, so ranked ahead of 'first'
+        client = fake_completion('cached answer')
+        first = self.ask(client)
+        self.assertEqual((first['cached'], first['model']), (False, 'second'))
+
+        self.client.post(reverse('new_session'))  # same payload again: empty history + same question
+        second = self.ask(client)
+        self.assertEqual((second['cached'], second['response']), (True, render_markdown('cached answer')))
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+
+        # Stored under the model that produced it; found whichever model ranks first now
+        messages = compose_messages([], 'hi')
+        self.assertIsNotNone(caches['llm'].get(llm_cache.cache_key('second', messages)))
+        self.assertIsNone(caches['llm'].get(llm_cache.cache_key('first', messages)))
+
+
+# ---------------------------
+#  Dense vectors
+# ---------------------------
+@override_settings(VECTOR_DIM=256)
+class VectorTests(SimpleTestCase):
+    CHUNKS = [
+        "pump pressure valve outlet pressure",
+        "warranty clause for the supplier contract",
+        "battery voltage and firmware module",
+        "pressure sensor calibration",
+    ]
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.enterContext(self.settings(FAISS_INDEX_PATH=tmp))
+        self.chunks_path = os.path.join(tmp, 'pdfs', 'chunks_7.chunks')
+
+    def test_top_k_order(self):
+        matrix = vectors.embed_many(self.CHUNKS)
+        hits = vectors.top_k(matrix, vectors.embed("valve pressure"), 3)
+        self.assertEqual([row for _, row in hits][:2], [0, 3])
+        self.assertEqual([score for score, _ in hits], sorted((score for score, _ in hits), reverse=True))
+        self.assertEqual(vectors.top_k(matrix, vectors.embed("valve pressure"), 0), [])
+
+        results = vectors.search("battery firmware", {'a': matrix, 'b': matrix[:2]}, k=2)
+        self.assertEqual(results[0][1], ('a', 2))
+
+    def test_memmap_reload(self):
+        built = vectors.build_vectors(self.CHUNKS, self.chunks_path)
+        loaded = vectors.load_vectors(self.chunks_path, self.CHUNKS)
+        self.assertIsInstance(loaded, np.memmap)
+        self.assertEqual(loaded.shape, (4, 256))
+        np.testing.assert_array_equal(loaded, built)
+        self.assertIsNone(vectors.load_vectors(os.path.join(os.path.dirname(self.chunks_path), 'chunks_8.chunks')))
+
+    def test_rebuild_on_stale_shape(self):
+        vectors.build_vectors(self.CHUNKS[:2], self.chunks_path)
+        with mock.patch('builtins.print') as printed:
+            self.assertEqual(vectors.load_vectors(self.chunks_path, self.CHUNKS).shape, (4, 256))
+        self.assertIn('Rebuilding stale vectors', printed.call_args.args[0])
+
+        with self.settings(VECTOR_DIM=128), mock.patch('builtins.print'):
+            self.assertEqual(vectors.load_vectors(self.chunks_path, self.CHUNKS).shape, (4, 128))
+
+
+# ---------------------------
+#  PDF page extraction
+# ---------------------------
+class PdfExtractionTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = make_pdf(os.path.join(tmp, 'doc.pdf'), pages=7, lines_per_page=5)
+        self.reader = PdfReader(self.path)
+
+    def test_parallel_matches_serial_order(self):
+        # A private pool for this test, shut down afterwards
+        self.enterContext(mock.patch.object(pdf_extract, '_pool', None))
+        self.addCleanup(lambda: pdf_extract._pool and pdf_extract._pool.shutdown())
+        serial = list(pdf_extract.iter_pages_serial(self.reader))
+        parallel = list(pdf_extract.iter_pages(self.path, self.reader, workers=2, min_pages=1, shard_size=2))
+        self.assertEqual([page_no for page_no, _ in parallel], list(range(1, 8)))
+        self.assertEqual(parallel, serial)
+        self.assertIn('page7', parallel[-1][1])
+
+    def test_small_files_are_read_serially(self):
+        with mock.patch.object(pdf_extract, 'get_pool') as get_pool:
+            pages = list(pdf_extract.iter_pages(self.path, self.reader, workers=4, min_pages=64))
+            one_page = make_pdf(os.path.join(os.path.dirname(self.path), 'one.pdf'), pages=1)
+            single = list(pdf_extract.iter_pages(one_page, PdfReader(one_page), workers=4, min_pages=1))
+            serial_workers = list(pdf_extract.iter_pages(self.path, self.reader, workers=1, min_pages=1))
+        get_pool.assert_not_called()
+        self.assertEqual(pages, list(pdf_extract.iter_pages_serial(self.reader)))
+        self.assertEqual(serial_workers, pages)
+        self.assertEqual([page_no for page_no, _ in single], [1])
+
+
+# ---------------------------
+#  Binary chunk store
+# ---------------------------
+def write_legacy_chunks(path, texts, spans=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"\n{CHUNK_SEPARATOR}\n".join(texts))
+    if spans is not None:
+        with open(spans_path_for(path), 'w', encoding='utf-8') as f:
+            json.dump(spans, f)
+    return path
+
+
+class ChunkStoreTests(TestCase):
+    # More than one block (CHUNKS_PER_BLOCK = 32); text that would break the legacy format
+    TEXTS = [f"chunk {i} ünïcode\n{CHUNK_SEPARATOR}\nstill chunk {i}" for i in range(70)]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_round_trip(self):
+        for compress in (False, True):
+            path = write_store(os.path.join(self.tmp, f'chunks_{compress}.chunks'), self.TEXTS, compress=compress)
+            self.assertFalse([name for name in os.listdir(self.tmp) if name.endswith('.tmp')])
+            store = open_chunks(path)
+            self.addCleanup(store.close)
+            self.assertIsInstance(store, ChunkStore)
+            self.assertEqual(store.compressed, compress)
+            self.assertEqual(len(store), 70)
+            self.assertEqual(store[69], self.TEXTS[69])
+            self.assertEqual(store[3], self.TEXTS[3])
+            self.assertEqual(list(store), self.TEXTS)
+            self.assertEqual(store.span(1), (1, 1, len(self.TEXTS[0]) + 1, 2 * len(self.TEXTS[0]) + 1))
+            with self.assertRaises(IndexError):
+                store[70]
+
+    def test_failed_write_leaves_no_store(self):
+        path = os.path.join(self.tmp, 'chunks_x.chunks')
+        with self.assertRaises(RuntimeError):
+            with ChunkWriter(path) as writer:
+                writer.write(Chunk('text', 1, 1, 0, 4))
+                raise RuntimeError('extraction failed')
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_concurrent_writers_of_one_path(self):
+        # Two ingestion jobs for the same content write the same store
+        path = os.path.join(self.tmp, 'chunks_x.chunks')
+        first, second = ChunkWriter(path), ChunkWriter(path)
+        for i, text in enumerate(self.TEXTS):
+            first.write(Chunk(text, 1, 1, i, i + 1))
+            second.write(Chunk(text, 1, 1, i, i + 1))
+        first.close()
+        second.close()
+        self.assertEqual(os.listdir(self.tmp), ['chunks_x.chunks'])
+        with closing(open_chunks(path)) as store:
+            self.assertEqual(list(store), self.TEXTS)
+
+    def test_legacy_text_file(self):
+        path = write_legacy_chunks(os.path.join(self.tmp, 'chunks_1.txt'), ['first chunk', 'second\nchunk'],
+                                   spans=[[1, 1, 0, 11], [1, 2, 12, 24]])
+        chunks = open_chunks(path)
+        self.assertIsInstance(chunks, TextChunks)
+        self.assertEqual(list(chunks), ['first chunk', 'second\nchunk'])
+        self.assertEqual(chunks.span(1), (1, 2, 12, 24))
+
+        os.remove(spans_path_for(path))
+        self.assertIsNone(open_chunks(path).span(0))
+
+    def test_migrate_chunk_stores(self):
+        texts = ['first chunk', 'second chunk']
+        path = write_legacy_chunks(os.path.join(self.tmp, 'chunks_2.txt'), texts, spans=[[1, 1, 0, 11], [2, 2, 12, 24]])
+        kept = write_legacy_chunks(os.path.join(self.tmp, 'chunks_3.txt'), texts)
+        user = User.objects.create_user(username='pia', password='pw')
+        pdf = UploadedPDF.objects.create(user=user, file='pdfs/a.pdf', status='ready', faiss_index_path=path)
+        UploadedPDF.objects.create(user=user, file='pdfs/b.pdf', status='ready', faiss_index_path=kept)
+
+        self.assertEqual(len(hot_state.get(user).ready_pdfs), 2)  # cached with the .txt paths
+
+        out = StringIO()
+        call_command('migrate_chunk_stores', stdout=out)
+        self.assertIn('Migrated 2 chunk file(s)', out.getvalue())
+        # The cached hot state must not keep pointing at the removed .txt files
+        self.assertTrue(all(is_chunk_store(p.faiss_index_path) for p in hot_state.get(user).ready_pdfs))
+        pdf.refresh_from_db()
+        self.assertTrue(pdf.faiss_index_path.endswith('chunks_2.chunks'))
+        self.assertFalse(os.path.exists(path) or os.path.exists(spans_path_for(path)))
+        store = open_chunks(pdf.faiss_index_path)
+        self.addCleanup(store.close)
+        self.assertEqual((list(store), store.span(1)), (texts, (2, 2, 12, 24)))
+        # Chunks without recorded spans get page 0 ("unknown")
+        self.assertEqual(open_chunks(chunk_store_path_for(kept)).span(0), (0, 0, 0, 0))
+
+        out = StringIO()
+        call_command('migrate_chunk_stores', stdout=out)
+        self.assertIn('Migrated 0 chunk file(s)', out.getvalue())
+
+    def test_migrate_keep_text(self):
+        path = write_legacy_chunks(os.path.join(self.tmp, 'chunks_4.txt'), ['only chunk'])
+        UploadedPDF.objects.create(user=User.objects.create_user(username='quin', password='pw'),
+                                   file='pdfs/c.pdf', status='ready', faiss_index_path=path)
+        call_command('migrate_chunk_stores', '--keep-text', stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(is_chunk_store(chunk_store_path_for(path)))
+
+
+# ---------------------------
+#  Load-test tooling
+# ---------------------------
+class FakeLLMTests(SimpleTestCase):
+    def start(self, **options):
+        config = fake_llm.FakeLLMConfig(latency=0, jitter=0, tokens_per_second=0, seed=1, **options)
+        server = fake_llm.start_in_thread(config)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address
+        client = openai.OpenAI(base_url=f'http://{host}:{port}/v1', api_key='fake', max_retries=0)
+        self.addCleanup(client.close)
+        return server, client
+
+    def test_completion(self):
+        server, client = self.start(response_tokens=8)
+        completion = client.chat.completions.create(
+            model='fake/model', messages=[{'role': 'user', 'content': 'what about refunds'}],
+        )
+        self.assertEqual(completion.model, 'fake/model')
+        self.assertEqual(completion.choices[0].message.content, 'what about refunds Based on the document the')
+        self.assertEqual(completion.usage.completion_tokens, 8)
+        self.assertEqual(server.config.requests, 1)
+
+    def test_stream(self):
+        _, client = self.start(response_tokens=20)
+        stream = client.chat.completions.create(
+            model='fake', messages=[{'role': 'user', 'content': 'hi'}], max_tokens=5, stream=True,
+        )
+        tokens = [chunk.choices[0].delta.content for chunk in stream if chunk.choices[0].delta.content]
+        self.assertEqual(len(tokens), 5)
+        self.assertEqual(tokens[0], 'hi')
+
+    def test_error_injection(self):
+        server, client = self.start(error_rate=1.0, error_status=503)
+        with self.assertRaises(openai.APIStatusError) as raised:
+            client.chat.completions.create(model='fake', messages=[{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(raised.exception.response.headers['Retry-After'], '1')
+        self.assertEqual((server.config.requests, server.config.errors), (1, 1))
+
+
+class LoadgenTests(SimpleTestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((loadgen.percentile(values, 50), loadgen.percentile(values, 99)), (50, 99))
+        self.assertEqual(loadgen.percentile(values, 0), 1)
+        self.assertEqual(loadgen.percentile([7], 95), 7)
+        self.assertIsNone(loadgen.percentile([], 50))
+
+    def test_recorder_summary(self):
+        recorder = loadgen.Recorder()
+        for seconds in (0.1, 0.3, 0.2):
+            recorder.record('POST /', seconds, ok=True)
+        recorder.record('POST /', 0.4, ok=False)
+        recorder.record('GET /login/', 0.05, ok=True)
+        recorder.finished = recorder.started + 2.0
+        summary = recorder.summary()
+        self.assertEqual(summary['elapsed_s'], 2.0)
+        chat = summary['endpoints']['POST /']
+        self.assertEqual((chat['requests'], chat['errors'], chat['throughput_rps']), (4, 1, 2.0))
+        self.assertAlmostEqual(chat['p50_ms'], 200.0)
+        self.assertAlmostEqual(chat['max_ms'], 400.0)
+        self.assertEqual(summary['endpoints']['GET /login/']['errors'], 0)
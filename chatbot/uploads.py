@@ -0,0 +1,135 @@
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .chunk_cache import chunk_cache
+from .ingestion import enqueue
+from .models import PdfContent, UploadedPDF
+from .retrieval import index_path_for
+from .vectors import vectors_path_for
+
+
+# ---------------------------
+#  Hash while receiving
+# ---------------------------
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Computes the SHA-256 of every uploaded file as its bytes arrive, then hands
+    the data on unchanged to the next handler (memory / temp file).
+    Must come first in FILE_UPLOAD_HANDLERS; digests end up in request.upload_digests.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self._sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_digests'):
+            self.request.upload_digests = {}
+        self.request.upload_digests[self.field_name] = self._sha256.hexdigest()
+        return None
+
+
+def upload_digest(request, field_name, upload):
+    """SHA-256 of an uploaded file; re-reads it only if the hashing handler wasn't installed"""
+    digest = getattr(request, 'upload_digests', {}).get(field_name)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        for block in upload.chunks():
+            sha256.update(block)
+        digest = sha256.hexdigest()
+        upload.seek(0)
+    return digest
+
+
+# ---------------------------
+#  Deduplicated storage
+# ---------------------------
+def store_upload(user, upload, digest):
+    """
+    Create the user's UploadedPDF for an upload, sharing the stored file (and,
+    once ingested, the chunk store + index) with every earlier upload of the
+    same bytes. Returns (pdf_obj, job); job is None when the content was
+    already ingested and the new row is ready immediately.
+    """
+    content = PdfContent.objects.filter(sha256=digest).first()
+    name = None
+    if content is None:
+        name = default_storage.save(f"pdfs/{digest}.pdf", upload)
+    try:
+        # The new reference and the row holding it commit (or roll back) together
+        with transaction.atomic():
+            if content is None:
+                try:
+                    with transaction.atomic():
+                        content = PdfContent.objects.create(sha256=digest, file=name, size=upload.size, ref_count=1)
+                except IntegrityError:
+                    # An identical upload won the race; use its copy
+                    content = PdfContent.objects.get(sha256=digest)
+                    PdfContent.objects.filter(pk=content.pk).update(ref_count=F('ref_count') + 1)
+            else:
+                PdfContent.objects.filter(pk=content.pk).update(ref_count=F('ref_count') + 1)
+
+            fields = {'user': user, 'file': content.file.name, 'original_name': upload.name, 'content': content}
+            if content.chunks_path and os.path.exists(content.chunks_path):
+                pdf_obj = UploadedPDF.objects.create(**fields, faiss_index_path=content.chunks_path, status='ready')
+                job = None
+            else:
+                pdf_obj = UploadedPDF.objects.create(**fields)
+                job = enqueue(pdf_obj)
+    except Exception:
+        if name is not None:
+            default_storage.delete(name)
+        raise
+    if name is not None and content.file.name != name:
+        default_storage.delete(name)
+    return pdf_obj, job
+
+
+# ---------------------------
+#  Reference counting / GC
+# ---------------------------
+def release_content(content_id):
+    """Drop one reference; the content's files go once nobody points at it (after commit)"""
+    PdfContent.objects.filter(pk=content_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    if PdfContent.objects.filter(pk=content_id, ref_count=0).exists():
+        transaction.on_commit(lambda: collect_content(content_id))
+
+
+def collect_content(content_id):
+    """Delete an unreferenced PdfContent with its PDF, chunk store, index and vectors"""
+    content = PdfContent.objects.filter(pk=content_id, ref_count=0).first()
+    if content is None:
+        return False
+    # Conditional delete: a concurrent upload may have just taken a new reference
+    deleted, _ = PdfContent.objects.filter(pk=content_id, ref_count=0).delete()
+    if not deleted:
+        return False
+    paths = []
+    if content.chunks_path:
+        chunk_cache.invalidate(content.chunks_path)
+        paths += [content.chunks_path, index_path_for(content.chunks_path), vectors_path_for(content.chunks_path)]
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if content.file:
+        default_storage.delete(content.file.name)
+    return True
+
+
+def collect_garbage():
+    """Sweep every unreferenced PdfContent (e.g. left behind by a crash before on_commit ran)"""
+    collected = 0
+    for content_id in PdfContent.objects.filter(ref_count=0).values_list('pk', flat=True):
+        collected += collect_content(content_id)
+    return collected
@@ -3,18 +3,25 @@ from . import views
 
 urlpatterns = [
     path('', views.chatbot_view, name="chatbot"),
+    path('chat/stream/', views.chatbot_stream, name="chatbot_stream"),
+    path('chat/async/', views.chatbot_async_view, name="chatbot_async"),
+    path('chat/history/', views.chat_history, name="chat_history"),
     path('login/', views.login_view, name="login"),
     path('register/', views.register_view, name="register"),
     path('logout/', views.logout_view, name="logout"),
 
     # ✅ New route for PDF upload
     path('upload-pdf/', views.upload_pdf, name="upload_pdf"),
+    # ✅ JSON progress for background PDF ingestion
+    path('upload-pdf/status/<int:job_id>/', views.ingestion_status, name="ingestion_status"),
     # ✅ Test route for debugging PDF processing
     path('test-pdf/', views.test_pdf_processing, name="test_pdf"),
     # ✅ Debug route for CSRF issues
     path('debug-csrf/', views.debug_csrf, name="debug_csrf"),
     # ✅ New route for starting new conversation session
     path('new-session/', views.start_new_session, name="new_session"),
+    # Prometheus scrape endpoint (404 unless METRICS_ENABLED)
+    path('metrics/', views.metrics_view, name="metrics"),
 ]
 
 
@@ -0,0 +1,164 @@
+import heapq
+import math
+import os
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from .retrieval import temp_path_for, tokenize
+
+VECTOR_DTYPE = np.float32
+
+
+def enabled():
+    """Dense retrieval is used instead of BM25 when RAG_RETRIEVER = 'dense'"""
+    return getattr(settings, 'RAG_RETRIEVER', 'bm25') == 'dense'
+
+
+def vector_dim():
+    return getattr(settings, 'VECTOR_DIM', 1024)
+
+
+def vectors_path_for(chunks_path):
+    """media/pdfs/chunks_12.txt -> <FAISS_INDEX_PATH>/chunks_12.npy"""
+    root, _ = os.path.splitext(os.path.basename(chunks_path))
+    return os.path.join(settings.FAISS_INDEX_PATH, f"{root}.npy")
+
+
+# ---------------------------
+#  Hashing vectorizer
+# ---------------------------
+def _features(text):
+    """Word counts (the same tokens BM25 uses)"""
+    counts = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+def _bucket(gram, dim):
+    h = zlib.crc32(gram.encode('utf-8'))
+    return h % dim, (1.0 if h & 0x80000000 else -1.0)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def embed(text, dim=None):
+    """
+    Query vector: signed feature hashing of word counts with sublinear tf,
+    L2-normalised. Deterministic and offline (no model download or vocabulary).
+    """
+    dim = dim or vector_dim()
+    vec = np.zeros(dim, dtype=VECTOR_DTYPE)
+    for gram, tf in _features(text).items():
+        bucket, sign = _bucket(gram, dim)
+        vec[bucket] += sign * (1.0 + math.log(tf))
+    return _normalize(vec)
+
+
+def embed_many(texts, dim=None, out=None):
+    """
+    Chunk vectors: like embed(), with each feature additionally weighted by its
+    idf within the document, so boilerplate shared by most chunks doesn't drown
+    out the rarer terms a question is usually about.
+    texts must be re-iterable (two passes: document frequencies, then rows);
+    rows are written into `out` when given, e.g. a memmap of the output file.
+    """
+    dim = dim or vector_dim()
+    df = {}
+    n = 0
+    for text in texts:
+        n += 1
+        for gram in _features(text):
+            df[gram] = df.get(gram, 0) + 1
+    matrix = out if out is not None else np.zeros((n, dim), dtype=VECTOR_DTYPE)
+    buckets = {}
+    for row, text in enumerate(texts):
+        vec = matrix[row]
+        for gram, tf in _features(text).items():
+            hashed = buckets.get(gram)
+            if hashed is None:
+                hashed = buckets[gram] = _bucket(gram, dim)
+            bucket, sign = hashed
+            vec[bucket] += sign * (1.0 + math.log(tf)) * math.log(1 + n / df[gram])
+        _normalize(vec)
+    return matrix
+
+
+# ---------------------------
+#  Persistence (.npy, memory-mapped)
+# ---------------------------
+def _count(texts):
+    return len(texts) if hasattr(texts, '__len__') else sum(1 for _ in texts)
+
+
+def build_vectors(chunks, chunks_path):
+    """
+    Embed the chunks straight into a float32 .npy file and return a read-only memmap.
+    chunks may be a list or a re-iterable reader over the chunks file.
+    """
+    path = vectors_path_for(chunks_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = temp_path_for(path)
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=VECTOR_DTYPE, shape=(_count(chunks), vector_dim()))
+    embed_many(chunks, out=out)
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+
+def load_vectors(chunks_path, chunks=None):
+    """
+    Memory-map the chunk vectors; every worker maps the same file, so the matrix
+    lives once in the OS page cache instead of once per process.
+    Missing or mismatched files are (re)built when the chunks are given.
+    """
+    path = vectors_path_for(chunks_path)
+    if os.path.exists(path):
+        try:
+            matrix = np.load(path, mmap_mode='r')
+            if matrix.ndim == 2 and matrix.shape[1] == vector_dim() and (
+                chunks is None or matrix.shape[0] == len(chunks)
+            ):
+                return matrix
+            print(f"Rebuilding stale vectors {path}: shape {matrix.shape}")
+        except (ValueError, OSError) as e:
+            print(f"Rebuilding unreadable vectors {path}: {str(e)}")
+    if chunks is None:
+        return None
+    return build_vectors(chunks, chunks_path)
+
+
+# ---------------------------
+#  Query-time search
+# ---------------------------
+def top_k(matrix, query_vec, k):
+    """Top-k (cosine, row) pairs, best first: one matvec + argpartition"""
+    if not len(matrix) or k <= 0:
+        return []
+    scores = matrix @ query_vec
+    k = min(k, len(scores))
+    rows = np.argpartition(scores, len(scores) - k)[-k:]
+    rows = rows[np.argsort(scores[rows])[::-1]]
+    return [(float(scores[row]), int(row)) for row in rows if scores[row] > 0]
+
+
+def search(query, matrices, k=3):
+    """
+    Top-k (score, (doc_id, chunk_id)) across documents, best first.
+    matrices: {doc_id: chunk vector matrix}. The query is embedded once.
+    """
+    query_vec = embed(query)
+    if not query_vec.any():
+        return []
+    candidates = []
+    for doc_id, matrix in matrices.items():
+        candidates.extend((score, (doc_id, row)) for score, row in top_k(matrix, query_vec, k))
+    return heapq.nlargest(k, candidates)
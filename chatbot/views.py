@@ -1,230 +1,174 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
-import markdown2
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+import json
+import hmac
+import time
 from django.contrib import auth
 from django.contrib.auth.models import User
-from .models import Chat, UploadedPDF, ChatSession, Message
+from .models import ArchivedSession, Chat, UploadedPDF, ChatSession, Message, IngestionJob
 from django.utils import timezone
-from openai import OpenAI
-import os
-
-
-# ✅ LangChain imports for RAG
-from langchain.text_splitter import CharacterTextSplitter
-from PyPDF2 import PdfReader
-import re
-from difflib import SequenceMatcher
+from django.db.models import Q
+from datetime import datetime, timedelta
+import uuid
+from asgiref.sync import sync_to_async
+
+from .llm import get_async_openrouter_client, get_openrouter_client
+from .llm_gateway import GatewayBusy, get_gateway
+from . import routing
+from .history import abuild_history, build_history
+from .rendering import RENDER_VERSION, chat_html, message_html, render_markdown
+from .retrieval import BM25Index, search_chunks
+from .chunk_cache import chunk_cache, user_indexes
+from . import archive, hot_state, llm_cache, metrics, packing
+from .ingestion import job_status, process_pdf  # noqa: F401 (process_pdf re-exported)
+from .uploads import store_upload, upload_digest
 
 from django.conf import settings
-from django.db import IntegrityError, OperationalError, DatabaseError
+from django.db import IntegrityError, OperationalError, DatabaseError, transaction
 from django.middleware.csrf import get_token
-
-# ✅ OpenRouter client setup (lazy)
-def get_openrouter_client():
-    api_key = getattr(settings, 'OPENROUTER_API_KEY', None)
-    if not api_key:
-        raise RuntimeError("OPENROUTER_API_KEY is not set")
-    return OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-        timeout=15.0,
-    )
+from django.urls import reverse
 
 # ---------------------------
-#  Simple Text Similarity Search
+#  BM25 Retrieval (see retrieval.py)
 # ---------------------------
-def find_relevant_chunks(query, chunks, top_k=3):
-    """Find most relevant chunks using simple text similarity"""
-    query_lower = query.lower()
-    query_words = set(query_lower.split())
-    
-    scored_chunks = []
-    
-    for i, chunk in enumerate(chunks):
-        chunk_lower = chunk.lower()
-        chunk_words = set(chunk_lower.split())
-        
-        # Calculate word overlap score
-        word_overlap = len(query_words.intersection(chunk_words))
-        word_ratio = word_overlap / len(query_words) if query_words else 0
-        
-        # Calculate sequence similarity
-        sequence_similarity = SequenceMatcher(None, query_lower, chunk_lower).ratio()
-        
-        # Combined score
-        combined_score = (word_ratio * 0.7) + (sequence_similarity * 0.3)
-        
-        scored_chunks.append((combined_score, i, chunk))
-    
-    # Sort by score and return top chunks
-    scored_chunks.sort(key=lambda x: x[0], reverse=True)
-    return [chunk for score, idx, chunk in scored_chunks[:top_k]]
+def find_relevant_chunks(query, chunks, top_k=3, index=None):
+    """Find most relevant chunks using the BM25 index (built on the fly if not given)"""
+    if index is None:
+        index = BM25Index.build(chunks)
+    return [chunks[i] for i in search_chunks(query, chunks, index, top_k=top_k)]
 
 from django.contrib import messages
 
 # ---------------------------
-#  PDF Upload View (original)
+#  LLM Chat (with conversation history and optional RAG)
 # ---------------------------
-def upload_pdf(request):
-    if request.method == 'POST' and request.FILES.get('pdf'):
-        try:
-            pdf_file = request.FILES['pdf']
-            
-            # Validate file type
-            if not pdf_file.name.lower().endswith('.pdf'):
-                messages.error(request, "❌ Please upload a valid PDF file.")
-                return redirect('upload_pdf')
 
-            pdf_obj = UploadedPDF.objects.create(user=request.user, file=pdf_file)
-            process_pdf(pdf_obj)  # extract + embed
 
-            messages.success(request, f"✅ {pdf_file.name} uploaded successfully!")
-            return redirect('chatbot')  # go back to chatbot after upload
+SYSTEM_PROMPT = "You are a helpful AI assistant."
 
+
+def retrieve_context(message, user_id, pdfs):
+    """
+    RAG context for the message drawn from all of the user's ready PDFs
+    ('' when nothing is found). Overlapping/adjacent hits are merged into one
+    passage, labelled with its source document, within RAG_CONTEXT_TOKENS.
+    """
+    context = ""
+    pdfs = [pdf for pdf in pdfs if pdf.faiss_index_path]
+    if pdfs:
+        try:
+            # One merged BM25 index per user; per-document chunks come from the worker cache
+            results = user_indexes.search(
+                user_id, pdfs, message, top_k=getattr(settings, 'RAG_CONTEXT_CANDIDATES', 10)
+            )
+            passages = packing.pack(results, getattr(settings, 'RAG_CONTEXT_TOKENS', 800))
+            context = packing.render(passages)
+            print(f"Packed {len(results)} relevant chunks into {len(passages)} passages across "
+                  f"{len(pdfs)} PDFs for query: {message[:50]}...")
         except Exception as e:
-            if 'pdf_obj' in locals():
-                pdf_obj.delete()
-            messages.error(request, f"❌ Error processing PDF: {str(e)}")
-            return redirect('upload_pdf')
+            print(f"Error reading PDF chunks: {str(e)}")
+    return context
 
-    return render(request, 'upload_pdf.html')
 
-# ---------------------------
-#  Utility: Extract + Process PDF
-# ---------------------------
-def process_pdf(pdf_obj):
-    """Extract text, split into chunks, and save for simple text search"""
-    try:
-        pdf_path = pdf_obj.file.path
-        reader = PdfReader(pdf_path)
-
-        # Extract text
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-
-        # Check if text was extracted
-        if not text.strip():
-            raise ValueError("No text could be extracted from the PDF")
-
-        # Split into chunks
-        splitter = CharacterTextSplitter(
-            separator="\n",
-            chunk_size=1000,  # Larger chunks for better context
-            chunk_overlap=200,
-            length_function=len
-        )
-        chunks = splitter.split_text(text)
+def ready_pdfs(user):
+    """The user's ingested PDFs (pending/processing/failed uploads are ignored), from the hot state"""
+    return hot_state.get(user).ready_pdfs
 
-        # Ensure chunks is a list and not empty
-        if not chunks or not isinstance(chunks, list):
-            raise ValueError("Failed to split text into chunks")
-        
-        # Filter out empty chunks
-        chunks = [chunk.strip() for chunk in chunks if chunk.strip()]
-        
-        if not chunks:
-            raise ValueError("No valid text chunks found after splitting")
-
-        print(f"Successfully extracted {len(chunks)} chunks from PDF: {pdf_obj.file.name}")
-        print(f"First chunk preview: {chunks[0][:100]}...")
-
-        # Save chunks as text file (simple approach)
-        chunks_text = "\n\n---CHUNK_SEPARATOR---\n\n".join(chunks)
-        chunks_path = os.path.join(settings.MEDIA_ROOT, "pdfs", f"chunks_{pdf_obj.id}.txt")
-        # Ensure directory exists (important on Render)
-        os.makedirs(os.path.dirname(chunks_path), exist_ok=True)
-        with open(chunks_path, 'w', encoding='utf-8') as f:
-            f.write(chunks_text)
-
-        # Save path to DB
-        pdf_obj.faiss_index_path = chunks_path  # Reusing this field for chunks path
-        pdf_obj.save()
-        
-        print(f"Successfully processed PDF: {pdf_obj.file.name}")
-        print(f"Chunks saved to: {chunks_path}")
-        
-    except Exception as e:
-        print(f"Error processing PDF {pdf_obj.file.name}: {str(e)}")
-        raise e
 
+def compose_messages(history, message, context=""):
+    """System prompt + prior turns + the user's question (wrapped with RAG context if any)"""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    messages.extend(history)
+    
+    # If we have RAG context, include it in the user message
+    if context:
+        message = f"""{llm_cache.RAG_PROMPT_PREFIX} If the answer is not in the document, say so clearly.
+
+Document Content:
+{context}
+
+User Question: {message}
+
+Please provide a helpful and accurate answer based on the document content."""
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+def build_chat_messages(message, user=None, session=None):
+    """
+    Build the LLM `messages` payload: system prompt, session history and the
+    user's question (wrapped with RAG context when the user has ready PDFs).
+    """
+    # Token-budgeted conversation history (rolling summary + recent turns)
+    with metrics.span('history'):
+        history = build_history(session) if session else []
+    
+    # Handle RAG context if user has uploaded PDFs
+    context = ""
+    if user:
+        pdfs = ready_pdfs(user)
+        with metrics.span('retrieval'):
+            context = retrieve_context(message, user.id, pdfs)
+
+    return compose_messages(history, message, context)
+
+
+async def abuild_chat_messages(message, user=None, session=None):
+    """Async ORM variant of build_chat_messages"""
+    with metrics.span('history'):
+        history = await abuild_history(session) if session else []
+    
+    context = ""
+    if user:
+        pdfs = (await hot_state.aget(user)).ready_pdfs
+        # Chunk loading / scoring is file I/O + CPU: keep it off the event loop
+        with metrics.span('retrieval'):
+            context = await sync_to_async(retrieve_context, thread_sensitive=False)(message, user.id, pdfs)
+
+    return compose_messages(history, message, context)
 
 
-# ---------------------------
-#  LLM Chat (with conversation history and optional RAG)
-# ---------------------------
 def ask_openai(message, user=None, session=None):
     """
     If user has uploaded PDFs, do RAG retrieval before sending to LLM.
     Uses conversation history if session is provided.
+    Returns (answer, cached, model) - cached is True when the answer came from the
+    response cache, model is the one that answered (None for cached/failed turns).
+    Raises GatewayBusy when the LLM gateway sheds the request (nothing was sent).
     """
     try:
-        # Build conversation history
-        messages = []
-        
-        # Add system message (optional)
-        messages.append({"role": "system", "content": "You are a helpful AI assistant."})
-        
-        # Add conversation history if session is provided
-        if session:
-            session_messages = Message.objects.filter(session=session).order_by('timestamp')
-            for msg in session_messages:
-                messages.append({"role": msg.role, "content": msg.content})
-        
-        # Add current user message
-        messages.append({"role": "user", "content": message})
-        
-        # Handle RAG context if user has uploaded PDFs
-        context = ""
-        if user:
-            pdfs = UploadedPDF.objects.filter(user=user)
-            if pdfs.exists():
-                # Load latest PDF's chunks
-                last_pdf = pdfs.last()
-                if last_pdf.faiss_index_path and os.path.exists(last_pdf.faiss_index_path):
-                    try:
-                        # Read chunks from file
-                        with open(last_pdf.faiss_index_path, 'r', encoding='utf-8') as f:
-                            chunks_text = f.read()
-                        
-                        # Split chunks
-                        chunks = [chunk.strip() for chunk in chunks_text.split("---CHUNK_SEPARATOR---") if chunk.strip()]
-                        
-                        if chunks:
-                            # Find relevant chunks using simple text similarity
-                            relevant_chunks = find_relevant_chunks(message, chunks, top_k=3)
-                            context = "\n\n".join(relevant_chunks)
-                            print(f"Found {len(relevant_chunks)} relevant chunks for query: {message[:50]}...")
-                        
-                    except Exception as e:
-                        print(f"Error reading PDF chunks: {str(e)}")
-
-        # If we have RAG context, modify the last user message to include it
-        if context:
-            messages[-1]["content"] = f"""Based on the following document content, please answer the user's question. If the answer is not in the document, say so clearly.
+        messages = build_chat_messages(message, user, session)
 
-Document Content:
-{context}
+        # Identical payloads (repeat questions, retries after timeouts) skip the round trip
+        keys = llm_cache.cache_keys(routing.chat_models(), messages) if llm_cache.enabled() else None
+        if keys:
+            answer = llm_cache.get(keys)
+            if answer is not None:
+                metrics.count_llm('cached')
+                return answer, True, None
 
-User Question: {message}
-
-Please provide a helpful and accurate answer based on the document content."""
-
-        # Call DeepSeek model with conversation history
+        # Fastest configured model, hedged to the next-fastest when it is slow
         try:
             client = get_openrouter_client()
-            completion = client.chat.completions.create(
-                model="openai/gpt-4o-mini",
-                messages=messages,
-                timeout=90,
-            )
-            answer = completion.choices[0].message.content.strip()
-            return answer
+            with metrics.span('llm'):
+                reply = routing.complete(client, messages)
+            answer = reply.content
+            metrics.count_llm('ok', reply.usage)
+            metrics.count_model(reply.model)
+        except GatewayBusy:
+            metrics.count_llm('rejected')
+            raise
         except Exception as llm_err:
+            metrics.count_llm('error')
             # Log and return concise error to avoid 500s
-            return f"Error contacting model: {str(llm_err)}"
+            return f"Error contacting model: {str(llm_err)}", False, None
+        if keys and answer:
+            llm_cache.set(llm_cache.cache_key(reply.model, messages), answer)
+        return answer, False, reply.model
+    except GatewayBusy:
+        raise
     except Exception as e:
-        return f"Error: {str(e)}"
+        return f"Error: {str(e)}", False, None
 
 
 # ---------------------------
@@ -235,35 +179,127 @@ def get_or_create_session(user):
     if not user.is_authenticated:
         return None
     
-    # Try to get the most recent active session
-    session = ChatSession.objects.filter(user=user, is_active=True).first()
+    # The active session comes from the cached hot state (no query in the steady state)
+    session = hot_state.get(user).session
     
     if not session:
-        # Create a new session
+        # Create a new session (post_save drops the cached state)
         session = ChatSession.objects.create(user=user)
     
     return session
 
-def get_session_messages(session):
-    """Get all messages for a session, formatted for display"""
+def save_chat_turn(user, session, message, response, response_html=None, model=None):
+    """
+    Persist one user/assistant exchange in a single transaction: one
+    bulk INSERT for both messages plus a targeted updated_at UPDATE.
+    The legacy Chat row is only written while CHAT_LEGACY_DUAL_WRITE is on.
+    """
+    if not (user.is_authenticated and session):
+        return
+    if response_html is None:
+        response_html = render_markdown(response)
+    
+    now = timezone.now()
+    turn = [Message(session=session, role='user', content=message, timestamp=now)]
+    # Save assistant response (a stream aborted before the first token has none)
+    if response:
+        turn.append(Message(
+            session=session,
+            role='assistant',
+            content=response,
+            content_html=response_html,
+            render_version=RENDER_VERSION,
+            model=model or '',
+            # keep (timestamp, message_id) ordering stable: reply sorts after the question
+            timestamp=now + timedelta(microseconds=1),
+        ))
+    
+    with transaction.atomic():
+        Message.objects.bulk_create(turn)
+        ChatSession.objects.filter(pk=session.pk).update(updated_at=now)
+        
+        if getattr(settings, 'CHAT_LEGACY_DUAL_WRITE', False):
+            Chat.objects.create(
+                user=user,
+                message=message,
+                response=response,
+                response_html=response_html,
+                render_version=RENDER_VERSION,
+            )
+    session.updated_at = now
+
+async def aget_or_create_session(user):
+    """Async ORM variant of get_or_create_session"""
+    if not user.is_authenticated:
+        return None
+    
+    session = (await hot_state.aget(user)).session
     if not session:
-        return []
+        session = await ChatSession.objects.acreate(user=user)
+    return session
+
+
+# Transactions need a sync context, so the async path runs the same write in a thread
+asave_chat_turn = sync_to_async(save_chat_turn)
+
+def encode_cursor(msg):
+    """Keyset cursor for the (timestamp, message_id) position of a message"""
+    return f"{msg.timestamp.isoformat()}|{msg.message_id}"
+
+
+def decode_cursor(cursor):
+    timestamp, message_id = cursor.split('|', 1)
+    return datetime.fromisoformat(timestamp), uuid.UUID(message_id)
+
+
+def get_session_messages(session, limit=None, cursor=None):
+    """
+    Newest `limit` messages of a session older than `cursor` (keyset on
+    (timestamp, message_id), never OFFSET), formatted for display oldest-first.
+    Returns (messages, next_cursor); next_cursor is None when nothing older remains.
+    """
+    if not session:
+        return [], None
+    limit = limit or getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 30)
     
-    messages = Message.objects.filter(session=session).order_by('timestamp')
-    formatted_messages = []
+    messages = Message.objects.filter(session=session)
+    if cursor:
+        timestamp, message_id = decode_cursor(cursor)
+        messages = messages.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, message_id__lt=message_id)
+        )
+    page = list(messages.order_by('-timestamp', '-message_id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit][::-1]
     
-    for msg in messages:
+    formatted_messages = []
+    stale = []
+    for msg in page:
         formatted_messages.append({
+            'id': str(msg.message_id),
             'role': msg.role,
             'content': msg.content,
             'timestamp': msg.timestamp,
-            'formatted_content': markdown2.markdown(
-                msg.content,
-                extras=["fenced-code-blocks", "tables", "strike", "cuddled-lists"]
-            ) if msg.role == 'assistant' else msg.content
+            # Stored HTML; only rows rendered by an older renderer are re-rendered
+            'formatted_content': message_html(msg, stale) if msg.role == 'assistant' else msg.content
         })
     
-    return formatted_messages
+    if stale:
+        Message.objects.bulk_update(stale, ['content_html', 'render_version'])
+    next_cursor = encode_cursor(page[0]) if has_more else None
+    return formatted_messages, next_cursor
+
+
+def get_legacy_chats(user, limit=None):
+    """Most recent legacy Chat rows (oldest-first) with their stored HTML"""
+    limit = limit or getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 30)
+    old_chats = list(Chat.objects.filter(user=user).order_by("-created_at", "-id")[:limit])[::-1]
+    stale = []
+    for chat in old_chats:
+        chat.response = chat_html(chat, stale)
+    if stale:
+        Chat.objects.bulk_update(stale, ['response_html', 'render_version'])
+    return old_chats
 
 # ---------------------------
 #  Chatbot View
@@ -271,72 +307,309 @@ def get_session_messages(session):
 def chatbot_view(request):
     # Get or create session for authenticated users
     session = get_or_create_session(request.user)
-    
-    # Get session messages for display
-    session_messages = get_session_messages(session) if session else []
-    
-    # Keep old chats for backward compatibility (optional)
-    old_chats = []
-    if request.user.is_authenticated:
-        old_chats = Chat.objects.filter(user=request.user).order_by("created_at")
-        for chat in old_chats:
-            chat.response = markdown2.markdown(
-                chat.response,
-                extras=["fenced-code-blocks", "tables", "strike", "cuddled-lists"]
-            )
 
     if request.method == 'POST':
         message = request.POST.get('message')
         
         # Get AI response with conversation history
-        response = ask_openai(message, request.user if request.user.is_authenticated else None, session)
+        try:
+            response, cached, model = ask_openai(
+                message, request.user if request.user.is_authenticated else None, session
+            )
+        except GatewayBusy as busy:
+            return busy_response(busy)
 
-        formatted_response = markdown2.markdown(
-            response,
-            extras=["fenced-code-blocks", "tables", "strike", "cuddled-lists"]
-        )
+        with metrics.span('render'):
+            formatted_response = render_markdown(response)
 
         # Save messages to session if user is authenticated
-        if request.user.is_authenticated and session:
-            # Save user message
-            Message.objects.create(
-                session=session,
-                role='user',
-                content=message
-            )
-            
-            # Save assistant response
-            Message.objects.create(
-                session=session,
-                role='assistant',
-                content=response
-            )
-            
-            # Update session timestamp
-            session.updated_at = timezone.now()
-            session.save()
-            
-            # Also save to old Chat model for backward compatibility
-            Chat.objects.create(
-                user=request.user,
-                message=message,
-                response=response,
-                created_at=timezone.now()
-            )
+        with metrics.span('save'):
+            save_chat_turn(request.user, session, message, response, formatted_response, model=model)
 
         return JsonResponse({
             'message': message, 
             'response': formatted_response,
+            'cached': cached,
+            'model': model,
             'session_id': str(session.session_id) if session else None
         })
 
+    # Only the latest page of the session is rendered; older pages load on scroll
+    session_messages, history_cursor = get_session_messages(session) if session else ([], None)
+    
+    # Keep old chats for backward compatibility (only shown when the session is empty)
+    old_chats = []
+    if request.user.is_authenticated and not session_messages and getattr(settings, 'CHAT_LEGACY_READ', False):
+        old_chats = get_legacy_chats(request.user)
+
     return render(request, 'chatbot.html', {
         'chats': old_chats,  # Keep for backward compatibility
         'session_messages': session_messages,
+        'history_cursor': history_cursor,
+        'session_id': str(session.session_id) if session else None
+    })
+
+
+# ---------------------------
+#  History API (keyset pagination)
+# ---------------------------
+def chat_history(request):
+    """
+    GET older messages of the active session as JSON.
+    ?cursor=<next_cursor from the previous page>&limit=<n>
+    &session=<session_id> reads another session of the user, archived ones included.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'User not authenticated'}, status=401)
+
+    try:
+        limit = min(int(request.GET.get('limit', 0)) or getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 30), 200)
+        session_id = request.GET.get('session')
+        if session_id:
+            session_id = uuid.UUID(session_id)
+            session = ChatSession.objects.filter(user=request.user, session_id=session_id).first()
+            if session is None:
+                return archived_history(request, session_id, limit)
+        else:
+            session = ChatSession.objects.filter(user=request.user, is_active=True).first()
+        history, next_cursor = get_session_messages(session, limit=limit, cursor=request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor, limit or session'}, status=400)
+
+    return JsonResponse({
+        'messages': [
+            {
+                'id': msg['id'],
+                'role': msg['role'],
+                'html': msg['formatted_content'] if msg['role'] == 'assistant' else None,
+                'content': msg['content'],
+                'timestamp': msg['timestamp'].isoformat(),
+            }
+            for msg in history
+        ],
+        'next_cursor': next_cursor,
+        'session_id': str(session.session_id) if session else None,
+    })
+
+
+def archived_history(request, session_id, limit):
+    """chat_history page of a session moved to the archive by `manage.py compact_sessions`"""
+    archived = ArchivedSession.objects.filter(user=request.user, session_id=session_id).first()
+    if archived is None:
+        return JsonResponse({'error': 'Session not found'}, status=404)
+    with metrics.span('archive'):
+        history, next_cursor = archive.archived_messages(archived, limit, cursor=request.GET.get('cursor'))
+    return JsonResponse({
+        'messages': [
+            {
+                'id': msg['id'],
+                'role': msg['role'],
+                'html': msg['content_html'] if msg['role'] == 'assistant' else None,
+                'content': msg['content'],
+                'timestamp': msg['timestamp'].isoformat(),
+            }
+            for msg in history
+        ],
+        'next_cursor': next_cursor,
+        'session_id': str(archived.session_id),
+        'archived': True,
+    })
+
+
+# ---------------------------
+#  Async Chat View (ASGI)
+# ---------------------------
+async def ask_openai_async(message, user=None, session=None):
+    """Async counterpart of ask_openai using the pooled AsyncOpenAI client; returns (answer, cached, model)"""
+    try:
+        messages = await abuild_chat_messages(message, user, session)
+
+        keys = llm_cache.cache_keys(routing.chat_models(), messages) if llm_cache.enabled() else None
+        if keys:
+            answer = await llm_cache.aget(keys)
+            if answer is not None:
+                metrics.count_llm('cached')
+                return answer, True, None
+
+        try:
+            client = get_async_openrouter_client()
+            with metrics.span('llm'):
+                reply = await routing.acomplete(client, messages)
+            answer = reply.content
+            metrics.count_llm('ok', reply.usage)
+            metrics.count_model(reply.model)
+        except GatewayBusy:
+            metrics.count_llm('rejected')
+            raise
+        except Exception as llm_err:
+            metrics.count_llm('error')
+            return f"Error contacting model: {str(llm_err)}", False, None
+        if keys and answer:
+            await llm_cache.aset(llm_cache.cache_key(reply.model, messages), answer)
+        return answer, False, reply.model
+    except GatewayBusy:
+        raise
+    except Exception as e:
+        return f"Error: {str(e)}", False, None
+
+
+async def chatbot_async_view(request):
+    """
+    Same contract as a POST to chatbot_view, but the upstream wait does not
+    pin a worker thread when served through django_chatbot/asgi.py.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    message = request.POST.get('message')
+    if not message:
+        return JsonResponse({'error': 'Message is required'}, status=400)
+
+    user = await request.auser()
+    session = await aget_or_create_session(user)
+    try:
+        response, cached, model = await ask_openai_async(message, user if user.is_authenticated else None, session)
+    except GatewayBusy as busy:
+        return busy_response(busy)
+
+    formatted_response = render_markdown(response)
+    await asave_chat_turn(user, session, message, response, formatted_response, model=model)
+
+    return JsonResponse({
+        'message': message,
+        'response': formatted_response,
+        'cached': cached,
+        'model': model,
         'session_id': str(session.session_id) if session else None
     })
 
 
+# ---------------------------
+#  Streaming Chat View (server-sent events)
+# ---------------------------
+def busy_response(busy):
+    """503 + Retry-After for requests the LLM gateway shed before calling upstream"""
+    response = JsonResponse({'error': str(busy), 'retry_after': busy.retry_after}, status=503)
+    response['Retry-After'] = str(busy.retry_after)
+    return response
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def chatbot_stream(request):
+    """
+    POST a message and receive the reply as server-sent events:
+    `token` events carry text deltas, `done` carries the rendered HTML,
+    `error` reports an upstream failure. The turn is saved when the stream
+    completes or the client disconnects.
+    Async end to end, so under ASGI each token is flushed as it arrives and a
+    disconnect cancels the upstream request.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    message = (request.POST.get('message') or '').strip()
+    if not message:
+        return JsonResponse({'error': 'Message is required'}, status=400)
+
+    # Shed load before committing to a 200 stream (breaker open / queue full)
+    try:
+        get_gateway().admit()
+    except GatewayBusy as busy:
+        return busy_response(busy)
+
+    user = await request.auser()
+    session = await aget_or_create_session(user)
+    session_id = str(session.session_id) if session else None
+
+    async def event_stream():
+        parts = []
+        stream = None
+        formatted_response = None  # set once the reply is complete
+        busy = None
+        model = None
+        started = None
+        try:
+            cached = None
+            try:
+                llm_messages = await abuild_chat_messages(message, user if user.is_authenticated else None, session)
+                keys = llm_cache.cache_keys(routing.chat_models(), llm_messages) if llm_cache.enabled() else None
+                cached = await llm_cache.aget(keys) if keys else None
+                if cached is not None:
+                    metrics.count_llm('cached')
+                    parts.append(cached)
+                    yield sse_event('token', {'token': cached})
+                else:
+                    client = get_async_openrouter_client()
+                    gateway = get_gateway()
+                    # Streams are not hedged (tokens are already on the wire); they go to the fastest model
+                    model = routing.plan()[0][0]
+                    # The slot is held until the stream ends (or the client goes away)
+                    async with gateway.aslot():
+                        started = time.monotonic()
+                        stream = await gateway.acall(lambda: client.chat.completions.create(
+                            model=model,
+                            messages=llm_messages,
+                            timeout=gateway.timeout,
+                            stream=True,
+                            stream_options={"include_usage": True},
+                        ))
+                        usage = None
+                        async for chunk in stream:
+                            # The final chunk carries token usage and no choices
+                            usage = getattr(chunk, 'usage', None) or usage
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                parts.append(delta)
+                                yield sse_event('token', {'token': delta})
+                    # Whole-stream time, comparable with the non-streamed calls routing measures
+                    routing.tracker.observe(model, time.monotonic() - started)
+                    metrics.count_llm('ok', usage)
+                    metrics.count_model(model)
+                    # Only completed streams are cached
+                    if keys and parts:
+                        await llm_cache.aset(llm_cache.cache_key(model, llm_messages), "".join(parts).strip())
+            except GatewayBusy as err:
+                # Shed after the stream started: nothing is saved, the client retries
+                metrics.count_llm('rejected')
+                busy = err
+                yield sse_event('error', {'error': str(err), 'retry_after': err.retry_after})
+                return
+            except Exception as llm_err:
+                metrics.count_llm('error')
+                if started is not None:
+                    routing.tracker.failure(model, time.monotonic() - started, llm_err)
+                # Same behaviour as ask_openai: the error becomes the reply
+                model = None
+                parts = [f"Error contacting model: {str(llm_err)}"]
+                yield sse_event('error', {'error': parts[0]})
+
+            response = "".join(parts).strip()
+            formatted_response = render_markdown(response)
+            yield sse_event('done', {
+                'message': message,
+                'response': formatted_response,
+                'cached': cached is not None,
+                'model': model,
+                'session_id': session_id,
+            })
+        finally:
+            # Runs on completion and on client disconnect (generator closed or cancelled)
+            if stream is not None:
+                await stream.close()
+            if busy is None:
+                await asave_chat_turn(
+                    user, session, message, "".join(parts).strip(), formatted_response, model=model
+                )
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # disable proxy buffering
+    return response
+
+
 # ---------------------------
 #  New Session View
 # ---------------------------
@@ -350,6 +623,7 @@ def start_new_session(request):
     
     # Create new session
     session = ChatSession.objects.create(user=request.user)
+    hot_state.invalidate(request.user.id)
     
     return JsonResponse({
         'session_id': str(session.session_id),
@@ -373,18 +647,18 @@ def test_pdf_processing(request):
         return redirect('login')
     
     try:
-        pdfs = UploadedPDF.objects.filter(user=request.user)
+        pdfs = UploadedPDF.objects.filter(user=request.user, status='ready')
         if pdfs.exists():
             last_pdf = pdfs.last()
-            if last_pdf.faiss_index_path and os.path.exists(last_pdf.faiss_index_path):
-                with open(last_pdf.faiss_index_path, 'r', encoding='utf-8') as f:
-                    chunks_text = f.read()
-                chunks = [chunk.strip() for chunk in chunks_text.split("---CHUNK_SEPARATOR---") if chunk.strip()]
+            chunk_set = chunk_cache.get(last_pdf)
+            if chunk_set is not None:
+                chunks = chunk_set.chunks
                 return JsonResponse({
                     'status': 'success', 
                     'message': f'PDF processing working. Found {len(chunks)} chunks.',
                     'chunks_count': len(chunks),
-                    'first_chunk_preview': chunks[0][:100] if chunks else 'No chunks'
+                    'first_chunk_preview': chunks[0][:100] if chunks else 'No chunks',
+                    'chunk_cache': chunk_cache.stats(),
                 })
             else:
                 return JsonResponse({'status': 'error', 'message': 'No processed PDF found'})
@@ -397,6 +671,7 @@ def test_pdf_processing(request):
 #  PDF Upload View
 # ---------------------------
 def upload_pdf(request):
+    """Store the PDF and queue it for background ingestion; returns without waiting"""
     if request.method == 'POST' and request.FILES.get('pdf'):
         try:
             pdf_file = request.FILES['pdf']
@@ -405,19 +680,65 @@ def upload_pdf(request):
             if not pdf_file.name.lower().endswith('.pdf'):
                 return render(request, 'upload_pdf.html', {'error_message': 'Please upload a PDF file'})
             
-            pdf_obj = UploadedPDF.objects.create(user=request.user, file=pdf_file)
-            process_pdf(pdf_obj)  # extract + embed
+            # Identical bytes already ingested -> ready at once, no job; else extract + index in the background
+            digest = upload_digest(request, 'pdf', pdf_file)
+            with metrics.span('store'):
+                pdf_obj, job = store_upload(request.user, pdf_file, digest)
+
+            if 'application/json' in request.headers.get('Accept', ''):
+                if job is None:
+                    return JsonResponse({'job_id': None, 'pdf_id': pdf_obj.id, 'status': 'ready'}, status=201)
+                return JsonResponse({
+                    'job_id': job.id,
+                    'pdf_id': pdf_obj.id,
+                    'status_url': reverse('ingestion_status', args=[job.id]),
+                }, status=202)
+            if job is None:
+                messages.info(request, f"{pdf_file.name} uploaded and ready (already processed).")
+            else:
+                messages.info(request, f"{pdf_file.name} uploaded. Processing in the background (job {job.id}).")
             return redirect('chatbot')
             
         except Exception as e:
-            # If processing fails, delete the PDF object
+            # If queuing fails, delete the PDF object
             if 'pdf_obj' in locals():
                 pdf_obj.delete()
-            return render(request, 'upload_pdf.html', {'error_message': f'Error processing PDF: {str(e)}'})
+            return render(request, 'upload_pdf.html', {'error_message': f'Error uploading PDF: {str(e)}'})
     
     return render(request, 'upload_pdf.html')
 
 
+# ---------------------------
+#  Ingestion Job Status
+# ---------------------------
+def ingestion_status(request, job_id):
+    """JSON progress of a PDF ingestion job owned by the current user"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'User not authenticated'}, status=401)
+
+    job = IngestionJob.objects.filter(pk=job_id, pdf__user=request.user).first()
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(job_status(job))
+
+
+# ---------------------------
+#  Metrics
+# ---------------------------
+def metrics_view(request):
+    """Prometheus text exposition of this process's metrics"""
+    if not metrics.enabled():
+        return HttpResponse(status=404)
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401)
+    elif not request.user.is_staff:
+        # No scrape token configured: only staff sessions may read the metrics
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # ---------------------------
 #  Authentication
 # ---------------------------
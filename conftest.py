@@ -0,0 +1,10 @@
+# Lets plain pytest (without pytest-django) run the Django test modules, e.g.
+#   SECRET_KEY=... pytest chatbot/test_benchmarks.py
+import os
+
+import django
+
+
+def pytest_configure(config):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_chatbot.settings')
+    django.setup()
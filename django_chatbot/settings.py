@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Server-Timing header + /metrics histograms; removes itself unless METRICS_ENABLED
+    'chatbot.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     *(['whitenoise.middleware.WhiteNoiseMiddleware'] if USE_WHITENOISE else []),
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -147,6 +149,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # ==============================
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
+# Uploads are SHA-256 hashed as they arrive (content-addressed dedup of PDFs)
+FILE_UPLOAD_HANDLERS = [
+    "chatbot.uploads.HashingUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
 # Ensure media directory exists (important on Render ephemeral FS)
 os.makedirs(MEDIA_ROOT, exist_ok=True)
 
@@ -154,8 +163,158 @@ os.makedirs(MEDIA_ROOT, exist_ok=True)
 # OpenRouter API (DeepSeek model)
 # ==============================
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Override to use another OpenAI-compatible server, e.g. the local stub for load
+# tests: `python manage.py run_fake_llm` + LLM_BASE_URL=http://127.0.0.1:8001/v1
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "")
+# Chat models, comma separated; each turn goes to the fastest (EWMA latency) and is
+# hedged to the next-fastest after LLM_HEDGE_DELAY seconds ("p95" = the primary's p95, "off")
+LLM_MODELS = [m.strip() for m in os.getenv("LLM_MODELS", "openai/gpt-4o-mini").split(",") if m.strip()]
+LLM_HEDGE_DELAY = os.getenv("LLM_HEDGE_DELAY", "p95")
+
+# ==============================
+# LLM gateway (per process): concurrency cap, wait queue, retries, circuit breaker
+# ==============================
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Requests waiting for a slot beyond this are answered 503 + Retry-After at once
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "90"))
+# Retries (full-jitter exponential backoff) for connection errors and 429/502/503/504 only
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+LLM_RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX", "8"))
+# Consecutive timeouts / connection errors / 5xx that open the breaker, and seconds until a probe
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
 
 # ==============================
 # Vector DB (FAISS) storage path
 # ==============================
 FAISS_INDEX_PATH = BASE_DIR / "vector_store"
+
+# ==============================
+# Retrieval (BM25 over PDF chunks)
+# ==============================
+# Number of BM25 candidates reranked with sequence similarity (0 disables reranking)
+RAG_RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "10"))
+# Retrieved chunks considered for the prompt, and the token budget they are packed into
+# (overlapping/adjacent chunks are merged first, so repeated overlap costs nothing)
+RAG_CONTEXT_CANDIDATES = int(os.getenv("RAG_CONTEXT_CANDIDATES", "10"))
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "800"))
+
+# Per-worker memory budget (bytes) for parsed chunks + indexes, evicted LRU
+CHUNK_CACHE_MAX_BYTES = int(os.getenv("CHUNK_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# zstd-compress chunk store blocks (smaller files; a block is decompressed per lookup)
+CHUNK_STORE_COMPRESS = os.getenv("CHUNK_STORE_COMPRESS", "False") == "True"
+
+# Users whose merged multi-document index is kept per worker (LRU)
+USER_INDEX_MAX_USERS = int(os.getenv("USER_INDEX_MAX_USERS", "256"))
+
+# "bm25" (inverted index) or "dense" (offline hashing vectors, float32 .npy
+# files under FAISS_INDEX_PATH, memory-mapped and shared via the page cache)
+RAG_RETRIEVER = os.getenv("RAG_RETRIEVER", "bm25")
+VECTOR_DIM = int(os.getenv("VECTOR_DIM", "1024"))
+
+# ==============================
+# PDF ingestion
+# ==============================
+# 'thread': in-process thread pool, 'worker': `manage.py run_ingestion_worker`, 'sync': inline
+INGESTION_MODE = os.getenv("INGESTION_MODE", "thread")
+INGESTION_THREADS = int(os.getenv("INGESTION_THREADS", "1"))
+# Processes used to extract page text of large PDFs (1 = serial), and the page
+# count below which a file is always extracted serially
+INGESTION_PROCESSES = int(os.getenv("INGESTION_PROCESSES", "1"))
+INGESTION_PARALLEL_MIN_PAGES = int(os.getenv("INGESTION_PARALLEL_MIN_PAGES", "64"))
+
+# ==============================
+# LLM HTTP connection pool (shared per process / event loop)
+# ==============================
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "200"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "50"))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+
+# ==============================
+# Conversation history budget
+# ==============================
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# Overflowing turns are folded into the session summary once they reach this size
+HISTORY_SUMMARY_BATCH_TOKENS = int(os.getenv("HISTORY_SUMMARY_BATCH_TOKENS", "500"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "400"))
+
+# Messages rendered on page load / returned per history page
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "30"))
+
+# ==============================
+# Legacy Chat table
+# ==============================
+# Chat history lives in ChatSession/Message; `manage.py migrate_legacy_chats` imports old rows.
+CHAT_LEGACY_DUAL_WRITE = os.getenv("CHAT_LEGACY_DUAL_WRITE", "False") == "True"
+CHAT_LEGACY_READ = os.getenv("CHAT_LEGACY_READ", "False") == "True"
+
+# ==============================
+# Session archive (`manage.py compact_sessions`, run e.g. nightly)
+# ==============================
+# Inactive sessions untouched for this many days move to ArchivedSession (zstd JSON transcripts)
+ARCHIVE_INACTIVE_DAYS = int(os.getenv("ARCHIVE_INACTIVE_DAYS", "30"))
+# Sessions per transaction; each batch commits on its own so a run can stop and resume
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", "10"))
+
+# ==============================
+# Caches
+# ==============================
+# LLM response cache: any Django cache backend (set LLM_CACHE_BACKEND/LOCATION to share it
+# across processes, e.g. django.core.cache.backends.redis.RedisCache)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True") == "True"
+LLM_CACHE_ALIAS = "llm"
+# Key RAG questions on the normalized question + retrieved context, ignoring history
+LLM_CACHE_NORMALIZED = os.getenv("LLM_CACHE_NORMALIZED", "False") == "True"
+
+# Shared cache tier (sessions, auth lookups, per-user hot state): "locmem" (per process,
+# the local stand-in), "file" (a directory shared by the processes of one host) or
+# "redis" (any Redis-compatible server at CACHE_LOCATION; needs the redis package)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "locmem")
+_CACHE_TIERS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'default'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/0'),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': _CACHE_TIERS[CACHE_BACKEND][0],
+        'LOCATION': os.getenv("CACHE_LOCATION", _CACHE_TIERS[CACHE_BACKEND][1]),
+        'TIMEOUT': int(os.getenv("CACHE_TTL", "300")),
+    },
+    'llm': {
+        'BACKEND': os.getenv("LLM_CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("LLM_CACHE_LOCATION", 'llm-responses'),
+        'TIMEOUT': int(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60))),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))},
+    },
+}
+
+# Sessions are read from the cache tier and written through to the DB
+SESSION_ENGINE = os.getenv("SESSION_ENGINE", "django.contrib.sessions.backends.cached_db")
+# Per-request user lookup served from the cache (ModelBackend kept for sessions that
+# logged in before the cached backend existed)
+AUTHENTICATION_BACKENDS = [
+    'chatbot.auth_backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+# Active chat session + ready PDFs per user (chatbot/hot_state.py). Invalidations only
+# reach processes sharing the cache; the TTL bounds staleness with locmem + a separate
+# ingestion worker.
+HOT_STATE_ENABLED = os.getenv("HOT_STATE_ENABLED", "True") == "True"
+HOT_STATE_CACHE_ALIAS = "default"
+HOT_STATE_TTL = int(os.getenv("HOT_STATE_TTL", "300"))
+
+# ==============================
+# Metrics
+# ==============================
+# Server-Timing headers and a Prometheus text endpoint at /metrics/ (off = no overhead)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "False") == "True"
+# When set, /metrics/ requires "Authorization: Bearer <token>"; when empty, only staff users may read it
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")